@@ -1,74 +1,291 @@
-'''Module responsible for routing'''
-from datetime import datetime
-from flask_openapi3 import OpenAPI, Info, Tag
-from flask import redirect
+'''
+    Module responsible for routing. The routes are declared on an
+    APIBlueprint and the application is built by create_app, so importing
+    this module has no side effects. gunicorn and flask run use the
+    factory, and the module attribute app is created on first access:
+
+        gunicorn 'app:create_app()'
+'''
+import os
+import time
+import hashlib
+import tempfile
+from datetime import datetime, timezone, timedelta
+from flask_openapi3 import OpenAPI, APIBlueprint, Info, Tag
+from flask import redirect, request, Response, stream_with_context, json, g, current_app
+from werkzeug.http import http_date, quote_etag
 from unidecode import unidecode
 from sqlalchemy.exc import IntegrityError
 from flask_cors import CORS
-from model import Reminder, Email, EmailClient
-from model import Session
-from logger import logger
+from dotenv import load_dotenv
+from model import Reminder, Email, EmailClient, EmailOutbox
+from model.email_outbox import KIND_CREATED, KIND_UPDATED, KIND_DUE_DATE, STATUS_SENDING, \
+                               queue_notifications, notification_log
+from model.idempotency import claim_key, complete_key, release_key, MAX_KEY_LENGTH
+from model.outbox_worker import outbox_worker
+from model.scheduler import due_date_scheduler
+from model.search import search_reminders, has_search_index
+from model.bulk import bulk_create, bulk_update, bulk_delete, bulk_upsert, DUPLICATE_NAME
+from model import Session, create_session, statement_counter, configure_engine
+from model.reminder_query import reminder_rows, get_reminder_by_id, get_reminder_by_name, \
+                                 get_reminder_version, upcoming_reminders, find_reminder_id
+from model.change_version import current_version
+from model.change_log import check_cursor, changes_since, has_change_log, ExpiredCursor, \
+                             changes_settings, CHANGES_KEEPALIVE
+from model.pagination import keyset_filter, fetch_page, InvalidCursor, STREAM_CHUNK_SIZE
+from logger import logger, configure_logging
+from cache import reminder_cache, configure_cache, CachedView
+from importer import import_reminders, guess_format
+from exporter import export_query, export_reminders, MIMETYPES
+import metrics
 from schemas import *
 
 
 info = Info(title = 'Reminder API', version = '1.0.0')
-app = OpenAPI(__name__, info = info)
-CORS(app)
+api = APIBlueprint('reminders', __name__)
 
 documentation_tag = Tag(name = 'Documentação', description = 'Seleção de documentação: Swagger')
 reminder_tag = Tag(name = 'Lembrete', description = 'Adição, edição, visualização individual ou geral e remoção de lembretes')
+changes_tag = Tag(name = 'Alterações', description = 'Feed de alterações de lembretes para sincronização incremental')
+cache_tag = Tag(name = 'Cache', description = 'Estatísticas do cache de leitura de lembretes')
+metrics_tag = Tag(name = 'Métricas', description = 'Métricas de latência, SQL e SMTP no formato do Prometheus')
 email_tag = Tag(name = 'Envio de Email', description = 'Envia um email de lembrete caso a data estipulada no lembrete esteja próxima')
 
-@app.get('/', tags = [documentation_tag])
+IDEMPOTENT_METHODS = ('POST', 'PUT', 'DELETE')
+FORM_MIMETYPES = ('application/x-www-form-urlencoded', 'multipart/form-data')
+# Files hashed for the Idempotency-Key are copied to disk above this size
+BODY_SPOOL_SIZE = 1024 * 1024
+BODY_CHUNK_SIZE = 64 * 1024
+
+def reset_statement_counter():
+    '''
+        Zera o contador de comandos SQL e marca o início de cada requisição.
+    '''
+    g.request_started = time.perf_counter()
+    statement_counter.reset()
+
+def add_statement_count_header(response):
+    '''
+        Informa no cabeçalho X-SQL-Statements quantos comandos SQL a
+        requisição executou e registra as métricas da rota. Respostas em
+        stream são medidas até o envio dos cabeçalhos.
+    '''
+    response.headers['X-SQL-Statements'] = str(statement_counter.count)
+    # The rule, not the path, keeps one series per route
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.http_requests.inc(request.method, route, response.status_code)
+    metrics.http_request_duration.observe(time.perf_counter() - g.request_started,
+                                          request.method, route)
+    metrics.sql_statements_per_request.observe(statement_counter.count, request.method, route)
+    metrics.sql_duration_per_request.observe(statement_counter.seconds, request.method, route)
+    return response
+
+def hash_file(digest, stream) -> None:
+    '''
+        Atualiza o hash com o conteúdo de um arquivo já recebido, lido em
+        partes, e volta ao início para que a rota o leia.
+    '''
+    for chunk in iter(lambda: stream.read(BODY_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    stream.seek(0)
+
+def request_fingerprint() -> str:
+    '''
+        Hash da query string e do corpo da requisição: campos e arquivos do
+        formulário, JSON ou, nos demais casos (arquivos enviados a
+        /import), o corpo, copiado para um arquivo temporário enquanto é
+        lido, do qual a rota passa a ler.
+    '''
+    digest = hashlib.sha256(request.query_string)
+    if request.mimetype in FORM_MIMETYPES:
+        for name, value in sorted(request.form.items(multi = True)):
+            digest.update(f'{name}={value}\n'.encode())
+        for name, upload in sorted(request.files.items(multi = True), key = lambda item: item[0]):
+            digest.update(f'{name}={upload.filename}\n'.encode())
+            hash_file(digest, upload.stream)
+    elif request.is_json:
+        digest.update(request.get_data(cache = True))
+    else:
+        body = tempfile.SpooledTemporaryFile(max_size = BODY_SPOOL_SIZE)
+        for chunk in iter(lambda: request.stream.read(BODY_CHUNK_SIZE), b''):
+            body.write(chunk)
+        body.seek(0)
+        hash_file(digest, body)
+        request.stream = body
+    return digest.hexdigest()
+
+def check_idempotency_key():
+    '''
+        Com o cabeçalho Idempotency-Key em uma rota de escrita, reserva a
+        chave para esta requisição ou, se ela já foi usada, devolve a
+        resposta salva sem executar a rota novamente.
+    '''
+    key = request.headers.get('Idempotency-Key')
+    if request.method not in IDEMPOTENT_METHODS or not key:
+        return None
+    if len(key) > MAX_KEY_LENGTH:
+        return {'mensagem': f'A Idempotency-Key deve ter no máximo {MAX_KEY_LENGTH} caracteres.'}, 400
+
+    fingerprint = request_fingerprint()
+    # The key has its own session, independent of the route's transaction
+    with create_session() as session:
+        saved = claim_key(session, key, request.method, request.path, fingerprint)
+    if saved is None:
+        g.idempotency_key = key
+        return None
+    if (saved.method, saved.path, saved.fingerprint) != (request.method, request.path, fingerprint):
+        logger.warning('Idempotency-Key %s reutilizada em outra requisição', key)
+        return {'mensagem': 'Idempotency-Key já usada em uma requisição diferente.'}, 422
+    if saved.status_code is None:
+        return {'mensagem': 'Uma requisição com esta Idempotency-Key ainda está em andamento.'}, 409
+    logger.debug('Repetindo a resposta da Idempotency-Key %s', key)
+    response = Response(saved.response_body, status = saved.status_code,
+                        content_type = saved.content_type)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def save_idempotent_response(response):
+    '''
+        Salva a resposta da requisição que reservou a Idempotency-Key. Erros
+        do servidor liberam a chave, para que a requisição possa ser repetida.
+    '''
+    key = g.pop('idempotency_key', None)
+    if key is None:
+        return response
+    if not response.is_streamed:
+        # What the route left uncommitted is discarded, and ending its
+        # transaction releases the SQLite write lock for the key's session
+        Session().rollback()
+    with create_session() as session:
+        if response.status_code >= 500 or response.is_streamed:
+            release_key(session, key)
+        else:
+            complete_key(session, key, response.status_code, response.content_type,
+                         response.get_data())
+    return response
+
+def remove_session(exception = None):
+    '''
+        Libera a sessão do banco ao final de cada requisição, desfazendo
+        alterações não confirmadas e devolvendo a conexão ao pool.
+    '''
+    Session.remove()
+
+def reminder_validators(reminder_id: int, updated_at: datetime, created_at: datetime):
+    '''
+        Retorna o ETag forte, derivado do id e da data de alteração, e o
+        Last-Modified de um lembrete.
+    '''
+    modified = updated_at or created_at
+    if not modified:
+        return f'r{reminder_id}-0', None
+    return f'r{reminder_id}-{modified:%Y%m%d%H%M%S%f}', modified.astimezone(timezone.utc)
+
+def validator_headers(etag: str, last_modified: datetime = None) -> dict:
+    '''
+        Cabeçalhos ETag e Last-Modified de uma resposta.
+    '''
+    headers = {'ETag': quote_etag(etag)}
+    if last_modified:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+def is_not_modified(etag: str, last_modified: datetime = None) -> bool:
+    '''
+        Verifica se a requisição condicional (If-None-Match ou, na ausência
+        dele, If-Modified-Since) permite responder 304.
+    '''
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified.replace(microsecond = 0) <= request.if_modified_since
+    return False
+
+def not_modified(etag: str, last_modified: datetime = None):
+    '''
+        Resposta 304, sem corpo.
+    '''
+    return '', 304, validator_headers(etag, last_modified)
+
+def cached_view_response(view: CachedView):
+    '''
+        Resposta a partir de uma visualização em cache, respeitando as
+        requisições condicionais.
+    '''
+    if is_not_modified(view.etag, view.last_modified):
+        return not_modified(view.etag, view.last_modified)
+    return Response(view.body, 200, validator_headers(view.etag, view.last_modified),
+                    mimetype = 'application/json')
+
+def cache_reminder_view(reminder: Reminder, generation: int = None):
+    '''
+        Serializa a visualização do lembrete, salva no cache de leitura e
+        retorna a resposta. generation é a geração do lembrete no cache lida
+        antes de carregá-lo do banco; sem ela, a visualização não é salva.
+    '''
+    etag, last_modified = reminder_validators(reminder.id, reminder.updated_at, reminder.created_at)
+    view = CachedView(etag, last_modified, json.dumps(show_reminder(reminder)))
+    reminder_cache.set(reminder.id, reminder.name_normalized, view, generation)
+    return cached_view_response(view)
+
+@api.get('/', tags = [documentation_tag])
 def documentation():
     '''
         Redireciona para openapi, com a documentação das rotas da API.
     '''
     return redirect('/openapi')
 
-@app.post('/create', tags = [reminder_tag],
+@api.post('/create', tags = [reminder_tag],
         responses = {'200': ReminderViewSchema,
                      '409': ErrorSchema,
                      '400': ErrorSchema})
-def create(form: ReminderSchema):
+def create(query: ReminderUpsertQuerySchema, form: ReminderSchema):
     '''
-        Persiste um novo lembrete no banco de dados.
+        Persiste um novo lembrete no banco de dados. Com upsert=true, um
+        lembrete de mesmo nome é atualizado com os valores enviados, ou
+        mantido sem escrita se já os tiver; sem upsert, um nome duplicado
+        retorna 409.
     '''
+    session = Session()
+    if query.upsert:
+        return upsert_reminder(session, form)
+
+    # Cheap lookup on the unique index: a duplicate is rejected before the
+    # reminder is built and a transaction fails
+    if find_reminder_id(session, unidecode(form.name.lower())) is not None:
+        logger.warning('Erro ao adicionar lembrete %s - %s', form.name, DUPLICATE_NAME)
+        return {'mensagem': DUPLICATE_NAME}, 409
+
     reminder = Reminder(
         name = form.name,
         description = form.description,
         due_date = datetime.strptime(form.due_date, '%Y-%m-%dT%H:%M:%S.%fZ'),
         send_email = form.send_email,
-        recurring = form.recurring)
+        recurring = form.recurring,
+        recurrence = form.recurrence,
+        recurrence_interval = form.recurrence_interval)
 
     logger.debug('Adicionando um lembrete de nome: %s', reminder.name)
     try:
         reminder.insert_email(Email(form.email))
-        session = Session()
         session.add(reminder)
         logger.debug('Adicionado lembrete de nome: %s', reminder.name)
 
         if reminder.validate_email_before_send():
-            #Sending email if has an email and send_email is True
-            email_receiver = reminder.email_relationship[0].email
-            due_date_adjusted = reminder.due_date.strftime('%d/%m/%Y')
-            email_client = EmailClient(
-                reminder.name,
-                reminder.description,
-                due_date_adjusted,
-                email_receiver
-                )
-            email_client.prepare_and_send_email(flag_create = True)
-        # After email validation and sending or not, commit changes
+            #Queueing email if has an email and send_email is True
+            session.flush()
+            queue_notifications(session, [EmailOutbox.for_reminder(reminder, KIND_CREATED).values()])
+        # Reminder and queued email are saved in the same transaction
         session.commit()
+        outbox_worker.notify()
 
         return show_reminder(reminder), 200
 
     except IntegrityError:
-        error_msg = 'Lembrete de mesmo nome já salvo na base :/'
-        logger.warning('Erro ao adicionar lembrete %s - %s', reminder.name, error_msg)
+        # A reminder of the same name was created after the lookup
+        logger.warning('Erro ao adicionar lembrete %s - %s', reminder.name, DUPLICATE_NAME)
 
-        return {'mensagem': error_msg}, 409
+        return {'mensagem': DUPLICATE_NAME}, 409
 
     except Exception as error:
         error_msg = 'Ocorreu um erro ao salvar o lembrete na base'
@@ -77,7 +294,26 @@ def create(form: ReminderSchema):
 
         return {'mensagem': error_msg}, 400
 
-@app.get('/reminder', tags = [reminder_tag],
+def upsert_reminder(session, form: ReminderSchema):
+    '''
+        Cria ou atualiza, pelo nome, o lembrete enviado a /create com
+        upsert=true, e retorna a sua representação.
+    '''
+    rows, errors = parse_reminder_items([(0, form.dict())])
+    if errors:
+        return {'mensagem': errors[0]['mensagem']}, 400
+    written, unchanged, errors = bulk_upsert(session, rows)
+    if errors:
+        return {'mensagem': errors[0]['mensagem']}, 409
+    if written:
+        reminder_cache.invalidate(*written)
+        outbox_worker.notify()
+        logger.debug('Lembrete %s gravado por upsert', form.name)
+    else:
+        logger.debug('Lembrete %s já atualizado', form.name)
+    return show_reminder(get_reminder_by_id(session, (written or unchanged)[0])), 200
+
+@api.get('/reminder', tags = [reminder_tag],
         responses = {'200': ReminderViewSchema, '404': ErrorSchema})
 def get_reminder(query: ReminderSearchSchema):
     '''
@@ -86,21 +322,29 @@ def get_reminder(query: ReminderSearchSchema):
     reminder_id = query.id
     logger.info('Coletando dados sobre o lembrete # %s', reminder_id)
 
-    try:
-        session = Session()
-        reminder = session.query(Reminder).filter(Reminder.id == reminder_id).first()
-        logger.info('reminder: %s', reminder.name)
-    except Exception as error:
+    view, generation = reminder_cache.get_by_id(reminder_id)
+    if view is not None:
+        return cached_view_response(view)
+
+    session = Session()
+    version = get_reminder_version(session, Reminder.id == reminder_id)
+    if not version:
         error_msg = 'O lembrete buscado não existe.'
-        logger.debug('Exceção : %s', error)
         logger.warning('Erro ao buscar lembrete %s : %s', reminder_id, error_msg)
 
         return {'mensagem': error_msg}, 404
+
+    # Unchanged reminder: answer 304 without loading or serializing it
+    etag, last_modified = reminder_validators(*version)
+    if is_not_modified(etag, last_modified):
+        return not_modified(etag, last_modified)
+
+    reminder = get_reminder_by_id(session, reminder_id)
     logger.debug('Lembrete econtrado: %s', reminder.name)
 
-    return show_reminder(reminder), 200
+    return cache_reminder_view(reminder, generation)
 
-@app.get('/reminder_name', tags = [reminder_tag],
+@api.get('/reminder_name', tags = [reminder_tag],
         responses = {'200': ReminderViewSchema, '404': ErrorSchema})
 def get_reminder_name(query: ReminderSearchByNameSchema):
     '''
@@ -109,42 +353,208 @@ def get_reminder_name(query: ReminderSearchByNameSchema):
     reminder_name = query.name
     logger.info('Coletando dados sobre o lembrete # %s', reminder_name)
 
-    session = Session()
     name_normalized = unidecode(reminder_name.lower())
-    reminder = session.query(Reminder).filter(Reminder.name_normalized == name_normalized).first()
+    cached_id = reminder_cache.get_id_by_name(name_normalized)
+    generation = None
+    if cached_id is not None:
+        view, generation = reminder_cache.get_by_id(cached_id)
+        # The reminder may have been renamed since the name was cached
+        if view is not None and json.loads(view.body)['name_normalized'] == name_normalized:
+            return cached_view_response(view)
+
+    session = Session()
+    version = get_reminder_version(session, Reminder.name_normalized == name_normalized)
 
     error_msg = 'O lembrete buscado não existe.'
-    if not reminder:
+    if not version:
         logger.warning('Erro ao buscar lembrete %s - %s', reminder_name, error_msg)
         return {'mensagem': error_msg}, 404
 
-    logger.debug('Lembrete encontrado: %s', reminder.name)
-    return show_reminder(reminder), 200
+    etag, last_modified = reminder_validators(*version)
+    if is_not_modified(etag, last_modified):
+        return not_modified(etag, last_modified)
 
-@app.get('/reminders', tags = [reminder_tag],
-         responses = {'200': RemindersListSchema, '404': ErrorSchema})
-def get_all_reminders():
+    reminder = get_reminder_by_name(session, name_normalized)
+    logger.debug('Lembrete encontrado: %s', reminder.name)
+    # The generation read applies only to the reminder cached under the name
+    if reminder.id != cached_id:
+        generation = None
+    return cache_reminder_view(reminder, generation)
+
+@api.get('/reminders', tags = [reminder_tag],
+         responses = {'200': RemindersListSchema, '400': ErrorSchema})
+def get_all_reminders(query: ReminderListQuerySchema):
     '''
-        Retorna todos os lembretes salvos no banco de dados.
+        Retorna os lembretes salvos no banco de dados, paginados por cursor.
+        O campo next_cursor da resposta deve ser enviado como cursor para
+        obter a próxima página. Com stream=true, todos os lembretes a partir
+        do cursor são enviados em partes, sem paginação.
     '''
-    logger.debug('Retornando todos os lembretes')
+    logger.debug('Retornando lembretes a partir do cursor: %s', query.cursor)
     session = Session()
-    reminders = session.query(Reminder).all()
+    # The table version changes on every write, so together with the query
+    # string it identifies the response without reading any reminder
+    version, last_modified = current_version(session)
+    headers = {}
+    if version is not None:
+        query_hash = hashlib.sha1(request.query_string).hexdigest()[:16]
+        etag = f'v{version}-{query_hash}'
+        if is_not_modified(etag, last_modified):
+            return not_modified(etag, last_modified)
+        headers = validator_headers(etag, last_modified)
 
-    if not reminders:
-        return {'Lembretes': []}, 200
+    try:
+        # Plain column tuples, encoded straight to JSON, skip the ORM
+        # hydration that the list would only copy into dicts
+        if query.stream:
+            reminders = keyset_filter(reminder_rows(session), query.cursor, query.order_by) \
+                .yield_per(STREAM_CHUNK_SIZE)
+            # Validates the cursor before the response starts streaming
+            rows = iter(reminders)
+        else:
+            reminders, next_cursor = fetch_page(
+                reminder_rows(session), query.cursor, query.page_size, query.order_by)
+    except InvalidCursor:
+        session.close()
+        error_msg = 'Cursor de paginação inválido.'
+        logger.warning('Erro ao listar lembretes - %s', error_msg)
+        return {'mensagem': error_msg}, 400
+
+    if query.stream:
+        def generate():
+            try:
+                yield from stream_reminders(rows)
+            finally:
+                session.close()
+        return Response(stream_with_context(generate()), headers = headers,
+                        mimetype = 'application/json')
+
+    logger.debug('%d lembretes encontrados', len(reminders))
+    return Response(dump_reminder_rows(reminders, next_cursor), headers = headers,
+                    mimetype = 'application/json')
 
+@api.get('/reminders/search', tags = [reminder_tag],
+         responses = {'200': RemindersListSchema, '501': ErrorSchema})
+def search(query: ReminderFullTextSearchSchema):
+    '''
+        Busca lembretes pelo nome e descrição, sem diferenciar acentos e
+        maiúsculas, ordenados por relevância. Com prefix=true (padrão), cada
+        palavra buscada pode ser apenas o início de uma palavra do lembrete.
+    '''
+    logger.debug('Buscando lembretes por: %s', query.q)
+    session = Session()
+    if not has_search_index(session.get_bind()):
+        error_msg = 'A busca textual está disponível apenas com o banco SQLite.'
+        logger.warning('Busca de lembretes - %s', error_msg)
+        return {'mensagem': error_msg}, 501
+    reminders = search_reminders(session, query.q, query.limit, query.prefix)
     logger.debug('%d lembretes encontrados', len(reminders))
+
     return show_reminders(reminders), 200
 
-@app.put('/update', tags = [reminder_tag],
+@api.get('/reminders/upcoming', tags = [reminder_tag],
+         responses = {'200': RemindersUpcomingSchema, '400': ErrorSchema})
+def get_upcoming_reminders(query: ReminderUpcomingQuerySchema):
+    '''
+        Retorna os lembretes com a próxima ocorrência dentro da janela
+        informada (por padrão, os próximos 7 dias), em ordem de ocorrência.
+        Lembretes recorrentes aparecem com a próxima ocorrência, mantida
+        pelo agendador.
+    '''
+    start = query.start or datetime.now()
+    end = query.end or start + timedelta(days = 7)
+    if end < start:
+        return {'mensagem': 'O fim da janela deve ser posterior ao início.'}, 400
+
+    logger.debug('Buscando ocorrências entre %s e %s', start, end)
+    session = Session()
+    rows = upcoming_reminders(session, start, end, query.limit)
+    body = dumps({'reminders': [show_reminder_row(row) for row in rows]})
+    return Response(body, mimetype = 'application/json')
+
+def change_events(session, since: int, limit: int):
+    '''
+        Gera as alterações posteriores ao cursor como server-sent events,
+        um evento por página, com o cursor no campo id. Sem alterações,
+        envia um comentário a cada CHANGES_KEEPALIVE segundos para manter a
+        conexão, e termina após CHANGES_STREAM_TIMEOUT segundos; o cliente
+        reconecta com o cabeçalho Last-Event-ID.
+    '''
+    settings = changes_settings()
+    started = last_sent = time.monotonic()
+    try:
+        while time.monotonic() - started < settings['stream_timeout']:
+            changes, rows = changes_since(session, since, limit)
+            # Ends the read, so the connection goes back to the pool while waiting
+            session.commit()
+            if changes:
+                page = show_changes(changes, rows, since, limit)
+                since = page['next_cursor']
+                yield b'id: %d\nevent: changes\ndata: %s\n\n' % (since, dumps(page))
+                last_sent = time.monotonic()
+                if page['has_more']:
+                    continue
+            elif time.monotonic() - last_sent >= CHANGES_KEEPALIVE:
+                yield b': keepalive\n\n'
+                last_sent = time.monotonic()
+            time.sleep(settings['poll_interval'])
+    finally:
+        session.close()
+
+@api.get('/changes', tags = [changes_tag],
+         responses = {'200': ChangesSchema, '410': ErrorSchema, '501': ErrorSchema})
+def get_changes(query: ChangesQuerySchema):
+    '''
+        Retorna os lembretes criados, alterados ou removidos depois do
+        cursor since, uma vez cada, com o estado atual ou deleted=true, para
+        que os clientes sincronizem apenas as diferenças em vez de listar
+        /reminders. Com wait, espera até wait segundos por uma alteração
+        (long polling); com stream=true ou Accept: text/event-stream, envia
+        as alterações como server-sent events. Um cursor anterior a
+        remoções já descartadas retorna 410, e o cliente deve sincronizar
+        novamente a partir do cursor 0.
+    '''
+    since = query.since
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    if last_event_id.isdigit():
+        since = int(last_event_id)
+
+    session = Session()
+    if not has_change_log(session.get_bind()):
+        error_msg = 'O feed de alterações está disponível apenas com o banco SQLite.'
+        logger.warning('Feed de alterações - %s', error_msg)
+        return {'mensagem': error_msg}, 501
+    try:
+        check_cursor(session, since)
+    except ExpiredCursor:
+        error_msg = 'Cursor expirado, sincronize novamente a partir do cursor 0.'
+        logger.info('Feed de alterações - %s (%d)', error_msg, since)
+        return {'mensagem': error_msg}, 410
+
+    if query.stream or request.accept_mimetypes.best == 'text/event-stream':
+        return Response(stream_with_context(change_events(session, since, query.limit)),
+                        mimetype = 'text/event-stream',
+                        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    poll_interval = changes_settings()['poll_interval']
+    deadline = time.monotonic() + query.wait
+    changes, rows = changes_since(session, since, query.limit)
+    while not changes and time.monotonic() < deadline:
+        # Ends the read, so the connection goes back to the pool while waiting
+        session.commit()
+        time.sleep(min(poll_interval, max(deadline - time.monotonic(), 0)))
+        changes, rows = changes_since(session, since, query.limit)
+    body = dumps(show_changes(changes, rows, since, query.limit))
+    return Response(body, mimetype = 'application/json')
+
+@api.put('/update', tags = [reminder_tag],
          responses = {'200': ReminderViewSchema, '404': ErrorSchema})
 def update(form: ReminderUpdateSchema):
     '''
         Atualiza um lembrete pelo id.
     '''
     session = Session()
-    reminder = session.query(Reminder).filter(Reminder.id == form.id).first()
+    reminder = get_reminder_by_id(session, form.id)
 
     logger.debug('Alterando um lembrete de nome: %s', reminder.name)
     try:
@@ -154,24 +564,22 @@ def update(form: ReminderUpdateSchema):
         reminder.due_date = form.due_date or reminder.due_date
         reminder.send_email = form.send_email
         reminder.email_relationship[0].email = form.email
-        reminder.recurring = form.recurring
+        reminder.recurrence = form.recurrence
+        reminder.recurrence_interval = form.recurrence_interval
+        reminder.recurring = form.recurring or bool(form.recurrence)
+        reminder.schedule()
         reminder.updated_at = datetime.now()
 
         logger.debug('Lembrete atualizado, nome: %s', reminder.name)
 
         if reminder.validate_email_before_send():
-            #Sending email if has an email and send_email is True
-            email_receiver = reminder.email_relationship[0].email
-            due_date_adjusted = reminder.due_date.strftime('%d/%m/%Y')
-            email_client = EmailClient(
-                reminder.name,
-                reminder.description,
-                due_date_adjusted,
-                email_receiver
-                )
-            email_client.prepare_and_send_email(flag_update = True)
-        # After email validation and sending or not, commit changes
+            #Queueing email if has an email and send_email is True
+            # Repeating the same change does not queue the same email again
+            queue_notifications(session, [EmailOutbox.for_reminder(reminder, KIND_UPDATED).values()])
+        # Reminder and queued email are saved in the same transaction
         session.commit()
+        reminder_cache.invalidate(reminder.id)
+        outbox_worker.notify()
 
         return show_reminder(reminder), 200
 
@@ -180,7 +588,7 @@ def update(form: ReminderUpdateSchema):
         logger.info(' %s : %s', error_msg, error)
         return {'mensagem': error_msg}, 400
 
-@app.delete('/delete', tags = [reminder_tag],
+@api.delete('/delete', tags = [reminder_tag],
             responses = {'200': ReminderDeleteSchema, '404': ErrorSchema})
 def delete_reminder(query: ReminderSearchSchema):
     '''
@@ -196,6 +604,7 @@ def delete_reminder(query: ReminderSearchSchema):
         reminder = reminder_query.first()
         reminder_query.delete()
         session.commit()
+        reminder_cache.invalidate(reminder_id)
     except:
         error_msg = 'Lembrete não encontrado :/'
         logger.warning('Erro ao deletar lembrete # %d - %s', reminder_id, error_msg)
@@ -204,8 +613,129 @@ def delete_reminder(query: ReminderSearchSchema):
     logger.debug('Lembrete # %d removido com sucesso.', reminder_id)
     return {'mensagem': 'Lembrete removido', 'nome': reminder.name}
 
-@app.get('/send_email', tags = [email_tag],
-         responses = {'200': EmailSentSchema, '404': ErrorSchema})
+@api.post('/reminders/bulk', tags = [reminder_tag],
+          responses = {'200': ReminderBulkResultSchema})
+def create_reminders_bulk(query: ReminderUpsertQuerySchema, body: ReminderBulkSchema):
+    '''
+        Persiste uma lista de lembretes, no mesmo formato da rota /create,
+        em transações por blocos. Itens inválidos ou com nome duplicado são
+        informados em errors sem impedir a gravação dos demais. Com
+        upsert=true, lembretes de mesmo nome são atualizados, e os que já
+        têm os valores enviados são listados em unchanged, sem escrita.
+    '''
+    items = body.__root__
+    logger.debug('Adicionando %d lembretes em lote', len(items))
+    rows, errors = parse_reminder_items(enumerate(items))
+
+    session = Session()
+    if query.upsert:
+        written, unchanged, write_errors = bulk_upsert(session, rows)
+        reminder_cache.invalidate(*written)
+        errors = sorted(errors + write_errors, key = lambda error: error['index'])
+        outbox_worker.notify()
+        logger.debug('%d lembretes gravados por upsert, %d inalterados, %d erros',
+                     len(written), len(unchanged), len(errors))
+        return {'total': len(items), 'ids': written, 'errors': errors,
+                'unchanged': unchanged}, 200
+
+    created, write_errors = bulk_create(session, rows)
+    errors = sorted(errors + write_errors, key = lambda error: error['index'])
+    outbox_worker.notify()
+    logger.debug('%d lembretes adicionados em lote, %d erros', len(created), len(errors))
+
+    return {'total': len(items), 'ids': created, 'errors': errors}, 200
+
+@api.get('/export', tags = [reminder_tag])
+def export_reminders_file(query: ReminderExportQuerySchema):
+    '''
+        Exporta os lembretes, com o email, em NDJSON ou CSV, opcionalmente
+        filtrados por intervalo de data final (due_from, due_to) ou pelos
+        criados ou alterados desde updated_since. A resposta é enviada em
+        stream, sem montar o arquivo em memória, e pode ser reimportada pela
+        rota /import.
+    '''
+    logger.debug('Exportando lembretes em %s', query.format)
+    session = Session()
+    rows = export_query(session, query.due_from, query.due_to, query.updated_since)
+
+    def generate():
+        try:
+            yield from export_reminders(rows, query.format)
+        finally:
+            session.close()
+    headers = {'Content-Disposition': f'attachment; filename=reminders.{query.format}'}
+    return Response(stream_with_context(generate()), headers = headers,
+                    mimetype = MIMETYPES[query.format])
+
+@api.post('/import', tags = [reminder_tag],
+          responses = {'200': ReminderImportResultSchema, '400': ErrorSchema})
+def import_reminders_file(query: ReminderImportQuerySchema):
+    '''
+        Importa lembretes de um arquivo NDJSON ou CSV, com os campos da rota
+        /create, enviado como corpo da requisição ou no campo file de um
+        formulário. O arquivo é lido em stream e gravado em blocos de
+        chunk_size linhas; linhas inválidas ou com nome duplicado são
+        informadas no resumo sem impedir a gravação das demais.
+    '''
+    upload = request.files.get('file')
+    if upload:
+        stream, filename, content_type = upload.stream, upload.filename, upload.content_type
+    else:
+        stream, filename, content_type = request.stream, None, request.content_type
+    file_format = query.format or guess_format(filename, content_type)
+    logger.debug('Importando lembretes em %s', file_format)
+
+    session = Session()
+    summary = import_reminders(session, stream, file_format, query.chunk_size)
+    outbox_worker.notify()
+    return summary, 200
+
+@api.put('/reminders/bulk', tags = [reminder_tag],
+         responses = {'200': ReminderBulkResultSchema})
+def update_reminders_bulk(body: ReminderBulkSchema):
+    '''
+        Atualiza uma lista de lembretes pelo id, no mesmo formato da rota
+        /update. Apenas os campos enviados em cada item são alterados.
+    '''
+    items = body.__root__
+    logger.debug('Alterando %d lembretes em lote', len(items))
+    valid, errors = validate_bulk_items(ReminderUpdateSchema, items)
+    fields = ('id', 'name', 'description', 'due_date', 'send_email', 'email', 'recurring',
+              'recurrence', 'recurrence_interval')
+    rows = []
+    for index, form in valid:
+        values = form.dict(include = set(fields), exclude_unset = True)
+        if 'id' not in values:
+            errors.append({'index': index, 'mensagem': 'O id do lembrete é obrigatório'})
+            continue
+        rows.append((index, values))
+
+    session = Session()
+    updated, write_errors = bulk_update(session, rows)
+    reminder_cache.invalidate(*updated)
+    errors = sorted(errors + write_errors, key = lambda error: error['index'])
+    outbox_worker.notify()
+    logger.debug('%d lembretes alterados em lote, %d erros', len(updated), len(errors))
+
+    return {'total': len(items), 'ids': updated, 'errors': errors}, 200
+
+@api.delete('/reminders/bulk', tags = [reminder_tag],
+            responses = {'200': ReminderBulkResultSchema})
+def delete_reminders_bulk(body: ReminderBulkDeleteSchema):
+    '''
+        Remove uma lista de lembretes pelo id.
+    '''
+    ids = body.__root__
+    logger.debug('Deletando %d lembretes em lote', len(ids))
+    session = Session()
+    deleted, errors = bulk_delete(session, ids)
+    reminder_cache.invalidate(*[reminder['id'] for reminder in deleted])
+    logger.debug('%d lembretes removidos em lote, %d erros', len(deleted), len(errors))
+
+    return {'total': len(ids), 'ids': [reminder['id'] for reminder in deleted], 'errors': errors}, 200
+
+@api.get('/send_email', tags = [email_tag],
+         responses = {'200': EmailSentSchema, '202': EmailSentSchema, '404': ErrorSchema})
 def validate_send_email(query: ReminderSearchSchema):
     '''
         Esta rota envia um email com as informações do lembrete, ao email cadastrado.
@@ -213,14 +743,48 @@ def validate_send_email(query: ReminderSearchSchema):
         1) Email cadastrado no lembrete,
         2) Boolean send_email como True,
         3) Lembrete a 1 dia ou menos de alcançar a data final (due_date).
+        Com ASYNC_EMAIL=1 o email é colocado na fila de envio e a rota
+        responde 202 sem esperar o servidor SMTP.
+        Cada ocorrência é notificada uma única vez, por esta rota ou pelo
+        agendador; chamadas repetidas apenas informam que o email já foi
+        enviado ou agendado.
     '''
     session = Session()
-    reminder = session.query(Reminder).filter(Reminder.id == query.id).first()
+    reminder = get_reminder_by_id(session, query.id)
     send_email: bool = reminder.validate_email_before_send()
 
     if send_email and reminder.validate_due_date():
         email_receiver = reminder.email_relationship[0].email
-        due_date_adjusted = reminder.due_date.strftime('%d/%m/%Y')
+        occurrence = reminder.next_due_at or reminder.due_date
+        # Conditional update, as in the scheduler: only one request (or
+        # scheduler run) claims the occurrence, before any email is built
+        claimed = session.query(Reminder) \
+            .filter(Reminder.id == reminder.id,
+                    (Reminder.notified_due_date.is_(None)) |
+                    (Reminder.notified_due_date != occurrence)) \
+            .update({'notified_due_date': occurrence}, synchronize_session = False)
+        outbox = EmailOutbox.for_reminder(reminder, KIND_DUE_DATE)
+        if not current_app.config['ASYNC_EMAIL']:
+            # Logged as being sent, so that a failure is retried by the worker
+            outbox.status = STATUS_SENDING
+        notified = not claimed
+        if claimed:
+            session.add(outbox)
+            try:
+                session.commit()
+            except IntegrityError:
+                # The occurrence is already in the notification log
+                notified = True
+        if notified:
+            session.rollback()
+            logger.debug('Prazo final do lembrete # %d já notificado', reminder.id)
+            return {'mensagem': f'O email do prazo final deste lembrete já foi enviado ou agendado para o destinatário: {email_receiver}'}, 200
+        if current_app.config['ASYNC_EMAIL']:
+            # The request thread is released at once; the outbox worker waits
+            # on the SMTP server instead
+            outbox_worker.notify()
+            return {'mensagem': f'Email avisando do prazo final do lembrete agendado para o destinatário: {email_receiver}'}, 202
+        due_date_adjusted = occurrence.strftime('%d/%m/%Y')
         email_client = EmailClient(
             reminder.name,
             reminder.description,
@@ -229,13 +793,104 @@ def validate_send_email(query: ReminderSearchSchema):
             )
         try:
             email_client.prepare_and_send_email(flag_due_date = True)
+            outbox_worker.record_result(outbox, None)
+            session.commit()
             return {'mensagem': f'Email avisando do prazo final do lembrete enviado para o destinatário: {email_receiver}'}, 200
         except Exception as error:
             logger.warning('Erro ao validar e enviar email para lembrete# %d - erro : %s', reminder.id, error)
-            return {'mensagem': 'Ocorreu um erro ao enviar o email.'}, 404
+            outbox_worker.record_result(outbox, error)
+            session.commit()
+            return {'mensagem': 'Ocorreu um erro ao enviar o email; uma nova tentativa foi agendada.'}, 404
     else:
         if not reminder.email_relationship[0].email:
             return {'mensagem': 'O lembrete não possui email cadastrado'}, 200
         if not reminder.send_email:
             return {'mensagem': 'O usuário optou por não receber email.'}, 200
         return {'mensagem': f'A data do lembrete é {reminder.due_date} e, portanto, superior à 1 dia a data atual'}, 200
+
+@api.get('/notifications', tags = [email_tag],
+         responses = {'200': NotificationsListSchema})
+def get_notifications(query: NotificationQuerySchema):
+    '''
+        Retorna o registro de notificações, das mais recentes para as mais
+        antigas, com a situação de cada envio (pending, sending, sent ou
+        failed), o número de tentativas e o último erro. Pode ser filtrado
+        por lembrete, tipo (created, updated, due_date, digest) e situação.
+    '''
+    session = Session()
+    notifications = notification_log(session, query.reminder_id, query.kind, query.status,
+                                     query.limit)
+    return {'notifications': [show_notification(outbox) for outbox in notifications]}, 200
+
+@api.get('/cache_stats', tags = [cache_tag],
+         responses = {'200': CacheStatsSchema})
+def cache_stats():
+    '''
+        Retorna os contadores de acertos, falhas e invalidações do cache de
+        leitura de lembretes deste processo.
+    '''
+    return reminder_cache.stats(), 200
+
+@api.get('/metrics', tags = [metrics_tag])
+def show_metrics():
+    '''
+        Retorna as métricas de latência por rota, de comandos SQL por
+        requisição e de conexão e envio SMTP no formato texto do Prometheus.
+    '''
+    return Response(metrics.registry.render(), mimetype = 'text/plain; version=0.0.4')
+
+def create_app(config: dict = None) -> OpenAPI:
+    '''
+        Cria a aplicação. Carrega o .env, configura os logs, o cache e o
+        banco e inicia as threads de fundo. As chaves de config sobrepõem as
+        variáveis de ambiente de mesmo nome (DB_URL, DB_INIT_SCHEMA,
+        OUTBOX_WORKER, SCHEDULER, ASYNC_EMAIL) e as demais vão para
+        app.config. As demais configurações são lidas do ambiente quando
+        usadas, e portanto também valem as do .env.
+    '''
+    config = dict(config or {})
+    load_dotenv(config.pop('DOTENV_PATH', '../.env'))
+
+    def setting(name: str, default: str = None):
+        return config.pop(name, os.environ.get(name, default))
+
+    configure_logging()
+    configure_cache()
+    create_schema = setting('DB_INIT_SCHEMA')
+    configure_engine(setting('DB_URL'),
+                     None if create_schema is None else str(create_schema) == '1')
+
+    async_email = str(setting('ASYNC_EMAIL', '0')) == '1'
+    start_outbox_worker = str(setting('OUTBOX_WORKER', '1')) == '1'
+    start_scheduler = str(setting('SCHEDULER', '1')) == '1'
+
+    application = OpenAPI(__name__, info = info)
+    application.config.update(config)
+    application.config['ASYNC_EMAIL'] = async_email
+    CORS(application)
+    application.before_request(reset_statement_counter)
+    application.before_request(check_idempotency_key)
+    # after_request hooks run in reverse order: the response is saved
+    # before the metrics are recorded
+    application.after_request(add_statement_count_header)
+    application.after_request(save_idempotent_response)
+    application.teardown_appcontext(remove_session)
+    application.register_api(api)
+
+    if start_outbox_worker:
+        # Set OUTBOX_WORKER=0 when the outbox is drained by a separate process
+        outbox_worker.start()
+    if start_scheduler:
+        # Set SCHEDULER=0 when due date emails are queued by a separate process
+        due_date_scheduler.start()
+    return application
+
+def __getattr__(name: str):
+    '''
+        Cria a aplicação no primeiro acesso a app.app, para quem importa o
+        módulo esperando o objeto da aplicação.
+    '''
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
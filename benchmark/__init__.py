@@ -0,0 +1 @@
+'''Package responsible for the performance benchmarks of the application'''
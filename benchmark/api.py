@@ -0,0 +1,299 @@
+'''
+    Benchmark of every route of the API. Seeds a database with synthetic
+    reminders in a scratch directory, points SMTP to a local stand-in server
+    and drives the routes through the Flask test client or, with --http, a
+    local HTTP server. Latency percentiles, throughput and peak RSS of each
+    route are written to a JSON file that can be compared with a baseline by
+    benchmark.compare:
+
+        python -m benchmark.api --size 100000 --requests 500 --output results.json
+
+    --concurrency keeps that many requests in flight over HTTP, and together
+    with --smtp-delay and --async-email shows how many requests a worker
+    serves while the SMTP server is slow:
+
+        python -m benchmark.api --routes "GET /send_email" --concurrency 50 \
+            --smtp-delay 200 --async-email
+'''
+import argparse
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DUE_DATE = '2023-09-20T00:00:00.000Z'
+# Routes that read the whole table, run --stream-requests times
+FULL_SCANS = ('GET /reminders?stream', 'GET /export')
+
+
+class FlaskClient():
+    '''
+        Executa as requisições pelo test client do Flask, sem rede.
+    '''
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def open(self, method: str, path: str, form: dict = None, body = None) -> int:
+        if isinstance(body, bytes):
+            # Raw file, as sent to /import
+            response = self.client.open(path, method = method, data = body,
+                                        content_type = 'application/x-ndjson')
+        else:
+            response = self.client.open(path, method = method, data = form, json = body)
+        response.get_data()
+        return response.status_code
+
+
+class HTTPClient():
+    '''
+        Executa as requisições por HTTP em um servidor local, com uma conexão
+        persistente por thread cliente.
+    '''
+    def __init__(self, app):
+        from werkzeug.serving import make_server
+
+        self.server = make_server('127.0.0.1', 0, app, threaded = True)
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        self._local = threading.local()
+
+    @property
+    def connection(self) -> http.client.HTTPConnection:
+        '''Connection of the current client thread'''
+        if not hasattr(self._local, 'connection'):
+            self._local.connection = http.client.HTTPConnection('127.0.0.1', self.server.server_port)
+        return self._local.connection
+
+    def open(self, method: str, path: str, form: dict = None, body = None) -> int:
+        headers = {}
+        payload = None
+        if form is not None:
+            payload = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif isinstance(body, bytes):
+            payload = body
+            headers['Content-Type'] = 'application/x-ndjson'
+        elif body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        self.connection.request(method, path, payload, headers)
+        response = self.connection.getresponse()
+        response.read()
+        if response.will_close:
+            self.connection.close()
+        return response.status
+
+
+def scenarios(size: int, batch: int) -> dict:
+    '''
+        Requisições medidas, por rota. Cada função recebe o número da
+        iteração e retorna (método, caminho, formulário, corpo JSON ou
+        arquivo em bytes).
+        As rotas que removem lembretes são as últimas, e usam os lembretes
+        do fim da faixa semeada.
+    '''
+    from benchmark.seed import letters, reminder_name, due_date, START
+
+    def reminder_id(i):
+        return i % size + 1
+
+    def bulk_items(i):
+        return [{'name': f'Lote {letters(i * batch + j)}', 'description': 'lote',
+                 'due_date': DUE_DATE, 'email': 'lote@email.com', 'send_email': False}
+                for j in range(batch)]
+
+    def import_file(i):
+        return b''.join(json.dumps({
+            'name': f'Importado {letters(i * batch + j)}', 'description': 'importado',
+            'due_date': DUE_DATE, 'email': 'importado@email.com'}).encode() + b'\n'
+            for j in range(batch))
+
+    return {
+        'GET /': lambda i: ('GET', '/', None, None),
+        'POST /create': lambda i: ('POST', '/create', {
+            'name': f'Novo {letters(i)}', 'description': 'benchmark', 'due_date': DUE_DATE,
+            'email': 'novo@email.com', 'send_email': 'true'}, None),
+        'GET /reminder': lambda i: ('GET', f'/reminder?id={reminder_id(i)}', None, None),
+        'GET /reminder_name': lambda i: (
+            'GET', '/reminder_name?' + urlencode({'name': reminder_name(reminder_id(i))}), None, None),
+        'GET /reminders': lambda i: ('GET', '/reminders?page_size=100', None, None),
+        'GET /reminders?stream': lambda i: ('GET', '/reminders?stream=true', None, None),
+        # Page of a sync client catching up from the start of the change feed
+        'GET /changes': lambda i: ('GET', '/changes?since=0&limit=100', None, None),
+        'GET /reminders/search': lambda i: (
+            'GET', '/reminders/search?' + urlencode({'q': f'lembrete {letters(i % 26)}'}), None, None),
+        # Re-push of a seeded reminder as sent by a sync client: nothing to write
+        'POST /create?upsert': lambda i: ('POST', '/create?upsert=true', {
+            'name': reminder_name(reminder_id(i)),
+            'description': f'descrição do lembrete {reminder_id(i)}',
+            'due_date': due_date(reminder_id(i)).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'email': f'usuario{reminder_id(i)}@email.com',
+            'send_email': str(reminder_id(i) % 2 == 0).lower()}, None),
+        'GET /reminders/upcoming': lambda i: (
+            'GET', '/reminders/upcoming?' + urlencode({
+                'start': (START + timedelta(minutes = reminder_id(i))).isoformat(),
+                'end': (START + timedelta(minutes = reminder_id(i), days = 1)).isoformat()}),
+            None, None),
+        'PUT /update': lambda i: ('PUT', '/update', {
+            'id': reminder_id(i), 'name': reminder_name(reminder_id(i)), 'description': f'alterado {i}',
+            'due_date': '2023-10-20T00:00:00', 'email': 'alterado@email.com',
+            'send_email': 'true'}, None),
+        'GET /send_email': lambda i: ('GET', f'/send_email?id={reminder_id(i * 2 + 1)}', None, None),
+        'POST /reminders/bulk': lambda i: ('POST', '/reminders/bulk', None, bulk_items(i)),
+        'PUT /reminders/bulk': lambda i: ('PUT', '/reminders/bulk', None, [
+            {'id': reminder_id(i * batch + j), 'description': f'lote {i}'} for j in range(batch)]),
+        'POST /import': lambda i: ('POST', '/import?format=ndjson', None, import_file(i)),
+        'GET /export': lambda i: ('GET', '/export?format=ndjson', None, None),
+        'GET /notifications': lambda i: (
+            'GET', f'/notifications?reminder_id={reminder_id(i)}', None, None),
+        'GET /cache_stats': lambda i: ('GET', '/cache_stats', None, None),
+        'GET /metrics': lambda i: ('GET', '/metrics', None, None),
+        'DELETE /delete': lambda i: ('DELETE', f'/delete?id={size - i}', None, None),
+        'DELETE /reminders/bulk': lambda i: ('DELETE', '/reminders/bulk', None, [
+            size // 2 - i * batch - j for j in range(batch)]),
+    }
+
+def percentile(values: list, fraction: float) -> float:
+    '''
+        Percentil de uma lista ordenada, pelo método do vizinho mais próximo.
+    '''
+    index = min(len(values) - 1, max(0, round(fraction * len(values)) - 1))
+    return values[index]
+
+def measure(client, scenario, requests: int, concurrency: int = 1) -> dict:
+    '''
+        Executa as requisições de um cenário, com até concurrency delas em
+        andamento ao mesmo tempo, e resume as latências.
+    '''
+    def timed(i):
+        method, path, form, body = scenario(i)
+        request_started = time.perf_counter()
+        status = client.open(method, path, form, body)
+        return (time.perf_counter() - request_started) * 1000, status
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(executor.map(timed, range(requests)))
+    else:
+        results = [timed(i) for i in range(requests)]
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, status in results if status >= 400)
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'throughput_rps': round(requests / elapsed, 1),
+        # ru_maxrss is the peak of the whole process so far, in KiB on Linux
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+def prepare(workdir: str, size: int, smtp_port: int, async_email: bool = False):
+    '''
+        Prepara o diretório de trabalho, o ambiente e o banco semeado, e
+        retorna a aplicação.
+    '''
+    os.makedirs(workdir, exist_ok = True)
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    os.environ.update({
+        'SCHEDULER': '0',
+        'SMTP_HOST': '127.0.0.1',
+        'SMTP_PORT': str(smtp_port),
+        'SMTP_SSL': '0',
+        'EMAIL_SENDER': 'benchmark@email.com',
+        'APP_PASSWORD': '',
+        'ASYNC_EMAIL': '1' if async_email else '0',
+    })
+    from app import create_app
+    from model import get_engine, Session, Reminder
+    from benchmark.seed import seed
+
+    app = create_app()
+    session = Session()
+    existing = session.query(Reminder).count()
+    Session.remove()
+    if existing < size:
+        print(f'Semeando {size - existing} lembretes em {workdir}')
+        seed(get_engine(), size - existing, first = existing + 1)
+    return app
+
+def main():
+    '''
+        Executa o benchmark de todas as rotas e grava o resultado em JSON.
+    '''
+    parser = argparse.ArgumentParser(description = __doc__,
+                                     formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type = int, default = 1000,
+                        help = 'quantidade de lembretes semeados (ex.: 1000, 100000, 1000000)')
+    parser.add_argument('--requests', type = int, default = 200, help = 'requisições por rota')
+    parser.add_argument('--stream-requests', type = int, default = 5,
+                        help = 'requisições das rotas que leem a tabela inteira (stream e /export)')
+    parser.add_argument('--batch', type = int, default = 100, help = 'itens por requisição em lote')
+    parser.add_argument('--http', action = 'store_true', help = 'usa um servidor HTTP local')
+    parser.add_argument('--concurrency', type = int, default = 1,
+                        help = 'requisições simultâneas; acima de 1 implica --http')
+    parser.add_argument('--smtp-delay', type = float, default = 0,
+                        help = 'atraso do servidor SMTP local por mensagem, em ms')
+    parser.add_argument('--async-email', action = 'store_true',
+                        help = 'executa com ASYNC_EMAIL=1 (/send_email pela fila de envio)')
+    parser.add_argument('--workdir', help = 'diretório do banco; por padrão um diretório temporário')
+    parser.add_argument('--routes', nargs = '*', help = 'executa apenas as rotas informadas')
+    parser.add_argument('--output', default = 'benchmark_results.json')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    workdir = args.workdir or tempfile.mkdtemp(prefix = 'benchmark-')
+
+    from benchmark.smtp_server import SMTPServer
+    smtp_server = SMTPServer(delay = args.smtp_delay / 1000).start()
+    app = prepare(os.path.abspath(workdir), args.size, smtp_server.port, args.async_email)
+    http = args.http or args.concurrency > 1
+    client = HTTPClient(app) if http else FlaskClient(app)
+
+    results = {}
+    for name, scenario in scenarios(args.size, args.batch).items():
+        if args.routes and name not in args.routes:
+            continue
+        requests = args.stream_requests if name in FULL_SCANS else args.requests
+        results[name] = measure(client, scenario, requests, args.concurrency)
+        print(f'{name:<26} p50 {results[name]["p50_ms"]:>9.2f} ms  '
+              f'p95 {results[name]["p95_ms"]:>9.2f} ms  p99 {results[name]["p99_ms"]:>9.2f} ms  '
+              f'{results[name]["throughput_rps"]:>9.1f} req/s  erros {results[name]["errors"]}')
+
+    report = {
+        'meta': {
+            'size': args.size,
+            'requests': args.requests,
+            'batch': args.batch,
+            'client': 'http' if http else 'flask',
+            'concurrency': args.concurrency,
+            'smtp_delay_ms': args.smtp_delay,
+            'async_email': args.async_email,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': datetime.now().isoformat(timespec = 'seconds'),
+            'smtp_messages': smtp_server.messages,
+            'smtp_connections': smtp_server.connections,
+        },
+        'routes': results,
+    }
+    with open(output, 'w', encoding = 'utf-8') as file:
+        json.dump(report, file, indent = 2)
+    print(f'Resultado gravado em {output}')
+
+
+if __name__ == '__main__':
+    main()
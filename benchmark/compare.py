@@ -0,0 +1,63 @@
+'''
+    Compares a benchmark.api result with a baseline and exits with status 1
+    when a route got slower (p95) or lost throughput beyond the threshold:
+
+        python -m benchmark.compare baseline.json results.json --threshold 20
+'''
+import argparse
+import json
+import sys
+
+
+def load(path: str) -> dict:
+    '''
+        Lê um resultado gravado por benchmark.api.
+    '''
+    with open(path, encoding = 'utf-8') as file:
+        return json.load(file)['routes']
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    '''
+        Retorna as regressões encontradas, uma descrição por rota e métrica.
+    '''
+    regressions = []
+    for route, result in current.items():
+        if route not in baseline:
+            continue
+        before = baseline[route]
+        p95_change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 \
+            if before['p95_ms'] else 0
+        throughput_change = (result['throughput_rps'] - before['throughput_rps']) \
+            / before['throughput_rps'] * 100 if before['throughput_rps'] else 0
+        print(f'{route:<26} p95 {before["p95_ms"]:>9.2f} -> {result["p95_ms"]:>9.2f} ms '
+              f'({p95_change:+6.1f}%)  req/s {before["throughput_rps"]:>9.1f} -> '
+              f'{result["throughput_rps"]:>9.1f} ({throughput_change:+6.1f}%)')
+        if p95_change > threshold:
+            regressions.append(f'{route}: p95 {p95_change:+.1f}%')
+        if -throughput_change > threshold:
+            regressions.append(f'{route}: vazão {throughput_change:+.1f}%')
+    return regressions
+
+def main():
+    '''
+        Compara os resultados e sinaliza regressões pelo código de saída.
+    '''
+    parser = argparse.ArgumentParser(description = __doc__,
+                                     formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type = float, default = 20,
+                        help = 'variação máxima aceita, em porcentagem')
+    args = parser.parse_args()
+
+    regressions = compare(load(args.baseline), load(args.current), args.threshold)
+    if regressions:
+        print('Regressões acima de %.0f%%:' % args.threshold)
+        for regression in regressions:
+            print(f'  {regression}')
+        sys.exit(1)
+    print('Nenhuma regressão acima de %.0f%%' % args.threshold)
+
+
+if __name__ == '__main__':
+    main()
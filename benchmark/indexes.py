@@ -0,0 +1,81 @@
+'''
+    Benchmark of the indexed lookups used by the routes. Seeds temporary
+    SQLite databases of growing size and measures the average time of each
+    lookup, which should stay flat as the reminder table grows:
+
+        python -m benchmark.indexes --sizes 1000 10000 100000 1000000
+'''
+import argparse
+import os
+import tempfile
+import time
+from datetime import timedelta
+from sqlalchemy import create_engine, select, text
+from model.base import Base
+from model.email import Email
+from model.reminder import Reminder
+from benchmark.seed import seed, reminder_name, due_date
+
+
+def lookups(size: int) -> dict:
+    '''
+        Consultas medidas, equivalentes às realizadas pelas rotas.
+    '''
+    middle = max(1, size // 2)
+    start = due_date(middle)
+    return {
+        'name_normalized': select(Reminder.id).where(
+            Reminder.name_normalized == reminder_name(middle).lower()),
+        'email.reminder': select(Email.id).where(Email.reminder == middle),
+        'send_email+due_date': select(Reminder.id).where(
+            Reminder.send_email.is_(True),
+            Reminder.due_date.between(start, start + timedelta(hours = 1))),
+        'recurring+next_due_at': select(Reminder.id).where(
+            Reminder.next_due_at < start, Reminder.recurrence.isnot(None)),
+    }
+
+def run(size: int, repeat: int, with_indexes: bool) -> dict:
+    '''
+        Mede o tempo médio, em microssegundos, de cada consulta em um banco
+        com size lembretes.
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f'sqlite:///{os.path.join(directory, "bench.sqlite3")}')
+        Base.metadata.create_all(engine)
+        if not with_indexes:
+            with engine.begin() as connection:
+                for table in Base.metadata.sorted_tables:
+                    for index in table.indexes:
+                        connection.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+        seed(engine, size)
+        result = {}
+        with engine.connect() as connection:
+            for name, query in lookups(size).items():
+                connection.execute(query).all()
+                started = time.perf_counter()
+                for _ in range(repeat):
+                    connection.execute(query).all()
+                result[name] = (time.perf_counter() - started) / repeat * 1e6
+        engine.dispose()
+        return result
+
+def main():
+    '''
+        Executa o benchmark para cada tamanho de tabela informado.
+    '''
+    parser = argparse.ArgumentParser(description = __doc__,
+                                     formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [1000, 10000, 100000, 1000000])
+    parser.add_argument('--repeat', type = int, default = 200)
+    parser.add_argument('--without-indexes', action = 'store_true',
+                        help = 'remove os índices para comparar com a leitura da tabela inteira')
+    args = parser.parse_args()
+
+    print(f'{"linhas":>10} ' + ' '.join(f'{name:>22}' for name in lookups(1)))
+    for size in args.sizes:
+        result = run(size, args.repeat, not args.without_indexes)
+        print(f'{size:>10} ' + ' '.join(f'{value:>19.1f} us' for value in result.values()))
+
+
+if __name__ == '__main__':
+    main()
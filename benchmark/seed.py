@@ -0,0 +1,76 @@
+'''
+    Seeds a database with synthetic reminders for the benchmarks:
+
+        python -m benchmark.seed --size 100000
+'''
+import argparse
+import string
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from sqlalchemy.engine import Engine
+from model.email import Email
+from model.reminder import Reminder
+
+CHUNK_SIZE = 10000
+START = datetime(2023, 1, 1)
+
+
+def letters(number: int) -> str:
+    '''
+        Representa o número apenas com letras, pois nomes de lembrete não
+        podem conter números (0 -> a, 25 -> z, 26 -> ba ...).
+    '''
+    result = ''
+    while True:
+        number, rest = divmod(number, 26)
+        result = string.ascii_lowercase[rest] + result
+        if not number:
+            return result
+
+def reminder_name(number: int) -> str:
+    '''
+        Nome do lembrete sintético de número informado.
+    '''
+    return f'Lembrete {letters(number)}'
+
+def due_date(number: int) -> datetime:
+    '''
+        Data final do lembrete sintético de número informado.
+    '''
+    return START + timedelta(minutes = number)
+
+def seed(engine: Engine, size: int, first: int = 1) -> None:
+    '''
+        Popula o banco com size lembretes sintéticos, cada um com um email,
+        usando inserts em lote por blocos de CHUNK_SIZE.
+    '''
+    last = first + size
+    with engine.begin() as connection:
+        for offset in range(first, last, CHUNK_SIZE):
+            ids = range(offset, min(offset + CHUNK_SIZE, last))
+            connection.execute(insert(Reminder.__table__), [{
+                'pk_reminder': i,
+                'name': reminder_name(i),
+                'name_normalized': reminder_name(i).lower(),
+                'description': f'descrição do lembrete {i}',
+                'due_date': due_date(i),
+                'send_email': i % 2 == 0,
+                'recurring': False,
+                'next_due_at': due_date(i),
+                'created_at': START,
+            } for i in ids])
+            connection.execute(insert(Email.__table__), [{
+                'email': f'usuario{i}@email.com',
+                'reminder': i,
+                'created_at': START,
+            } for i in ids])
+
+
+if __name__ == '__main__':
+    from model import get_engine
+
+    parser = argparse.ArgumentParser(description = __doc__,
+                                     formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type = int, default = 1000)
+    args = parser.parse_args()
+    seed(get_engine(), args.size)
@@ -0,0 +1,79 @@
+'''
+    Benchmark of the list serialization: the ORM path (Reminder objects with
+    selectinload, show_reminders and the Flask JSON encoder) against the
+    column projection of reminder_rows encoded by dump_reminder_rows, on a
+    temporary database:
+
+        python -m benchmark.serialization --size 100000
+'''
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from flask import json
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from model.base import Base
+from model.reminder import Reminder
+from model.reminder_query import reminders_with_email, reminder_rows
+from schemas.reminder import show_reminders, dump_reminder_rows, orjson
+from benchmark.seed import seed
+
+
+def orm_path(session) -> bytes:
+    '''
+        Caminho anterior: objetos Reminder com os emails e json do Flask.
+    '''
+    reminders = reminders_with_email(session).order_by(Reminder.id).all()
+    return json.dumps(show_reminders(reminders)).encode()
+
+def projection_path(session) -> bytes:
+    '''
+        Caminho atual: tuplas apenas com as colunas exibidas.
+    '''
+    return dump_reminder_rows(reminder_rows(session).order_by(Reminder.id).all())
+
+def measure(label: str, session_factory, path, repeat: int) -> None:
+    '''
+        Imprime o tempo médio e o pico de memória alocada de um caminho.
+    '''
+    elapsed = 0.0
+    for _ in range(repeat):
+        session = session_factory()
+        started = time.perf_counter()
+        body = path(session)
+        elapsed += time.perf_counter() - started
+        session.close()
+    session = session_factory()
+    tracemalloc.start()
+    path(session)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    session.close()
+    print(f'{label:<12} {elapsed / repeat * 1000:>10.1f} ms  pico {peak / 2**20:>8.1f} MiB  '
+          f'{len(body) / 2**20:>6.1f} MiB de JSON')
+
+def main():
+    '''
+        Compara os dois caminhos de listagem em um banco com size lembretes.
+    '''
+    parser = argparse.ArgumentParser(description = __doc__,
+                                     formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type = int, default = 100000)
+    parser.add_argument('--repeat', type = int, default = 3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f'sqlite:///{os.path.join(directory, "bench.sqlite3")}')
+        Base.metadata.create_all(engine)
+        seed(engine, args.size)
+        session_factory = sessionmaker(bind = engine)
+        print(f'{args.size} lembretes, encoder {"orjson" if orjson else "json"}')
+        measure('ORM', session_factory, orm_path, args.repeat)
+        measure('projeção', session_factory, projection_path, args.repeat)
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+'''
+    Local SMTP stand-in used by the benchmarks. Accepts any login and any
+    message, without TLS, and only counts what it receives, so that the
+    measured time is the application's and not the mail provider's. A delay
+    per message can simulate the latency of a real provider:
+
+        python -m benchmark.smtp_server --port 8025 --delay 200
+'''
+import argparse
+import socketserver
+import threading
+import time
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    '''
+        Atende uma sessão SMTP com o mínimo de comandos usados pelo
+        smtplib: EHLO/HELO, AUTH, MAIL, RCPT, DATA, RSET, NOOP e QUIT.
+    '''
+    def reply(self, line: str) -> None:
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self) -> None:
+        self.server.connections += 1
+        self.reply('220 localhost SMTP stand-in')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors = 'replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply('250-localhost')
+                self.reply('250 AUTH PLAIN LOGIN')
+            elif command.startswith('AUTH'):
+                self.reply('235 Authentication successful')
+            elif command.startswith(('MAIL', 'RCPT', 'RSET', 'NOOP')):
+                self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                    pass
+                if self.server.delay:
+                    time.sleep(self.server.delay)
+                with self.server.lock:
+                    self.server.messages += 1
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    '''Class representing the local SMTP stand-in server'''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, delay: float = 0):
+        super().__init__((host, port), SMTPHandler)
+        self.connections = 0
+        self.messages = 0
+        self.delay = delay
+        self.lock = threading.Lock()
+
+    @property
+    def port(self) -> int:
+        '''Port the server is listening on'''
+        return self.server_address[1]
+
+    def start(self) -> 'SMTPServer':
+        '''
+            Inicia o servidor em uma thread de fundo.
+        '''
+        threading.Thread(target = self.serve_forever, name = 'smtp-stand-in', daemon = True).start()
+        return self
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__,
+                                     formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8025)
+    parser.add_argument('--delay', type = float, default = 0, help = 'atraso por mensagem, em ms')
+    args = parser.parse_args()
+    server = SMTPServer(args.host, args.port, args.delay / 1000)
+    print(f'Servidor SMTP local em {args.host}:{server.port}')
+    server.serve_forever()
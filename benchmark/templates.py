@@ -0,0 +1,47 @@
+'''
+    Micro-benchmark of the email templates: messages rendered per second
+    with render_email only, and with the EmailMessage built and serialized
+    as it is sent to the SMTP server:
+
+        python -m benchmark.templates --count 20000
+'''
+import argparse
+import time
+from model.email_templates import KIND_DUE_DATE, KIND_DIGEST, render_email, build_message
+
+REMINDER = {
+    'name': 'Trocar o óleo do carro',
+    'description': 'trocar o óleo a cada 10 mil km no <Moraes AutoCenter>',
+    'due_date': '20/09/2023',
+}
+
+
+def measure(label: str, count: int, function) -> None:
+    '''
+        Executa function count vezes e imprime a vazão obtida.
+    '''
+    started = time.perf_counter()
+    for _ in range(count):
+        function()
+    elapsed = time.perf_counter() - started
+    print(f'{label:<32} {count / elapsed:>12,.0f} emails/s')
+
+def main():
+    '''
+        Mede a vazão de renderização dos emails de lembrete e de resumo.
+    '''
+    parser = argparse.ArgumentParser(description = __doc__,
+                                     formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type = int, default = 20000)
+    args = parser.parse_args()
+
+    digest = {'reminders': [REMINDER] * 10}
+    measure('render lembrete', args.count, lambda: render_email(KIND_DUE_DATE, REMINDER))
+    measure('render resumo (10 lembretes)', args.count, lambda: render_email(KIND_DIGEST, digest))
+    measure('render + EmailMessage', args.count // 10, lambda: build_message(
+        render_email(KIND_DUE_DATE, REMINDER), 'remetente@email.com', 'destino@email.com'
+        ).as_string())
+
+
+if __name__ == '__main__':
+    main()
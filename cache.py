@@ -0,0 +1,311 @@
+'''
+    Module responsible for caching the serialized reminder views. Entries are
+    kept in an in-process LRU with TTL or, when CACHE_URL points to a Redis
+    server, in Redis, so that every gunicorn worker sees the same
+    invalidations. Each invalidation bumps a per-reminder generation, and an
+    entry is only served if it was written under the current one, so a
+    reader that loaded a reminder before a write cannot cache the old view.
+'''
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
+from typing import Optional, List, Tuple
+from logger import logger
+
+CACHE_PREFIX = 'reminder:'
+
+CachedView = namedtuple('CachedView', ['etag', 'last_modified', 'body'])
+
+
+def cache_settings() -> dict:
+    '''
+        Configuração do cache lida das variáveis de ambiente no momento do
+        uso, para que valha o .env carregado por create_app.
+    '''
+    return {
+        'url': os.environ.get('CACHE_URL'),
+        'ttl': float(os.environ.get('CACHE_TTL', 60)),
+        'max_size': int(os.environ.get('CACHE_MAX_SIZE', 10000)),
+    }
+
+
+class LocalCache():
+    '''
+        Cache LRU em memória, com tempo de expiração por entrada.
+    '''
+    def __init__(self, max_size: int = None, ttl: float = None):
+        settings = cache_settings()
+        self.max_size = settings['max_size'] if max_size is None else max_size
+        self.ttl = settings['ttl'] if ttl is None else ttl
+        self._entries = OrderedDict()
+        # Kept apart from the LRU: a counter evicted before the entries
+        # written under it would make them current again
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> Optional[str]:
+        now = time.monotonic()
+        counter = self._counters.get(key)
+        if counter is not None:
+            value, expires_at = counter
+            if expires_at >= now:
+                return str(value)
+            del self._counters[key]
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def get(self, key: str) -> Optional[str]:
+        '''
+            Retorna o valor da chave, ou None se ausente ou expirado.
+        '''
+        with self._lock:
+            return self._get(key)
+
+    def get_many(self, *keys: str) -> List[Optional[str]]:
+        '''
+            Retorna os valores das chaves, com None para as ausentes.
+        '''
+        with self._lock:
+            return [self._get(key) for key in keys]
+
+    def set(self, key: str, value: str) -> None:
+        '''
+            Salva o valor, descartando a entrada menos usada se necessário.
+        '''
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last = False)
+
+    def delete(self, *keys: str) -> None:
+        '''
+            Remove as chaves informadas.
+        '''
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def incr(self, key: str) -> None:
+        '''
+            Incrementa o contador da chave. Os contadores duram o dobro das
+            entradas, de forma que expiram depois das gravadas antes deles.
+        '''
+        now = time.monotonic()
+        with self._lock:
+            value, expires_at = self._counters.get(key, (0, now))
+            if expires_at < now:
+                value = 0
+            self._counters[key] = (value + 1, now + 2 * self.ttl)
+            if len(self._counters) > self.max_size:
+                self._counters = {name: counter for name, counter in self._counters.items()
+                                  if counter[1] >= now}
+
+    def clear(self) -> None:
+        '''
+            Remove todas as entradas.
+        '''
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+
+
+class RedisCache():
+    '''
+        Cache compartilhado entre processos. Aceita qualquer cliente com a
+        interface do redis-py (get, mget, setex, delete, incr, expire), o que
+        permite usar um substituto local nos testes.
+    '''
+    def __init__(self, client, ttl: float = None, prefix: str = CACHE_PREFIX):
+        self.client = client
+        self.ttl = cache_settings()['ttl'] if ttl is None else ttl
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[str]:
+        '''
+            Retorna o valor da chave, ou None se ausente ou expirado.
+        '''
+        value = self.client.get(self.prefix + key)
+        if isinstance(value, bytes):
+            return value.decode()
+        return value
+
+    def get_many(self, *keys: str) -> List[Optional[str]]:
+        '''
+            Retorna os valores das chaves, com None para as ausentes, em uma
+            única consulta.
+        '''
+        values = self.client.mget([self.prefix + key for key in keys])
+        return [value.decode() if isinstance(value, bytes) else value for value in values]
+
+    def set(self, key: str, value: str) -> None:
+        '''
+            Salva o valor com expiração.
+        '''
+        self.client.setex(self.prefix + key, max(1, int(self.ttl)), value)
+
+    def delete(self, *keys: str) -> None:
+        '''
+            Remove as chaves informadas.
+        '''
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def incr(self, key: str) -> None:
+        '''
+            Incrementa o contador da chave. Os contadores duram o dobro das
+            entradas, de forma que expiram depois das gravadas antes deles.
+        '''
+        self.client.incr(self.prefix + key)
+        self.client.expire(self.prefix + key, max(2, int(2 * self.ttl)))
+
+    def clear(self) -> None:
+        '''
+            Nada a fazer: as entradas compartilhadas expiram sozinhas.
+        '''
+
+
+class ReminderCache():
+    '''
+        Cache de leitura das visualizações de lembretes, indexadas por id.
+        As buscas por nome guardam apenas o id correspondente, de forma que
+        invalidar o id de um lembrete alterado ou removido basta para as duas
+        rotas de leitura.
+    '''
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get_by_id(self, reminder_id: int) -> Tuple[Optional[CachedView], Optional[int]]:
+        '''
+            Retorna a visualização serializada do lembrete, com seu ETag e
+            Last-Modified, se estiver em cache, e a geração atual do
+            lembrete, a ser informada a set caso ele seja lido do banco. A
+            geração é None se o cache não pôde ser lido.
+        '''
+        try:
+            value, generation = self.backend.get_many(f'id:{reminder_id}', f'gen:{reminder_id}')
+            generation = int(generation or 0)
+        except Exception as error:
+            logger.warning('Erro ao ler o cache: %s', error)
+            value, generation = None, None
+        # Entry layout: generation, etag, last modified timestamp and the JSON
+        # body, which never contains a raw line break
+        if value is not None:
+            written, value = value.split('\n', 1)
+            if int(written) != generation:
+                value = None
+        self._count(value is not None)
+        if value is None:
+            return None, generation
+        etag, timestamp, body = value.split('\n', 2)
+        last_modified = datetime.fromtimestamp(float(timestamp), timezone.utc) if timestamp else None
+        return CachedView(etag, last_modified, body), generation
+
+    def get_id_by_name(self, name_normalized: str) -> Optional[int]:
+        '''
+            Retorna o id do lembrete de nome normalizado informado, se estiver
+            em cache. O id deve ser conferido com o nome da visualização, pois
+            o lembrete pode ter sido renomeado.
+        '''
+        try:
+            value = self.backend.get(f'name:{name_normalized}')
+        except Exception as error:
+            logger.warning('Erro ao ler o cache: %s', error)
+            value = None
+        if value is None:
+            self._count(False)
+            return None
+        return int(value)
+
+    def set(self, reminder_id: int, name_normalized: str, view: CachedView,
+            generation: Optional[int]) -> None:
+        '''
+            Salva a visualização serializada de um lembrete, lida do banco
+            na geração informada, retornada por get_by_id antes da leitura.
+            Sem geração, apenas o id do nome é salvo.
+        '''
+        timestamp = str(view.last_modified.timestamp()) if view.last_modified else ''
+        try:
+            if generation is not None:
+                self.backend.set(f'id:{reminder_id}',
+                                 f'{generation}\n{view.etag}\n{timestamp}\n{view.body}')
+            self.backend.set(f'name:{name_normalized}', str(reminder_id))
+        except Exception as error:
+            logger.warning('Erro ao gravar no cache: %s', error)
+
+    def invalidate(self, *reminder_ids: int) -> None:
+        '''
+            Remove do cache os lembretes alterados ou removidos e avança a
+            sua geração, descartando visualizações lidas antes da alteração
+            que ainda sejam gravadas.
+        '''
+        if not reminder_ids:
+            return
+        try:
+            for reminder_id in reminder_ids:
+                self.backend.incr(f'gen:{reminder_id}')
+            self.backend.delete(*[f'id:{reminder_id}' for reminder_id in reminder_ids])
+        except Exception as error:
+            logger.warning('Erro ao invalidar o cache: %s', error)
+        with self._lock:
+            self.invalidations += len(reminder_ids)
+
+    def stats(self) -> dict:
+        '''
+            Contadores de acertos, falhas e invalidações do cache.
+        '''
+        with self._lock:
+            return {
+                'backend': type(self.backend).__name__,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+            }
+
+
+def create_backend():
+    '''
+        Usa o Redis de CACHE_URL quando configurado e disponível, e o cache
+        em memória do processo caso contrário.
+    '''
+    url = cache_settings()['url']
+    if url:
+        try:
+            import redis
+            return RedisCache(redis.Redis.from_url(url))
+        except ImportError:
+            logger.warning('CACHE_URL definido, mas o pacote redis não está instalado; '
+                           'usando cache local')
+    return LocalCache()
+
+
+def configure_cache() -> None:
+    '''
+        Recria o backend de reminder_cache com a configuração atual do
+        ambiente. Chamado por create_app após carregar o .env.
+    '''
+    reminder_cache.backend = create_backend()
+
+
+# Replaced by configure_cache in create_app, once the .env is loaded
+reminder_cache = ReminderCache(LocalCache())
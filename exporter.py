@@ -0,0 +1,141 @@
+'''
+    Module responsible for exporting reminders, with their email, as NDJSON
+    or CSV. Rows come from a yield_per cursor and are encoded and flushed in
+    small buffers, so memory stays constant and the first bytes go out
+    before the query ends. Dates use the /create format, so an export can
+    be imported back by importer. Used by the /export route and from the
+    command line:
+
+        python -m exporter --format csv --output reminders.csv
+'''
+import argparse
+import csv
+import io
+import os
+import sys
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+from sqlalchemy import or_
+from sqlalchemy.orm import Query
+from model.reminder import Reminder
+from model.reminder_query import reminder_rows
+from schemas.reminder import dumps
+
+FORMAT_NDJSON = 'ndjson'
+FORMAT_CSV = 'csv'
+EXPORT_FORMATS = (FORMAT_NDJSON, FORMAT_CSV)
+EXPORT_FIELDS = ('id', 'name', 'name_normalized', 'description', 'due_date', 'send_email',
+                 'email', 'recurring', 'recurrence', 'recurrence_interval', 'created_at',
+                 'updated_at')
+MIMETYPES = {FORMAT_NDJSON: 'application/x-ndjson', FORMAT_CSV: 'text/csv'}
+
+
+def export_settings() -> dict:
+    '''
+        Configuração da exportação lida das variáveis de ambiente no momento
+        do uso, para que valha o .env carregado por create_app.
+    '''
+    return {
+        'chunk_size': int(os.environ.get('EXPORT_CHUNK_SIZE', 1000)),
+        'buffer_size': int(os.environ.get('EXPORT_BUFFER_SIZE', 64 * 1024)),
+    }
+
+def export_query(session, due_from: Optional[datetime] = None, due_to: Optional[datetime] = None,
+                 updated_since: Optional[datetime] = None) -> Query:
+    '''
+        Query das linhas exportadas, em ordem de id, com os filtros
+        opcionais de intervalo de due_date e de alteração desde uma data
+        (lembretes criados ou atualizados a partir dela).
+    '''
+    query = reminder_rows(session).add_columns(Reminder.created_at, Reminder.updated_at)
+    if due_from:
+        query = query.filter(Reminder.due_date >= due_from)
+    if due_to:
+        query = query.filter(Reminder.due_date <= due_to)
+    if updated_since:
+        query = query.filter(or_(Reminder.updated_at >= updated_since,
+                                 Reminder.created_at >= updated_since))
+    return query.order_by(Reminder.id).yield_per(export_settings()['chunk_size'])
+
+def format_date(value: Optional[datetime]) -> Optional[str]:
+    '''
+        Formata a data no formato aceito pela rota /create.
+    '''
+    return value.isoformat(timespec = 'milliseconds') + 'Z' if value else None
+
+def export_view(row) -> dict:
+    '''
+        Representação exportada de uma linha de export_query.
+    '''
+    view = row._asdict()
+    for field in ('due_date', 'created_at', 'updated_at'):
+        view[field] = format_date(view[field])
+    return view
+
+def ndjson_lines(rows: Iterable) -> Iterator[bytes]:
+    '''
+        Gera um objeto JSON por linha.
+    '''
+    for row in rows:
+        yield dumps(export_view(row)) + b'\n'
+
+def csv_lines(rows: Iterable) -> Iterator[bytes]:
+    '''
+        Gera o cabeçalho e uma linha CSV por lembrete.
+    '''
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, EXPORT_FIELDS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(export_view(row))
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+def buffered(lines: Iterator[bytes], size: int = None) -> Iterator[bytes]:
+    '''
+        Agrupa as linhas em blocos de até size bytes (por padrão,
+        EXPORT_BUFFER_SIZE). O primeiro bloco é enviado assim que existir,
+        para que a resposta comece sem esperar o buffer encher.
+    '''
+    size = size or export_settings()['buffer_size']
+    chunk, length, first = [], 0, True
+    for line in lines:
+        chunk.append(line)
+        length += len(line)
+        if first or length >= size:
+            yield b''.join(chunk)
+            chunk, length, first = [], 0, False
+    if chunk:
+        yield b''.join(chunk)
+
+def export_reminders(rows: Iterable, file_format: str = FORMAT_NDJSON) -> Iterator[bytes]:
+    '''
+        Gera o arquivo exportado, no formato informado, em blocos de bytes.
+    '''
+    lines = csv_lines(rows) if file_format == FORMAT_CSV else ndjson_lines(rows)
+    return buffered(lines)
+
+
+if __name__ == '__main__':
+    from model import Session
+
+    parser = argparse.ArgumentParser(description = __doc__,
+                                     formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--format', choices = EXPORT_FORMATS, default = FORMAT_NDJSON)
+    parser.add_argument('--output', help = 'arquivo de saída; por padrão a saída padrão')
+    parser.add_argument('--due-from', type = datetime.fromisoformat)
+    parser.add_argument('--due-to', type = datetime.fromisoformat)
+    parser.add_argument('--updated-since', type = datetime.fromisoformat)
+    args = parser.parse_args()
+
+    session = Session()
+    rows = export_query(session, args.due_from, args.due_to, args.updated_since)
+    output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for block in export_reminders(rows, args.format):
+            output.write(block)
+    finally:
+        if args.output:
+            output.close()
+        session.close()
@@ -0,0 +1,25 @@
+'''
+    Gunicorn settings, read from the environment. Requests spend most of
+    their time waiting on SQLite or, with ASYNC_EMAIL=0, on the SMTP server,
+    so each worker runs a pool of threads (gthread) instead of handling one
+    request at a time. The database pool is sized to the thread count so no
+    thread waits for a connection:
+
+        gunicorn 'app:create_app()'
+        GUNICORN_WORKERS=4 GUNICORN_THREADS=64 gunicorn 'app:create_app()'
+'''
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', min(multiprocessing.cpu_count(), 4)))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+# Access log destination ('-' for stdout), off by default; the app moves
+# its handler behind the log queue, where LOG_SAMPLING applies
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')
+
+# One connection per request thread; read by model.create_db_engine
+os.environ.setdefault('DB_POOL_SIZE', str(threads))
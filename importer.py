@@ -0,0 +1,131 @@
+'''
+    Module responsible for importing reminders from NDJSON or CSV files.
+    The file is read as a stream, validated line by line with the same
+    rules as /create and written by bulk_create, one transaction per chunk,
+    so memory use does not grow with the file. Used by the /import route
+    and from the command line:
+
+        python -m importer reminders.ndjson --chunk-size 1000
+'''
+import argparse
+import csv
+import io
+import json
+import os
+from collections import namedtuple
+from typing import IO, Iterator, Tuple, Any
+from model.bulk import bulk_create, bulk_chunk_size
+from schemas.reminder import parse_reminder_items
+from logger import logger
+
+FORMAT_NDJSON = 'ndjson'
+FORMAT_CSV = 'csv'
+IMPORT_FORMATS = (FORMAT_NDJSON, FORMAT_CSV)
+
+InvalidLine = namedtuple('InvalidLine', ['mensagem'])
+
+
+def guess_format(filename: str = None, content_type: str = None) -> str:
+    '''
+        Deduz o formato pelo nome do arquivo ou pelo Content-Type, sendo
+        NDJSON o padrão.
+    '''
+    if (filename or '').lower().endswith('.csv') or 'csv' in (content_type or ''):
+        return FORMAT_CSV
+    return FORMAT_NDJSON
+
+def read_ndjson(text: IO[str]) -> Iterator[Tuple[int, Any]]:
+    '''
+        Gera (número da linha, objeto) para cada linha não vazia.
+    '''
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as error:
+            yield line_number, InvalidLine(f'JSON inválido: {error.msg}')
+
+def read_csv(text: IO[str]) -> Iterator[Tuple[int, Any]]:
+    '''
+        Gera (número da linha, objeto) para cada linha após o cabeçalho.
+        As colunas são os campos da rota /create.
+    '''
+    reader = csv.DictReader(text)
+    for row in reader:
+        yield reader.line_num, row
+
+def read_items(stream: IO[bytes], file_format: str) -> Iterator[Tuple[int, Any]]:
+    '''
+        Lê o arquivo binário em UTF-8 no formato informado.
+    '''
+    text = io.TextIOWrapper(stream, encoding = 'utf-8-sig', newline = '')
+    if file_format == FORMAT_CSV:
+        return read_csv(text)
+    return read_ndjson(text)
+
+def import_reminders(session, stream: IO[bytes], file_format: str = FORMAT_NDJSON,
+                     chunk_size: int = None) -> dict:
+    '''
+        Importa os lembretes do arquivo, validando e gravando um bloco de
+        chunk_size linhas (por padrão, BULK_CHUNK_SIZE) por vez. Retorna o
+        resumo com os totais de linhas aceitas e rejeitadas e o motivo de
+        cada rejeição.
+    '''
+    chunk_size = chunk_size or bulk_chunk_size()
+    # Rejected rows are always counted, but only the first ones are described
+    max_errors = int(os.environ.get('IMPORT_MAX_ERRORS', 1000))
+    summary = {'total': 0, 'accepted': 0, 'rejected': 0, 'errors': []}
+
+    def reject(errors):
+        summary['rejected'] += len(errors)
+        room = max_errors - len(summary['errors'])
+        summary['errors'].extend({'line': error['index'], 'mensagem': error['mensagem']}
+                                 for error in sorted(errors, key = lambda error: error['index'])[:room])
+
+    def flush(batch):
+        rows, errors = parse_reminder_items(batch)
+        created, write_errors = bulk_create(session, rows, chunk_size)
+        summary['accepted'] += len(created)
+        reject(errors + write_errors)
+
+    batch = []
+    line_number = 0
+    try:
+        for line_number, item in read_items(stream, file_format):
+            summary['total'] += 1
+            if isinstance(item, InvalidLine):
+                reject([{'index': line_number, 'mensagem': item.mensagem}])
+                continue
+            batch.append((line_number, item))
+            if len(batch) >= chunk_size:
+                flush(batch)
+                batch = []
+    except (UnicodeDecodeError, csv.Error) as error:
+        # The rest of the file can not be read; what was read is kept
+        logger.warning('Importação interrompida na linha %d: %s', line_number + 1, error)
+        reject([{'index': line_number + 1, 'mensagem': f'Arquivo inválido a partir desta linha: {error}'}])
+    if batch:
+        flush(batch)
+    logger.info('Importação: %d linhas, %d aceitas, %d rejeitadas',
+                summary['total'], summary['accepted'], summary['rejected'])
+    return summary
+
+
+if __name__ == '__main__':
+    from model import Session
+    from logger import configure_logging
+
+    parser = argparse.ArgumentParser(description = __doc__,
+                                     formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('file')
+    parser.add_argument('--format', choices = IMPORT_FORMATS,
+                        help = 'formato do arquivo; por padrão deduzido pela extensão')
+    parser.add_argument('--chunk-size', type = int, help = 'por padrão, BULK_CHUNK_SIZE')
+    args = parser.parse_args()
+
+    configure_logging()
+    with open(args.file, 'rb') as file:
+        result = import_reminders(Session(), file, args.format or guess_format(args.file),
+                                  args.chunk_size)
+    print(json.dumps(result, ensure_ascii = False, indent = 2))
@@ -1,67 +1,220 @@
-'''Module responsible for application logging'''
+'''
+    Module responsible for application logging. Loggers only put records on
+    an in-memory queue; a background QueueListener per logger does the
+    formatting and the console and file writes, so request threads never
+    wait on disk. Nothing is configured at import: create_app and the
+    command line entry points call configure_logging(), which reads the
+    environment variables:
+
+        LOG_LEVEL         minimum level (INFO)
+        LOG_FORMAT        text or json (text)
+        LOG_MAX_BYTES     size that rotates the log files (10 MiB)
+        LOG_BACKUP_COUNT  rotated files kept (10)
+        LOG_ROTATE_WHEN   rotate by time instead of size (e.g. midnight)
+        LOG_SAMPLING      fraction kept of the INFO/DEBUG records, per
+                          logger, e.g. logger=0.1,gunicorn.access=0.01
+
+    Under gunicorn, gunicorn.error and, when the access log is enabled,
+    gunicorn.access go through the queue as well.
+'''
 from logging.config import dictConfig
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import copy
+import itertools
+import json
 import logging
 import os
+import queue
+import threading
 
 LOG_PATH = 'log/'
-if not os.path.exists(LOG_PATH):
-    os.makedirs(LOG_PATH)
-
-dictConfig({
-    "version": 1,
-    "disable_existing_loggers": True,
-    "formatters": {
-        "default": {
-            "format": "[%(asctime)s] %(levelname)-4s %(funcName)s() L%(lineno)-4d %(message)s",
-        },
-        "detailed": {
-            "format": "[%(asctime)s] %(levelname)-4s %(funcName)s() L%(lineno)-4d %(message)s - call_trace=%(pathname)s L%(lineno)-4d",
+
+listeners = []
+
+
+class JsonFormatter(logging.Formatter):
+    '''
+        Formata cada registro como um objeto JSON em uma linha.
+    '''
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'function': record.funcName,
+            'line': record.lineno,
+            'message': record.getMessage(),
         }
-    },
-    "handlers": {
-        "console": {
-            "class": "logging.StreamHandler",
-            "formatter": "default",
-            "stream": "ext://sys.stdout",
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii = False)
+
+
+class SamplingFilter(logging.Filter):
+    '''
+        Mantém apenas uma fração dos registros INFO/DEBUG dos loggers
+        configurados, contando cada linha de log separadamente. Avisos e
+        erros nunca são descartados.
+    '''
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(record.name)
+        if rate is None or rate >= 1 or record.levelno >= logging.WARNING:
+            return True
+        if rate <= 0:
+            return False
+        key = (record.name, record.pathname, record.lineno)
+        counter = self._counters.get(key)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(key, itertools.count())
+        return next(counter) % round(1 / rate) == 0
+
+
+class LogQueueHandler(QueueHandler):
+    '''
+        QueueHandler que mantém o traceback separado da mensagem, para que
+        cada formatter do listener o apresente à sua maneira.
+    '''
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_sampling(value: str) -> dict:
+    '''
+        Converte 'logger=0.1,gunicorn.access=0.01' em {nome: fração}.
+    '''
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, rate = item.partition('=')
+        rates[name.strip()] = float(rate)
+    return rates
+
+def file_handler(filename: str, log_format: str) -> dict:
+    '''
+        Configuração de um arquivo de log rotacionado por tamanho ou, com
+        LOG_ROTATE_WHEN, por tempo.
+    '''
+    handler = {
+        "formatter": "json" if log_format == 'json' else "detailed",
+        "filename": os.path.join(LOG_PATH, filename),
+        "backupCount": int(os.environ.get('LOG_BACKUP_COUNT', 10)),
+        "delay": True,
+        "encoding": "utf-8",
+    }
+    rotate_when = os.environ.get('LOG_ROTATE_WHEN')
+    if rotate_when:
+        handler.update({"class": "logging.handlers.TimedRotatingFileHandler",
+                        "when": rotate_when})
+    else:
+        handler.update({"class": "logging.handlers.RotatingFileHandler",
+                        "maxBytes": int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))})
+    return handler
+
+def use_queue(target: logging.Logger, sampling: logging.Filter) -> QueueListener:
+    '''
+        Troca os handlers do logger por um QueueHandler e inicia uma thread
+        que repassa os registros da fila aos handlers originais.
+    '''
+    handlers = list(target.handlers)
+    records = queue.SimpleQueue()
+    queue_handler = LogQueueHandler(records)
+    queue_handler.addFilter(sampling)
+    for handler in handlers:
+        target.removeHandler(handler)
+    target.addHandler(queue_handler)
+    listener = QueueListener(records, *handlers, respect_handler_level = True)
+    listener.start()
+    return listener
+
+def configure_logging() -> None:
+    '''
+        Configura os handlers e inicia as threads de escrita. Chamadas
+        seguintes não têm efeito.
+    '''
+    if listeners:
+        return
+    if not os.path.exists(LOG_PATH):
+        os.makedirs(LOG_PATH)
+    level = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    log_format = os.environ.get('LOG_FORMAT', 'text')
+
+    dictConfig({
+        "version": 1,
+        # Module loggers are created at import, before this configuration
+        "disable_existing_loggers": False,
+        "formatters": {
+            "default": {
+                "format": "[%(asctime)s] %(levelname)-4s %(funcName)s() L%(lineno)-4d %(message)s",
+            },
+            "detailed": {
+                "format": "[%(asctime)s] %(levelname)-4s %(funcName)s() L%(lineno)-4d %(message)s - call_trace=%(pathname)s L%(lineno)-4d",
+            },
+            "json": {
+                "()": JsonFormatter,
+            }
         },
-        # "email": {
-        #     "class": "logging.handlers.SMTPHandler",
-        #     "formatter": "default",
-        #     "level": "ERROR",
-        #     "mailhost": ("smtp.example.com", 587),
-        #     "fromaddr": "devops@example.com",
-        #     "toaddrs": ["receiver@example.com", "receiver2@example.com"],
-        #     "subject": "Error Logs",
-        #     "credentials": ("username", "password"),
-        # },
-        "error_file": {
-            "class": "logging.handlers.RotatingFileHandler",
-            "formatter": "detailed",
-            "filename": "log/error.log",
-            "maxBytes": 10000,
-            "backupCount": 10,
-            "delay": "True",
+        "handlers": {
+            "console": {
+                "class": "logging.StreamHandler",
+                "formatter": "json" if log_format == 'json' else "default",
+                "stream": "ext://sys.stdout",
+            },
+            # "email": {
+            #     "class": "logging.handlers.SMTPHandler",
+            #     "formatter": "default",
+            #     "level": "ERROR",
+            #     "mailhost": ("smtp.example.com", 587),
+            #     "fromaddr": "devops@example.com",
+            #     "toaddrs": ["receiver@example.com", "receiver2@example.com"],
+            #     "subject": "Error Logs",
+            #     "credentials": ("username", "password"),
+            # },
+            "error_file": file_handler("error.log", log_format),
+            "detailed_file": file_handler("detailed.log", log_format),
         },
-        "detailed_file": {
-            "class": "logging.handlers.RotatingFileHandler",
-            "formatter": "detailed",
-            "filename": "log/detailed.log",
-            "maxBytes": 10000,
-            "backupCount": 10,
-            "delay": "True",
-        }
-    },
-    "loggers": {
-        "gunicorn.error": {
-            "handlers": ["console", "error_file"],  #, email],
-            "level": "INFO",
-            "propagate": False,
+        "loggers": {
+            "gunicorn.error": {
+                "handlers": ["console", "error_file"],  #, email],
+                "level": level,
+                "propagate": False,
+            }
+        },
+        "root": {
+            "handlers": ["console", "detailed_file"],
+            "level": level,
         }
-    },
-    "root": {
-        "handlers": ["console", "detailed_file"],
-        "level": "INFO",
-    }
-})
+    })
+
+    names = ['gunicorn.error', None]
+    # gunicorn gives gunicorn.access its own handlers only when the access
+    # log is enabled (GUNICORN_ACCESS_LOG); those move behind the queue too
+    if logging.getLogger('gunicorn.access').handlers:
+        names.append('gunicorn.access')
+    sampling_filter = SamplingFilter(parse_sampling(os.environ.get('LOG_SAMPLING', '')))
+    listeners.extend(use_queue(logging.getLogger(name), sampling_filter) for name in names)
+    atexit.register(stop_listeners)
+
+def stop_listeners():
+    '''
+        Escreve os registros pendentes na fila antes de o processo terminar.
+    '''
+    for listener in listeners:
+        listener.stop()
+
 
 logger = logging.getLogger(__name__)
@@ -0,0 +1,162 @@
+'''
+    Module responsible for the application metrics: per-route latency, SQL
+    statements per request and SMTP connect/send durations, kept in memory
+    and rendered in the Prometheus text format by the /metrics route. Each
+    observation is a bisect and a few additions under a lock, so recording
+    is cheap enough to stay always on. Values are per process; under
+    gunicorn every worker exposes its own series.
+'''
+import threading
+from bisect import bisect_left
+from typing import Tuple
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 500, 1000)
+
+
+def escape(value) -> str:
+    '''
+        Escapa o valor de um rótulo.
+    '''
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    '''
+        Monta o trecho {nome="valor",...} de uma série.
+    '''
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def format_value(value: float) -> str:
+    '''
+        Formata um número no padrão do Prometheus.
+    '''
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter():
+    '''
+        Contador monotônico, com uma série por combinação de rótulos.
+    '''
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        '''
+            Incrementa a série dos rótulos informados.
+        '''
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        '''
+            Linhas da métrica no formato texto do Prometheus.
+        '''
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            lines.append(f'{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}')
+        return lines
+
+
+class Histogram():
+    '''
+        Histograma com buckets fixos, com uma série por combinação de
+        rótulos.
+    '''
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        '''
+            Registra uma observação na série dos rótulos informados.
+        '''
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # [count per bucket (+Inf last), sum]
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> list:
+        '''
+            Linhas da métrica no formato texto do Prometheus, com os buckets
+            acumulados.
+        '''
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                bucket_label = 'le="%s"' % format_value(bound)
+                lines.append(f'{self.name}_bucket'
+                             f'{format_labels(self.labelnames, labels, bucket_label)} {cumulative}')
+            label_text = format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_text} {format_value(total)}')
+            lines.append(f'{self.name}_count{label_text} {cumulative}')
+        return lines
+
+
+class Registry():
+    '''
+        Conjunto das métricas expostas pela aplicação.
+    '''
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        '''
+            Adiciona uma métrica ao registro e a retorna.
+        '''
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        '''
+            Todas as métricas no formato texto do Prometheus.
+        '''
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    'http_requests_total', 'Requests handled, by route, method and status.',
+    ('method', 'route', 'status')))
+http_request_duration = registry.register(Histogram(
+    'http_request_duration_seconds', 'Time to handle a request, until the response is ready.',
+    ('method', 'route')))
+sql_statements_per_request = registry.register(Histogram(
+    'sql_statements_per_request', 'SQL statements executed per request.',
+    ('method', 'route'), COUNT_BUCKETS))
+sql_duration_per_request = registry.register(Histogram(
+    'sql_duration_per_request_seconds', 'Time spent executing SQL statements per request.',
+    ('method', 'route')))
+smtp_connect_duration = registry.register(Histogram(
+    'smtp_connect_duration_seconds', 'Time to open and authenticate an SMTP session.'))
+smtp_send_duration = registry.register(Histogram(
+    'smtp_send_duration_seconds', 'Time to send one message over an open SMTP session.'))
+smtp_errors = registry.register(Counter(
+    'smtp_errors_total', 'SMTP connections (stage=connect) or messages (stage=send) that failed.', ('stage',)))
@@ -1,24 +1,144 @@
-'''Module responsible for initializing the database'''
+'''
+    Module responsible for initializing the database. Nothing is created at
+    import: the engine is built, and the schema created or upgraded, on the
+    first use of get_engine() or Session(), or explicitly by
+    configure_engine(), called by create_app. The URL and pool settings
+    come from the environment (DB_URL, DB_POOL_*, SQLITE_*):
+
+        python -m model    # creates or upgrades the schema and exits
+'''
 import os
-from sqlalchemy_utils import database_exists, create_database
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+import threading
+from typing import Optional
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.orm import Session as OrmSession
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy import create_engine, event
 
 from model.base import Base
 from model.email import Email
 from model.email_client import EmailClient
+from model.email_outbox import EmailOutbox, EmailOutboxReminder
+from model.idempotency import IdempotencyKey
 from model.reminder import Reminder
+from model.statement_counter import statement_counter
+from model.migrations import upgrade
+
+DEFAULT_DB_URL = 'sqlite:///database/db.sqlite3'
+
+_engine: Optional[Engine] = None
+_engine_lock = threading.RLock()
+_session_factory = sessionmaker()
+
+
+def sqlite_pragmas() -> dict:
+    '''
+        Configurações do SQLite aplicadas a cada nova conexão. WAL permite
+        leituras concorrentes com uma escrita, e busy_timeout faz a escrita
+        esperar pelo lock em vez de falhar com "database is locked".
+    '''
+    return {
+        'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 268435456)),
+        'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),
+        'foreign_keys': 'OFF',
+    }
+
+def create_db_engine(url: str) -> Engine:
+    '''
+        Cria o engine da URL informada, com o pool configurado por DB_POOL_*
+        e, para SQLite, os PRAGMAs aplicados a cada conexão.
+    '''
+    options = {
+        'echo': False,
+        'poolclass': QueuePool,
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', -1)),
+        'pool_pre_ping': False,
+    }
+    sqlite = make_url(url).get_backend_name() == 'sqlite'
+    if sqlite:
+        pragmas = sqlite_pragmas()
+        # Pooled connections are handed to whichever thread checks them out
+        options['connect_args'] = {'check_same_thread': False,
+                                   'timeout': pragmas['busy_timeout'] / 1000}
+    engine = create_engine(url, **options)
+    statement_counter.listen(engine)
+
+    if sqlite:
+        @event.listens_for(engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            '''
+                Aplica as configurações do SQLite a cada nova conexão do pool.
+            '''
+            cursor = dbapi_connection.cursor()
+            for pragma, value in pragmas.items():
+                cursor.execute(f'PRAGMA {pragma} = {value}')
+            cursor.close()
+    return engine
+
+def init_schema(engine: Engine) -> None:
+    '''
+        Cria o banco, se necessário, e as tabelas, e aplica as migrações.
+    '''
+    url = engine.url
+    if url.get_backend_name() == 'sqlite':
+        # SQLite creates the file on connect; only its directory is needed
+        directory = os.path.dirname(url.database or '')
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok = True)
+    else:
+        from sqlalchemy_utils import database_exists, create_database
+        if not database_exists(url):
+            create_database(url)
+    Base.metadata.create_all(engine)
+    upgrade(engine)
 
-DB_PATH = 'database/'
-if not os.path.exists(DB_PATH):
-    os.makedirs(DB_PATH)
+def configure_engine(url: str = None, create_schema: bool = None) -> Engine:
+    '''
+        Cria o engine usado por Session, substituindo um anterior. A URL
+        padrão é DB_URL; o schema é criado ou atualizado a menos que
+        create_schema (ou DB_INIT_SCHEMA=0) indique que outro processo já o
+        faz, como um passo de deploy com python -m model.
+    '''
+    global _engine
+    url = url or os.environ.get('DB_URL', DEFAULT_DB_URL)
+    if create_schema is None:
+        create_schema = os.environ.get('DB_INIT_SCHEMA', '1') == '1'
+    with _engine_lock:
+        engine = create_db_engine(url)
+        if create_schema:
+            init_schema(engine)
+        previous, _engine = _engine, engine
+        _session_factory.configure(bind = engine)
+    Session.remove()
+    if previous is not None:
+        previous.dispose()
+    return engine
 
-DB_URL = 'sqlite:///%s/db.sqlite3' % DB_PATH
-engine = create_engine(DB_URL, echo = False)
+def get_engine() -> Engine:
+    '''
+        Retorna o engine configurado, criando-o no primeiro uso.
+    '''
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                configure_engine()
+    return _engine
 
-Session = sessionmaker(bind = engine)
+def create_session() -> OrmSession:
+    '''
+        Abre uma sessão no engine configurado, criando-o no primeiro uso.
+    '''
+    get_engine()
+    return _session_factory()
 
-if not database_exists(engine.url):
-    create_database(engine.url)
 
-Base.metadata.create_all(engine)
+# One session per thread: each request (and each background worker) gets its
+# own session, released by Session.remove() at the end of the request
+Session = scoped_session(create_session)
@@ -0,0 +1,6 @@
+'''Creates or upgrades the database schema of DB_URL and exits: python -m model'''
+from logger import configure_logging
+from model import configure_engine
+
+configure_logging()
+configure_engine(create_schema = True)
@@ -0,0 +1,332 @@
+'''
+    Module responsible for bulk reminder writes. Rows are written with
+    executemany statements in chunked transactions, and the failure of one
+    item is reported without aborting the rest of the batch.
+'''
+import os
+import json
+from datetime import datetime
+from typing import List, Tuple
+from sqlalchemy import insert, update, delete, bindparam, select
+from sqlalchemy.exc import IntegrityError
+from unidecode import unidecode
+from model.email import Email
+from model.email_outbox import KIND_CREATED, KIND_UPDATED, STATUS_PENDING, \
+                               notification_key, queue_notifications
+from model.reminder import Reminder
+from model.recurrence import first_due_at
+from model.upsert import upsert
+
+DUPLICATE_NAME = 'Lembrete de mesmo nome já salvo na base :/'
+NOT_FOUND = 'Lembrete não encontrado :/'
+WRITE_CONFLICT = 'Conflito ao gravar o lembrete, tente novamente'
+
+# Columns overwritten when an upserted reminder already exists
+UPSERT_COLUMNS = ('name', 'description', 'due_date', 'send_email', 'recurring', 'recurrence',
+                  'recurrence_interval', 'next_due_at')
+
+reminder_table = Reminder.__table__
+email_table = Email.__table__
+
+
+def bulk_chunk_size() -> int:
+    '''
+        Tamanho padrão dos blocos, lido de BULK_CHUNK_SIZE no momento do uso,
+        para que valha o .env carregado por create_app.
+    '''
+    return int(os.environ.get('BULK_CHUNK_SIZE', 500))
+
+def chunks(items: list, size: int = None):
+    '''
+        Divide a lista de itens em blocos de até size elementos.
+    '''
+    size = size or bulk_chunk_size()
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def outbox_row(kind: str, reminder_id: int, values: dict) -> dict:
+    '''
+        Linha da fila de emails para um lembrete escrito em lote.
+    '''
+    now = datetime.now()
+    payload = {
+        'name': values['name'],
+        'description': values['description'],
+        'due_date': values['due_date'].strftime('%d/%m/%Y'),
+    }
+    return {
+        'reminder_id': reminder_id,
+        'kind': kind,
+        'email_receiver': values['email'],
+        'payload': json.dumps(payload),
+        'notification_key': notification_key(reminder_id, kind, values['email'], payload),
+        'status': STATUS_PENDING,
+        'attempts': 0,
+        'next_attempt_at': now,
+        'created_at': now,
+    }
+
+def schedule_values(values: dict, now: datetime) -> dict:
+    '''
+        Colunas de recorrência de um lembrete escrito em lote, com a próxima
+        ocorrência calculada como em Reminder.schedule.
+    '''
+    recurrence = values.get('recurrence')
+    interval = values.get('recurrence_interval') or 1
+    return {
+        'recurring': bool(values.get('recurring') or recurrence),
+        'recurrence': recurrence,
+        'recurrence_interval': interval,
+        'next_due_at': first_due_at(values['due_date'], recurrence, interval, now),
+    }
+
+def wants_email(values: dict) -> bool:
+    '''
+        Mesma regra de Reminder.validate_email_before_send para um lembrete
+        escrito em lote.
+    '''
+    return bool(values.get('send_email') and values.get('email'))
+
+def _insert_chunk(session, chunk: List[Tuple[int, dict]]) -> List[int]:
+    '''
+        Insere um bloco de lembretes válidos e sem conflito de nome, com
+        seus emails e emails de criação. Retorna os ids criados.
+    '''
+    now = datetime.now()
+    session.execute(insert(reminder_table), [{
+        'name': values['name'],
+        'name_normalized': unidecode(values['name'].lower()),
+        'description': values['description'],
+        'due_date': values['due_date'],
+        'send_email': values['send_email'],
+        **schedule_values(values, now),
+        'created_at': now,
+    } for _, values in chunk])
+    ids = dict(session.execute(
+        select(reminder_table.c.name, reminder_table.c.pk_reminder)
+        .where(reminder_table.c.name.in_([values['name'] for _, values in chunk]))).all())
+    session.execute(insert(email_table), [{
+        'email': values['email'],
+        'reminder': ids[values['name']],
+        'created_at': now,
+    } for _, values in chunk])
+    queue_notifications(session, [outbox_row(KIND_CREATED, ids[values['name']], values)
+                                  for _, values in chunk if wants_email(values)])
+    return [ids[values['name']] for _, values in chunk]
+
+def bulk_create(session, items: List[Tuple[int, dict]],
+                chunk_size: int = None) -> Tuple[List[int], List[dict]]:
+    '''
+        Cria lembretes em lote, com uma transação por bloco de chunk_size
+        itens. Recebe tuplas (posição no lote, valores) e retorna os ids
+        criados e a lista de erros por item.
+    '''
+    created, errors = [], []
+    for chunk in chunks(items, chunk_size):
+        # name and name_normalized are both unique
+        normalized = [unidecode(values['name'].lower()) for _, values in chunk]
+        seen = set(session.execute(
+            select(reminder_table.c.name_normalized)
+            .where(reminder_table.c.name_normalized.in_(normalized))).scalars())
+        accepted = []
+        for (index, values), name_normalized in zip(chunk, normalized):
+            if name_normalized in seen:
+                errors.append({'index': index, 'mensagem': DUPLICATE_NAME})
+                continue
+            seen.add(name_normalized)
+            accepted.append((index, values))
+        if not accepted:
+            continue
+        try:
+            created.extend(_insert_chunk(session, accepted))
+            session.commit()
+        except IntegrityError:
+            # A concurrent write conflicted with the chunk: retry item by item
+            # so that only the conflicting reminders are rejected
+            session.rollback()
+            for index, values in accepted:
+                try:
+                    created.extend(_insert_chunk(session, [(index, values)]))
+                    session.commit()
+                except IntegrityError:
+                    session.rollback()
+                    errors.append({'index': index, 'mensagem': DUPLICATE_NAME})
+    return created, errors
+
+def is_unchanged(current, values: dict) -> bool:
+    '''
+        Indica se o lembrete salvo (linha com o email) já tem os valores
+        enviados, caso em que o upsert não escreve nada.
+    '''
+    recurrence = values.get('recurrence')
+    return (current.name == values['name']
+            and current.description == values['description']
+            and current.due_date == values['due_date']
+            and bool(current.send_email) == bool(values['send_email'])
+            and bool(current.recurring) == bool(values.get('recurring') or recurrence)
+            and current.recurrence == recurrence
+            and (current.recurrence_interval or 1) == (values.get('recurrence_interval') or 1)
+            and current.email == values['email'])
+
+def _upsert_chunk(session, chunk: List[Tuple[str, dict]], existing: set) -> dict:
+    '''
+        Grava com um único upsert um bloco de lembretes novos ou alterados,
+        com seus emails e emails de criação ou atualização. Retorna os ids
+        por nome normalizado.
+    '''
+    now = datetime.now()
+    upsert(session, reminder_table, [{
+        'name': values['name'],
+        'name_normalized': name_normalized,
+        'description': values['description'],
+        'due_date': values['due_date'],
+        'send_email': values['send_email'],
+        **schedule_values(values, now),
+        'created_at': now,
+    } for name_normalized, values in chunk], 'name_normalized', UPSERT_COLUMNS,
+        {'updated_at': now})
+    ids = dict(session.execute(
+        select(reminder_table.c.name_normalized, reminder_table.c.pk_reminder)
+        .where(reminder_table.c.name_normalized.in_([name for name, _ in chunk]))).all())
+    # Checked after the upsert: a reminder created concurrently already has its email
+    with_email = set(session.execute(
+        select(email_table.c.reminder).where(email_table.c.reminder.in_(ids.values()))).scalars())
+    updates = [{'b_id': ids[name], 'email': values['email']}
+               for name, values in chunk if ids[name] in with_email]
+    if updates:
+        session.execute(
+            update(email_table).where(email_table.c.reminder == bindparam('b_id')), updates)
+    inserts = [{'email': values['email'], 'reminder': ids[name], 'created_at': now}
+               for name, values in chunk if ids[name] not in with_email]
+    if inserts:
+        session.execute(insert(email_table), inserts)
+    queue_notifications(session, [
+        outbox_row(KIND_UPDATED if name in existing else KIND_CREATED, ids[name], values)
+        for name, values in chunk if wants_email(values)])
+    return ids
+
+def bulk_upsert(session, items: List[Tuple[int, dict]],
+                chunk_size: int = None) -> Tuple[List[int], List[int], List[dict]]:
+    '''
+        Cria ou, quando já existe um lembrete de mesmo nome normalizado,
+        atualiza lembretes em lote, com uma transação por bloco. Lembretes
+        já iguais aos enviados são apenas lidos, sem escrita nem email.
+        Retorna os ids gravados, os ids já atualizados e a lista de erros
+        por item.
+    '''
+    written, unchanged, errors = [], [], []
+    for chunk in chunks(items, chunk_size):
+        # A name repeated in the chunk is written once, with its last values
+        by_name = {unidecode(values['name'].lower()): (index, values) for index, values in chunk}
+        current = {row.name_normalized: row for row in session.execute(
+            select(reminder_table.c.pk_reminder, email_table.c.email,
+                   *[reminder_table.c[column] for column in ('name_normalized',) + UPSERT_COLUMNS])
+            .outerjoin(email_table, email_table.c.reminder == reminder_table.c.pk_reminder)
+            .where(reminder_table.c.name_normalized.in_(by_name)))}
+        changed = []
+        for name_normalized, (index, values) in by_name.items():
+            if name_normalized in current and is_unchanged(current[name_normalized], values):
+                unchanged.append(current[name_normalized].pk_reminder)
+            else:
+                changed.append((name_normalized, values))
+        if not changed:
+            continue
+        try:
+            ids = _upsert_chunk(session, changed, set(current))
+            session.commit()
+            written.extend(ids[name] for name, _ in changed)
+        except IntegrityError:
+            session.rollback()
+            errors.extend({'index': by_name[name][0], 'mensagem': WRITE_CONFLICT}
+                          for name, _ in changed)
+    return written, unchanged, errors
+
+def _update_chunk(session, chunk: List[Tuple[int, dict]]) -> None:
+    '''
+        Atualiza um bloco de lembretes já carregados, com seus emails e
+        emails de atualização.
+    '''
+    now = datetime.now()
+    session.execute(
+        update(reminder_table).where(reminder_table.c.pk_reminder == bindparam('b_id')),
+        [{
+            'b_id': values['id'],
+            'name': values['name'],
+            'name_normalized': unidecode(values['name'].lower()),
+            'description': values['description'],
+            'due_date': values['due_date'],
+            'send_email': values['send_email'],
+            **schedule_values(values, now),
+            'updated_at': values['updated_at'],
+        } for _, values in chunk])
+    session.execute(
+        update(email_table).where(email_table.c.reminder == bindparam('b_id')),
+        [{'b_id': values['id'], 'email': values['email']} for _, values in chunk])
+    # Repeating the same change does not queue the same email again
+    queue_notifications(session, [outbox_row(KIND_UPDATED, values['id'], values)
+                                  for _, values in chunk if wants_email(values)])
+
+def bulk_update(session, items: List[Tuple[int, dict]]) -> Tuple[List[int], List[dict]]:
+    '''
+        Atualiza lembretes em lote. Apenas os campos presentes em cada item
+        são alterados. Retorna os ids atualizados e a lista de erros por item.
+    '''
+    updated, errors = [], []
+    columns = ('name', 'description', 'due_date', 'send_email', 'recurring',
+               'recurrence', 'recurrence_interval')
+    for chunk in chunks(items):
+        ids = [values['id'] for _, values in chunk]
+        current = {row.pk_reminder: row._asdict() for row in session.execute(
+            select(reminder_table.c.pk_reminder, email_table.c.email,
+                   *[reminder_table.c[column] for column in columns])
+            .outerjoin(email_table, email_table.c.reminder == reminder_table.c.pk_reminder)
+            .where(reminder_table.c.pk_reminder.in_(ids)))}
+        accepted = []
+        now = datetime.now()
+        for index, values in chunk:
+            if values['id'] not in current:
+                errors.append({'index': index, 'mensagem': NOT_FOUND})
+                continue
+            merged = dict(current[values['id']])
+            merged.update({key: value for key, value in values.items() if value is not None})
+            merged['updated_at'] = now
+            accepted.append((index, merged))
+        if not accepted:
+            continue
+        try:
+            _update_chunk(session, accepted)
+            session.commit()
+            updated.extend(values['id'] for _, values in accepted)
+        except IntegrityError:
+            session.rollback()
+            for index, values in accepted:
+                try:
+                    _update_chunk(session, [(index, values)])
+                    session.commit()
+                    updated.append(values['id'])
+                except IntegrityError:
+                    session.rollback()
+                    errors.append({'index': index, 'mensagem': DUPLICATE_NAME})
+    return updated, errors
+
+def bulk_delete(session, ids: List[int]) -> Tuple[List[dict], List[dict]]:
+    '''
+        Remove lembretes em lote. Retorna id e nome dos lembretes removidos e
+        a lista de erros por item.
+    '''
+    deleted, errors = [], []
+    indexed = list(enumerate(ids))
+    for chunk in chunks(indexed):
+        chunk_ids = [reminder_id for _, reminder_id in chunk]
+        names = dict(session.execute(
+            select(reminder_table.c.pk_reminder, reminder_table.c.name)
+            .where(reminder_table.c.pk_reminder.in_(chunk_ids))).all())
+        session.execute(delete(email_table).where(email_table.c.reminder.in_(names)))
+        session.execute(delete(reminder_table).where(reminder_table.c.pk_reminder.in_(names)))
+        session.commit()
+        for index, reminder_id in chunk:
+            if reminder_id in names:
+                deleted.append({'id': reminder_id, 'name': names.pop(reminder_id)})
+            else:
+                errors.append({'index': index, 'mensagem': NOT_FOUND})
+    return deleted, errors
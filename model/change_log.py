@@ -0,0 +1,164 @@
+'''
+    Module responsible for the reminder change log, written by triggers on
+    every insert, visible update and delete of a reminder (and update of its
+    email), whatever route or process made it. Each change gets a
+    monotonically increasing seq, used by clients as the cursor of the
+    /changes feed, so they sync deltas instead of re-reading /reminders.
+    The feed is compacted: a reminder changed many times since the cursor is
+    returned once, with its current state, or as a tombstone if deleted.
+    Old changes superseded by a later one are purged, as are old tombstones;
+    a cursor older than a purged tombstone must resync. The triggers are
+    SQLite only; on other databases there is no change log.
+'''
+import os
+from datetime import datetime, timedelta
+from typing import List, Tuple, Dict
+from sqlalchemy import text
+from sqlalchemy.engine import Engine, Row
+from model.reminder import Reminder
+from model.reminder_query import reminder_rows
+from model.change_version import VIEW_COLUMNS
+from logger import logger
+
+CHANGE_TABLE = 'reminder_change'
+# Single row with the seq of the newest purged tombstone
+HORIZON_TABLE = 'reminder_change_horizon'
+OPERATION_UPSERT = 'upsert'
+OPERATION_DELETE = 'delete'
+
+CHANGES_KEEPALIVE = 15
+
+# Walks the seq range after the cursor and keeps the rows with no later
+# change of the same reminder, stopping at limit. A GROUP BY reminder_id
+# would read the whole (reminder_id, seq) index even at the latest cursor.
+CHANGES_SINCE = f'''
+    SELECT reminder_id, seq AS last_seq FROM {CHANGE_TABLE} AS change
+    WHERE seq > :since AND NOT EXISTS (
+        SELECT 1 FROM {CHANGE_TABLE} AS later
+        WHERE later.reminder_id = change.reminder_id AND later.seq > change.seq)
+    ORDER BY seq LIMIT :limit
+'''
+
+LOG_CHANGE = f'''
+    INSERT INTO {CHANGE_TABLE} (reminder_id, operation, changed_at)
+    VALUES (%s, '%s', CURRENT_TIMESTAMP);
+'''
+CREATE_CHANGE_TRIGGERS = (
+    f'CREATE TRIGGER IF NOT EXISTS reminder_change_insert AFTER INSERT ON reminder '
+    f'BEGIN {LOG_CHANGE % ("NEW.pk_reminder", OPERATION_UPSERT)} END',
+    f'CREATE TRIGGER IF NOT EXISTS reminder_change_delete AFTER DELETE ON reminder '
+    f'BEGIN {LOG_CHANGE % ("OLD.pk_reminder", OPERATION_DELETE)} END',
+    # Recreated on every start, so that databases keep up with VIEW_COLUMNS
+    'DROP TRIGGER IF EXISTS reminder_change_update',
+    f'CREATE TRIGGER reminder_change_update AFTER UPDATE OF {VIEW_COLUMNS} ON reminder '
+    f'BEGIN {LOG_CHANGE % ("NEW.pk_reminder", OPERATION_UPSERT)} END',
+    f'CREATE TRIGGER IF NOT EXISTS email_change_update AFTER UPDATE OF email ON email '
+    f'BEGIN {LOG_CHANGE % ("NEW.reminder", OPERATION_UPSERT)} END',
+)
+
+
+class ExpiredCursor(ValueError):
+    '''Raised when the changes after a cursor were already purged'''
+
+
+def changes_settings() -> dict:
+    '''
+        Configuração do feed de alterações lida das variáveis de ambiente no
+        momento do uso, para que valha o .env carregado por create_app.
+    '''
+    return {
+        # Changes older than this are purged; older cursors must resync
+        'retention': timedelta(days = float(os.environ.get('CHANGES_RETENTION_DAYS', 7))),
+        'poll_interval': float(os.environ.get('CHANGES_POLL_INTERVAL', 0.5)),
+        # Server-sent event streams end after this many seconds; clients
+        # reconnect with Last-Event-ID
+        'stream_timeout': float(os.environ.get('CHANGES_STREAM_TIMEOUT', 300)),
+    }
+
+def has_change_log(bind) -> bool:
+    '''
+        Indica se o banco do engine ou conexão tem o registro de alterações.
+    '''
+    return bind.dialect.name == 'sqlite'
+
+def create_change_log(engine: Engine) -> None:
+    '''
+        Cria a tabela de alterações e os triggers que a preenchem. Em um
+        banco existente, registra uma alteração para cada lembrete já salvo,
+        para que a sincronização a partir do início os inclua.
+    '''
+    if not has_change_log(engine):
+        return
+    with engine.begin() as connection:
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (CHANGE_TABLE,)).first()
+        if not exists:
+            connection.exec_driver_sql(
+                f'CREATE TABLE {CHANGE_TABLE} ('
+                f'seq INTEGER PRIMARY KEY AUTOINCREMENT, reminder_id INTEGER NOT NULL, '
+                f'operation VARCHAR(10) NOT NULL, changed_at DATETIME NOT NULL)')
+            connection.exec_driver_sql(
+                f'CREATE INDEX ix_{CHANGE_TABLE}_changed_at ON {CHANGE_TABLE} (changed_at)')
+            connection.exec_driver_sql(
+                f'CREATE INDEX ix_{CHANGE_TABLE}_reminder_id ON {CHANGE_TABLE} (reminder_id, seq)')
+            logged = connection.exec_driver_sql(
+                f"INSERT INTO {CHANGE_TABLE} (reminder_id, operation, changed_at) "
+                f"SELECT pk_reminder, '{OPERATION_UPSERT}', CURRENT_TIMESTAMP FROM reminder "
+                f"ORDER BY pk_reminder").rowcount
+            logger.info('Criada a tabela de alterações %s com %d lembretes', CHANGE_TABLE, logged)
+        connection.exec_driver_sql(
+            f'CREATE TABLE IF NOT EXISTS {HORIZON_TABLE} (id INTEGER PRIMARY KEY, seq INTEGER NOT NULL)')
+        connection.exec_driver_sql(f'INSERT OR IGNORE INTO {HORIZON_TABLE} (id, seq) VALUES (1, 0)')
+        for trigger in CREATE_CHANGE_TRIGGERS:
+            connection.exec_driver_sql(trigger)
+
+def check_cursor(session, since: int) -> None:
+    '''
+        Lança ExpiredCursor se a remoção de um lembrete posterior ao cursor
+        já foi descartada, caso em que o cliente precisa sincronizar tudo de
+        novo, a partir do cursor 0.
+    '''
+    horizon = session.execute(text(f'SELECT seq FROM {HORIZON_TABLE} WHERE id = 1')).scalar()
+    if 0 < since < (horizon or 0):
+        raise ExpiredCursor(since)
+
+def changes_since(session, since: int, limit: int) -> Tuple[List[Tuple[int, int]], Dict[int, Row]]:
+    '''
+        Busca os lembretes alterados depois do cursor, uma vez cada, em
+        ordem da última alteração, e o estado atual deles. Retorna as tuplas
+        (id, seq da última alteração) e as linhas de reminder_rows por id;
+        os ids sem linha foram removidos.
+    '''
+    changes = session.execute(text(CHANGES_SINCE), {'since': since, 'limit': limit}).all()
+    if not changes:
+        return [], {}
+    ids = [reminder_id for reminder_id, _ in changes]
+    rows = {row.id: row for row in reminder_rows(session).filter(Reminder.id.in_(ids))}
+    return [tuple(change) for change in changes], rows
+
+def purge_changes(session, now: datetime = None) -> int:
+    '''
+        Remove as alterações mais antigas que CHANGES_RETENTION_DAYS que já
+        foram substituídas por uma alteração posterior do mesmo lembrete, e
+        as remoções antigas. A última alteração de cada lembrete existente é
+        mantida, de forma que a sincronização a partir do cursor 0 continua
+        completa. Retorna a quantidade removida.
+    '''
+    if not has_change_log(session.get_bind()):
+        return 0
+    # changed_at is written by the triggers in UTC
+    now = now or datetime.utcnow()
+    params = {'cutoff': (now - changes_settings()['retention']).strftime('%Y-%m-%d %H:%M:%S'),
+              'delete': OPERATION_DELETE}
+    horizon = session.execute(
+        text(f'SELECT MAX(seq) FROM {CHANGE_TABLE} '
+             f'WHERE changed_at < :cutoff AND operation = :delete'), params).scalar()
+    purged = session.execute(
+        text(f'DELETE FROM {CHANGE_TABLE} WHERE changed_at < :cutoff AND ('
+             f'operation = :delete OR seq < (SELECT MAX(later.seq) FROM {CHANGE_TABLE} later '
+             f'WHERE later.reminder_id = {CHANGE_TABLE}.reminder_id))'), params).rowcount
+    if horizon:
+        session.execute(text(f'UPDATE {HORIZON_TABLE} SET seq = MAX(seq, :horizon) WHERE id = 1'),
+                        {'horizon': horizon})
+    session.commit()
+    return purged
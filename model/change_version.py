@@ -0,0 +1,68 @@
+'''
+    Module responsible for the reminder table change version, a counter
+    incremented by triggers on every write to the reminder and email tables.
+    Lets list reads detect that nothing changed without querying the reminders.
+    The triggers are SQLite only; on other databases there is no version.
+'''
+from datetime import datetime, timezone
+from typing import Tuple, Optional
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from logger import logger
+
+VERSION_TABLE = 'reminder_version'
+
+# Columns whose change is visible in the reminder views; scheduler bookkeeping
+# such as notified_due_date does not change the version
+VIEW_COLUMNS = 'name, name_normalized, description, due_date, send_email, recurring, ' \
+               'recurrence, recurrence_interval, updated_at'
+
+BUMP_VERSION = f'''
+    UPDATE {VERSION_TABLE}
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE id = 1;
+'''
+CREATE_VERSION_TRIGGERS = (
+    f'CREATE TRIGGER IF NOT EXISTS reminder_version_insert AFTER INSERT ON reminder '
+    f'BEGIN {BUMP_VERSION} END',
+    f'CREATE TRIGGER IF NOT EXISTS reminder_version_delete AFTER DELETE ON reminder '
+    f'BEGIN {BUMP_VERSION} END',
+    # Recreated on every start, so that databases keep up with VIEW_COLUMNS
+    'DROP TRIGGER IF EXISTS reminder_version_update',
+    f'CREATE TRIGGER reminder_version_update AFTER UPDATE OF {VIEW_COLUMNS} '
+    f'ON reminder BEGIN {BUMP_VERSION} END',
+    f'CREATE TRIGGER IF NOT EXISTS email_version_update AFTER UPDATE OF email ON email '
+    f'BEGIN {BUMP_VERSION} END',
+)
+
+
+def create_change_version(engine: Engine) -> None:
+    '''
+        Cria a tabela de versão e os triggers que a incrementam.
+    '''
+    if engine.dialect.name != 'sqlite':
+        return
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            f'CREATE TABLE IF NOT EXISTS {VERSION_TABLE} ('
+            f'id INTEGER PRIMARY KEY, version INTEGER NOT NULL, updated_at DATETIME)')
+        created = connection.exec_driver_sql(
+            f'INSERT OR IGNORE INTO {VERSION_TABLE} (id, version, updated_at) '
+            f'VALUES (1, 0, CURRENT_TIMESTAMP)').rowcount
+        if created:
+            logger.info('Criada a tabela de versão %s', VERSION_TABLE)
+        for trigger in CREATE_VERSION_TRIGGERS:
+            connection.exec_driver_sql(trigger)
+
+def current_version(session) -> Tuple[Optional[int], Optional[datetime]]:
+    '''
+        Retorna a versão atual da tabela de lembretes e o instante, em UTC,
+        da última alteração, ou None em bancos sem a tabela de versão.
+    '''
+    if session.get_bind().dialect.name != 'sqlite':
+        return None, None
+    version, updated_at = session.execute(
+        text(f'SELECT version, updated_at FROM {VERSION_TABLE} WHERE id = 1')).one()
+    if isinstance(updated_at, str):
+        updated_at = datetime.fromisoformat(updated_at).replace(tzinfo = timezone.utc)
+    return version, updated_at
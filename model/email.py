@@ -12,8 +12,8 @@ class Email(Base):
     id = Column(Integer, primary_key = True)
     email = Column(String(60))
     #relation
-    reminder = Column(Integer, ForeignKey('reminder.pk_reminder'), nullable = False)
-    created_at = Column(DateTime, default = datetime.now())
+    reminder = Column(Integer, ForeignKey('reminder.pk_reminder'), nullable = False, index = True)
+    created_at = Column(DateTime, default = datetime.now)
     updated_at = Column(DateTime, default = None)
 
     def __init__(
@@ -25,7 +25,7 @@ class Email(Base):
             Adiciona um email a um lembrete.
         '''
         self.email = email
-        if not created_at:
+        if created_at:
             self.created_at = created_at
-        if not updated_at:
+        if updated_at:
             self.updated_at = updated_at
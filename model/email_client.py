@@ -1,11 +1,190 @@
 '''Module responsible for email formatting and sending'''
 import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import List, Optional
 from email.message import EmailMessage
 import ssl
 import smtplib
-from dotenv import load_dotenv
+import metrics
+from model.email_templates import KIND_CREATED, KIND_UPDATED, KIND_DUE_DATE, \
+                                  render_reminder, render_digest, build_message
 
-load_dotenv('../.env')
+
+def smtp_settings() -> dict:
+    '''
+        Configuração SMTP lida das variáveis de ambiente no momento do uso,
+        para que valha o .env carregado por create_app.
+    '''
+    return {
+        'host': os.environ.get('SMTP_HOST', 'smtp.gmail.com'),
+        'port': int(os.environ.get('SMTP_PORT', 465)),
+        'use_ssl': os.environ.get('SMTP_SSL', '1') == '1',
+        'timeout': float(os.environ.get('SMTP_TIMEOUT', 30)),
+        # Servers drop idle sessions (gmail after a few minutes), so connections
+        # idle for longer than this are checked with NOOP before being reused
+        'idle_timeout': float(os.environ.get('SMTP_IDLE_TIMEOUT', 60)),
+        'max_size': int(os.environ.get('SMTP_POOL_SIZE', 4)),
+    }
+
+
+class SMTPConnectionPool():
+    '''
+        Mantém sessões SMTP autenticadas abertas para reuso, evitando um novo
+        handshake TLS e login a cada email enviado.
+    '''
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        host: str = None,
+        port: int = None,
+        use_ssl: bool = None,
+        idle_timeout: float = None,
+        max_size: int = None,
+        timeout: float = None):
+        settings = smtp_settings()
+        self.username = username
+        self.password = password
+        self.host = host if host is not None else settings['host']
+        self.port = port if port is not None else settings['port']
+        self.use_ssl = use_ssl if use_ssl is not None else settings['use_ssl']
+        self.idle_timeout = idle_timeout if idle_timeout is not None else settings['idle_timeout']
+        self.max_size = max_size if max_size is not None else settings['max_size']
+        self.timeout = timeout if timeout is not None else settings['timeout']
+        self._context = ssl.create_default_context() if self.use_ssl else None
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> smtplib.SMTP:
+        started = time.perf_counter()
+        try:
+            if self.use_ssl:
+                smtp = smtplib.SMTP_SSL(self.host, self.port, timeout = self.timeout,
+                                        context = self._context)
+            else:
+                smtp = smtplib.SMTP(self.host, self.port, timeout = self.timeout)
+            if self.password:
+                smtp.login(self.username, self.password)
+        except (smtplib.SMTPException, OSError):
+            metrics.smtp_errors.inc('connect')
+            raise
+        metrics.smtp_connect_duration.observe(time.perf_counter() - started)
+        return smtp
+
+    @staticmethod
+    def _close(smtp: smtplib.SMTP) -> None:
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+    @staticmethod
+    def _is_alive(smtp: smtplib.SMTP) -> bool:
+        try:
+            return smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _acquire(self) -> smtplib.SMTP:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                smtp, last_used = self._idle.pop()
+            if time.monotonic() - last_used < self.idle_timeout or self._is_alive(smtp):
+                return smtp
+            self._close(smtp)
+        return self._connect()
+
+    def _release(self, smtp: smtplib.SMTP) -> None:
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append((smtp, time.monotonic()))
+                return
+        self._close(smtp)
+
+    @contextmanager
+    def connection(self):
+        '''
+            Empresta uma conexão autenticada do pool. Conexões que falharem
+            durante o uso são descartadas em vez de devolvidas.
+        '''
+        smtp = self._acquire()
+        try:
+            yield smtp
+        except BaseException:
+            self._close(smtp)
+            raise
+        self._release(smtp)
+
+    def send(self, message: EmailMessage) -> None:
+        '''
+            Envia um único email por uma conexão do pool.
+        '''
+        error = self.send_batch([message])[0]
+        if error:
+            raise error
+
+    def send_batch(self, messages: List[EmailMessage]) -> List[Optional[Exception]]:
+        '''
+            Envia vários emails pela mesma sessão SMTP. Retorna, na ordem das
+            mensagens, None para as enviadas ou a exceção de cada falha. Se o
+            servidor encerrar a sessão no meio do lote, uma nova conexão é
+            aberta para as mensagens restantes.
+        '''
+        results: List[Optional[Exception]] = []
+        reconnected = False
+        while len(results) < len(messages):
+            try:
+                with self.connection() as smtp:
+                    for message in messages[len(results):]:
+                        started = time.perf_counter()
+                        try:
+                            smtp.sendmail(message['From'], message['To'], message.as_string())
+                            results.append(None)
+                        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError,
+                                smtplib.SMTPSenderRefused) as error:
+                            # Refused message: the session is still usable
+                            metrics.smtp_errors.inc('send')
+                            results.append(error)
+                            continue
+                        metrics.smtp_send_duration.observe(time.perf_counter() - started)
+            except (smtplib.SMTPServerDisconnected, OSError) as error:
+                if reconnected:
+                    results.extend([error] * (len(messages) - len(results)))
+                    break
+                reconnected = True
+            except smtplib.SMTPException as error:
+                results.extend([error] * (len(messages) - len(results)))
+        return results
+
+    def close(self) -> None:
+        '''
+            Encerra todas as conexões ociosas do pool.
+        '''
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for smtp, _ in idle:
+            self._close(smtp)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_smtp_pool(username: str, password: str) -> SMTPConnectionPool:
+    '''
+        Retorna o pool de conexões SMTP da conta informada, criando-o no
+        primeiro uso.
+    '''
+    settings = smtp_settings()
+    key = (settings['host'], settings['port'], username)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.password != password:
+            pool = _pools[key] = SMTPConnectionPool(username, password)
+        return pool
 
 
 class EmailClient():
@@ -17,15 +196,34 @@ class EmailClient():
         due_date: str,
         email_receiver: str,
         subject: str = 'Aviso de Lembrete',
-        email_sender: str = os.environ.get('EMAIL_SENDER'),
-        email_password: str = os.environ.get('APP_PASSWORD')):
+        email_sender: str = None,
+        email_password: str = None):
         self.name = name
         self.description = description
         self.due_date = due_date
         self.email_receiver = email_receiver
         self.subject = subject
-        self.email_sender = email_sender
-        self.email_password = email_password
+        self.email_sender = email_sender or os.environ.get('EMAIL_SENDER')
+        self.email_password = email_password or os.environ.get('APP_PASSWORD')
+
+    def prepare_email(
+            self,
+            flag_create: bool = None,
+            flag_update: bool = None,
+            flag_due_date: bool = None) -> EmailMessage:
+        '''
+            Function to create the email, without sending it.
+        '''
+        if flag_update:
+            kind = KIND_UPDATED
+        elif flag_create:
+            kind = KIND_CREATED
+        elif flag_due_date:
+            kind = KIND_DUE_DATE
+        else:
+            raise ValueError('Tipo de email não informado')
+        rendered = render_reminder(kind, self.name, self.description, self.due_date)
+        return build_message(rendered, self.email_sender, self.email_receiver, self.subject)
 
     def prepare_and_send_email(
             self,
@@ -35,64 +233,49 @@ class EmailClient():
         '''
             Function to create the email and send it.
         '''
-        message = EmailMessage()
-        if flag_create or flag_update:
-            term = 'criado' if flag_update is None else 'atualizado'
-            message.set_content(f'''
-                    Olá usuário(a), este é um email automatizado para avisar
-                    que o lembrete nome:  {self.name}, de descrição:
-                    {self.description}, e com data final: {self.due_date},
-                    foi {term}.
-
-                    Atenciosamente,
-                    Aplicativo Lembretes
-                ''')
-            message.add_alternative(f'''\
-            <!DOCTYPE html>
-                <html>
-                    <body>
-                        <h1 style="color:#dd8888;">Lembrete:</h1>
-                            <div><p>Olá usuário(a), este é um email automatizado
-                            para avisar </br> que o lembrete nome: <strong>{self.name}</strong> 
-                            </br> de descrição: <strong>{self.description}</strong>,
-                            e com data final: <strong>{self.due_date}</strong>,
-                            </br> foi {term}.</p>
-                                <p>Atenciosamente,</p>
-                                <p>Aplicativo Lembretes</p>
-                            </div>
-                    </body>
-                </html>
-            ''', subtype = 'html')
-        elif flag_due_date:
-            message.set_content(f'''
-                    Olá usuário(a), este é um email automatizado para avisar
-                    que o lembrete nome:  {self.name}, de descrição:
-                    {self.description}, e com data final: {self.due_date},
-                    está próximo à data estipulada.
-
-                    Atenciosamente,
-                    Aplicativo Lembretes
-                ''')
-            message.add_alternative(f'''\
-            <!DOCTYPE html>
-                <html>
-                    <body>
-                        <h1 style="color:#dd8888;">Lembrete:</h1>
-                            <div><p>Olá usuário(a), este é um email automatizado
-                            para avisar </br> que o lembrete nome: <strong>{self.name}</strong>
-                            </br> de descrição: <strong>{self.description}</strong>,
-                            e com data final: <strong>{self.due_date}</strong>,
-                            </br> está próximo à data estipulada.</p>
-                                <p>Atenciosamente,</p>
-                                <p>Aplicativo Lembretes</p>
-                            </div>
-                    </body>
-                </html>
-            ''', subtype = 'html')
-        message['From'] = self.email_sender
-        message['To'] = self.email_receiver
-        message['Subject'] = self.subject
-        context = ssl.create_default_context()
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465, context=context) as smtp:
-            smtp.login(self.email_sender, self.email_password)
-            smtp.sendmail(self.email_sender, self.email_receiver, message.as_string())
+        message = self.prepare_email(flag_create, flag_update, flag_due_date)
+        self.smtp_pool().send(message)
+
+    def smtp_pool(self) -> SMTPConnectionPool:
+        '''
+            Pool de conexões da conta remetente deste cliente.
+        '''
+        return get_smtp_pool(self.email_sender, self.email_password)
+
+
+class DigestEmailClient():
+    '''
+        Class representing a digest email: one message listing every reminder
+        of the same recipient
+    '''
+    def __init__(
+        self,
+        reminders: List[dict],
+        email_receiver: str,
+        subject: str = 'Aviso de Lembretes',
+        email_sender: str = None,
+        email_password: str = None):
+        self.reminders = reminders
+        self.email_receiver = email_receiver
+        self.subject = subject
+        self.email_sender = email_sender or os.environ.get('EMAIL_SENDER')
+        self.email_password = email_password or os.environ.get('APP_PASSWORD')
+
+    def prepare_email(self) -> EmailMessage:
+        '''
+            Function to create the digest email, without sending it.
+        '''
+        rendered = render_digest(self.reminders)
+        return build_message(rendered, self.email_sender, self.email_receiver, self.subject)
+
+    def prepare_and_send_email(self) -> None:
+        '''
+            Function to create the digest email and send it.
+        '''
+        self.smtp_pool().send(self.prepare_email())
+
+    def smtp_pool(self) -> SMTPConnectionPool:
+        '''
+            Pool de conexões da conta remetente deste cliente.
+        '''
+        return get_smtp_pool(self.email_sender, self.email_password)
@@ -0,0 +1,185 @@
+'''
+    Module responsible for the email outbox model. Sent rows are kept, so the
+    outbox is also the log of the notifications of each reminder, queried
+    by /notifications. Digest emails are linked to each reminder they cover.
+'''
+import json
+import hashlib
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy import Column, String, Integer, DateTime, Text, Index, ForeignKey, select, or_
+from sqlalchemy.orm import relationship, selectinload
+from model import Base
+from model.upsert import insert_ignore
+from model.email_templates import KIND_CREATED, KIND_UPDATED, KIND_DUE_DATE, KIND_DIGEST
+
+STATUS_PENDING = 'pending'
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+
+class EmailOutbox(Base):
+    '''
+        Class representing an email waiting to be delivered. Rows are written
+        in the same transaction as the reminder change that originated them
+        and drained later by the OutboxWorker.
+    '''
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        # Lookup of the rows ready to be claimed by the OutboxWorker
+        Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+        # Notification log of a reminder, newest first
+        Index('ix_email_outbox_reminder_id', 'reminder_id', 'id'),
+        # The same notification is queued only once
+        Index('ix_email_outbox_notification_key', 'notification_key', unique = True),
+    )
+
+    id = Column(Integer, primary_key = True)
+    reminder_id = Column(Integer)
+    kind = Column(String(20), nullable = False)
+    email_receiver = Column(String(60), nullable = False)
+    payload = Column(Text, nullable = False)
+    status = Column(String(10), nullable = False, default = STATUS_PENDING)
+    attempts = Column(Integer, nullable = False, default = 0)
+    next_attempt_at = Column(DateTime, nullable = False, default = datetime.now)
+    last_error = Column(String(255))
+    created_at = Column(DateTime, default = datetime.now)
+    sent_at = Column(DateTime, default = None)
+    # Reminder, kind and version of the notification (see notification_key)
+    notification_key = Column(String(120), default = None)
+    # Reminders covered by a digest email
+    covered_reminders = relationship('EmailOutboxReminder')
+
+    def __init__(
+        self,
+        kind: str,
+        email_receiver: str,
+        payload: dict,
+        reminder_id: int = None,
+        notification_key: str = None):
+        '''
+            Adiciona um email à fila de envio.
+        '''
+        self.kind = kind
+        self.email_receiver = email_receiver
+        self.payload = json.dumps(payload)
+        self.reminder_id = reminder_id
+        self.notification_key = notification_key
+        self.status = STATUS_PENDING
+        self.attempts = 0
+        self.next_attempt_at = datetime.now()
+
+    @classmethod
+    def for_reminder(cls, reminder, kind: str):
+        '''
+            Cria a mensagem da fila a partir dos dados atuais do lembrete. O
+            aviso de prazo final informa a próxima ocorrência.
+        '''
+        due_date = reminder.due_date
+        if kind == KIND_DUE_DATE and reminder.next_due_at:
+            due_date = reminder.next_due_at
+        email_receiver = reminder.email_relationship[0].email
+        payload = {
+            'name': reminder.name,
+            'description': reminder.description,
+            'due_date': due_date.strftime('%d/%m/%Y'),
+        }
+        return cls(
+            kind = kind,
+            email_receiver = email_receiver,
+            payload = payload,
+            reminder_id = reminder.id,
+            notification_key = notification_key(reminder.id, kind, email_receiver,
+                                                 payload, due_date))
+
+    def values(self) -> dict:
+        '''
+            Retorna as colunas preenchidas, para inserção sem o ORM.
+        '''
+        return {column.name: getattr(self, column.key) for column in self.__table__.columns
+                if getattr(self, column.key) is not None}
+
+    def load_payload(self) -> dict:
+        '''
+            Retorna os dados do email salvos na fila.
+        '''
+        return json.loads(self.payload)
+
+    def reminder_ids(self) -> List[int]:
+        '''
+            Lembretes notificados por este email: o próprio lembrete ou,
+            em um resumo, todos os que ele inclui.
+        '''
+        if self.reminder_id is not None:
+            return [self.reminder_id]
+        return sorted(link.reminder_id for link in self.covered_reminders)
+
+
+class EmailOutboxReminder(Base):
+    '''
+        Class linking a digest email to each reminder it covers, so that the
+        notification log of a reminder includes its digests.
+    '''
+    __tablename__ = 'email_outbox_reminder'
+    __table_args__ = (
+        # Notification log of a reminder, newest first
+        Index('ix_email_outbox_reminder_reminder_id', 'reminder_id', 'outbox_id'),
+    )
+
+    outbox_id = Column(Integer, ForeignKey('email_outbox.id'), primary_key = True)
+    reminder_id = Column(Integer, primary_key = True)
+
+
+def notification_key(reminder_id: Optional[int], kind: str, email_receiver: str,
+                     payload: dict, due_date: datetime = None) -> Optional[str]:
+    '''
+        Chave que identifica uma notificação: o lembrete, o tipo e a versão.
+        O aviso de criação é único por lembrete, o de prazo final por
+        ocorrência e o de alteração pelo conteúdo do email, de forma que
+        repetir a mesma alteração não envia outro email.
+    '''
+    if reminder_id is None:
+        return None
+    if kind == KIND_CREATED:
+        version = ''
+    elif kind == KIND_DUE_DATE:
+        version = due_date.isoformat()
+    else:
+        content = json.dumps([email_receiver, payload], sort_keys = True)
+        version = hashlib.sha1(content.encode()).hexdigest()[:16]
+    return f'{reminder_id}:{kind}:{version}'
+
+def digest_key(email_receiver: str, occurrences: List[Tuple[int, datetime]]) -> str:
+    '''
+        Chave de um email de resumo: o destinatário e as ocorrências (id do
+        lembrete e prazo final) que ele inclui.
+    '''
+    content = json.dumps([email_receiver, sorted((reminder_id, due_date.isoformat())
+                                                 for reminder_id, due_date in occurrences)])
+    return f'{KIND_DIGEST}:{hashlib.sha1(content.encode()).hexdigest()[:16]}'
+
+def queue_notifications(session, rows: List[dict]) -> int:
+    '''
+        Coloca os emails na fila, ignorando as notificações já registradas.
+        Retorna quantos foram enfileirados.
+    '''
+    return insert_ignore(session, EmailOutbox.__table__, rows, 'notification_key')
+
+def notification_log(session, reminder_id: int = None, kind: str = None, status: str = None,
+                     limit: int = 100) -> List[EmailOutbox]:
+    '''
+        Notificações registradas, das mais recentes para as mais antigas,
+        filtradas por lembrete, tipo e situação do envio.
+    '''
+    query = session.query(EmailOutbox).options(selectinload(EmailOutbox.covered_reminders))
+    if reminder_id is not None:
+        digests = select(EmailOutboxReminder.outbox_id) \
+            .where(EmailOutboxReminder.reminder_id == reminder_id)
+        query = query.filter(or_(EmailOutbox.reminder_id == reminder_id,
+                                 EmailOutbox.id.in_(digests)))
+    if kind:
+        query = query.filter(EmailOutbox.kind == kind)
+    if status:
+        query = query.filter(EmailOutbox.status == status)
+    return query.order_by(EmailOutbox.id.desc()).limit(limit).all()
@@ -0,0 +1,137 @@
+'''
+    Module responsible for the email templates. Templates are parsed once, at
+    import, and rendered with the reminder fields HTML escaped in the HTML
+    alternative. render_email only renders the texts, so bulk senders can
+    pre-render many messages before building any EmailMessage.
+'''
+import html
+from collections import namedtuple
+from string import Template
+from typing import List
+from email.message import EmailMessage
+
+KIND_CREATED = 'created'
+KIND_UPDATED = 'updated'
+KIND_DUE_DATE = 'due_date'
+KIND_DIGEST = 'digest'
+
+RenderedEmail = namedtuple('RenderedEmail', ['subject', 'plain', 'html'])
+EmailTemplate = namedtuple('EmailTemplate', ['subject', 'plain', 'html'])
+
+SIGNATURE_PLAIN = '''
+Atenciosamente,
+Aplicativo Lembretes
+'''
+SIGNATURE_HTML = '''<p>Atenciosamente,</p>
+        <p>Aplicativo Lembretes</p>'''
+
+REMINDER_PLAIN = Template('''Olá usuário(a), este é um email automatizado para avisar
+que o lembrete nome: $name, de descrição:
+$description, e com data final: $due_date,
+$event.
+''' + SIGNATURE_PLAIN)
+
+REMINDER_HTML = Template('''<!DOCTYPE html>
+<html>
+    <body>
+        <h1 style="color:#dd8888;">Lembrete:</h1>
+        <div><p>Olá usuário(a), este é um email automatizado
+        para avisar </br> que o lembrete nome: <strong>$name</strong>
+        </br> de descrição: <strong>$description</strong>,
+        e com data final: <strong>$due_date</strong>,
+        </br> $event.</p>
+        ''' + SIGNATURE_HTML + '''
+        </div>
+    </body>
+</html>
+''')
+
+DIGEST_PLAIN = Template('''Olá usuário(a), este é um email automatizado para avisar
+que os seguintes lembretes estão próximos à data estipulada:
+
+$items
+''' + SIGNATURE_PLAIN)
+DIGEST_ITEM_PLAIN = Template('- $name: $description, data final: $due_date')
+
+DIGEST_HTML = Template('''<!DOCTYPE html>
+<html>
+    <body>
+        <h1 style="color:#dd8888;">Lembretes:</h1>
+        <div><p>Olá usuário(a), este é um email automatizado
+        para avisar </br> que os seguintes lembretes estão próximos
+        à data estipulada:</p>
+        <ul>$items</ul>
+        ''' + SIGNATURE_HTML + '''
+        </div>
+    </body>
+</html>
+''')
+DIGEST_ITEM_HTML = Template(
+    '<li><strong>$name</strong>: $description, data final: <strong>$due_date</strong></li>')
+
+EVENTS = {
+    KIND_CREATED: 'foi criado',
+    KIND_UPDATED: 'foi atualizado',
+    KIND_DUE_DATE: 'está próximo à data estipulada',
+}
+
+TEMPLATES = {
+    KIND_CREATED: EmailTemplate(Template('Aviso de Lembrete'), REMINDER_PLAIN, REMINDER_HTML),
+    KIND_UPDATED: EmailTemplate(Template('Aviso de Lembrete'), REMINDER_PLAIN, REMINDER_HTML),
+    KIND_DUE_DATE: EmailTemplate(Template('Aviso de Lembrete'), REMINDER_PLAIN, REMINDER_HTML),
+    KIND_DIGEST: EmailTemplate(Template('Aviso de Lembretes'), DIGEST_PLAIN, DIGEST_HTML),
+}
+
+
+def escape_fields(fields: dict) -> dict:
+    '''
+        Escapa os valores para inclusão no HTML.
+    '''
+    return {key: html.escape(str(value)) for key, value in fields.items()}
+
+def render_reminder(kind: str, name: str, description: str, due_date: str) -> RenderedEmail:
+    '''
+        Renderiza o email de um lembrete (criado, atualizado ou prazo final).
+    '''
+    template = TEMPLATES[kind]
+    fields = {'name': name, 'description': description, 'due_date': due_date,
+              'event': EVENTS[kind]}
+    return RenderedEmail(
+        template.subject.substitute(fields),
+        template.plain.substitute(fields),
+        template.html.substitute(escape_fields(fields)))
+
+def render_digest(reminders: List[dict]) -> RenderedEmail:
+    '''
+        Renderiza o resumo com vários lembretes de um destinatário.
+    '''
+    template = TEMPLATES[KIND_DIGEST]
+    plain_items = '\n'.join(DIGEST_ITEM_PLAIN.substitute(reminder) for reminder in reminders)
+    html_items = ''.join(DIGEST_ITEM_HTML.substitute(escape_fields(reminder))
+                         for reminder in reminders)
+    return RenderedEmail(
+        template.subject.substitute(),
+        template.plain.substitute(items = plain_items),
+        template.html.substitute(items = html_items))
+
+def render_email(kind: str, payload: dict) -> RenderedEmail:
+    '''
+        Renderiza, sem montar a mensagem, o email do tipo informado a partir
+        do payload salvo na fila de envio.
+    '''
+    if kind == KIND_DIGEST:
+        return render_digest(payload['reminders'])
+    return render_reminder(kind, payload['name'], payload['description'], payload['due_date'])
+
+def build_message(rendered: RenderedEmail, email_sender: str, email_receiver: str,
+                  subject: str = None) -> EmailMessage:
+    '''
+        Monta a mensagem, com as versões texto e HTML, de um email renderizado.
+    '''
+    message = EmailMessage()
+    message.set_content(rendered.plain)
+    message.add_alternative(rendered.html, subtype = 'html')
+    message['From'] = email_sender
+    message['To'] = email_receiver
+    message['Subject'] = subject or rendered.subject
+    return message
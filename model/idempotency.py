@@ -0,0 +1,98 @@
+'''
+    Module responsible for the Idempotency-Key of the write routes. The first
+    request with a key claims it and its response is saved; a retry with the
+    same key gets the saved response back without running the route again,
+    so retries and double submissions do not repeat writes or emails. Keys
+    expire after IDEMPOTENCY_TTL_HOURS.
+'''
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import Column, String, Integer, DateTime, LargeBinary, Index
+from model import Base
+from model.upsert import insert_ignore
+
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyKey(Base):
+    '''
+        Class representing an Idempotency-Key and the response of the request
+        that claimed it. status_code is None while that request runs.
+    '''
+    __tablename__ = 'idempotency_key'
+    __table_args__ = (
+        # Removal of the expired keys
+        Index('ix_idempotency_key_created_at', 'created_at'),
+    )
+
+    key = Column(String(MAX_KEY_LENGTH), primary_key = True)
+    method = Column(String(10), nullable = False)
+    path = Column(String(255), nullable = False)
+    # Hash of the query string and body, to detect a key reused for another request
+    fingerprint = Column(String(64), nullable = False)
+    status_code = Column(Integer, default = None)
+    content_type = Column(String(100), default = None)
+    response_body = Column(LargeBinary, default = None)
+    created_at = Column(DateTime, nullable = False, default = datetime.now)
+
+
+def idempotency_ttl() -> timedelta:
+    '''
+        Validade das chaves, lida de IDEMPOTENCY_TTL_HOURS no momento do uso,
+        para que valha o .env carregado por create_app.
+    '''
+    return timedelta(hours = float(os.environ.get('IDEMPOTENCY_TTL_HOURS', 24)))
+
+def claim_key(session, key: str, method: str, path: str,
+              fingerprint: str) -> Optional[IdempotencyKey]:
+    '''
+        Reserva a chave para a requisição atual. Retorna None se a chave foi
+        reservada, ou o registro existente se ela já foi usada e não expirou.
+    '''
+    now = datetime.now()
+    session.query(IdempotencyKey) \
+        .filter(IdempotencyKey.key == key, IdempotencyKey.created_at < now - idempotency_ttl()) \
+        .delete(synchronize_session = False)
+    claimed = insert_ignore(session, IdempotencyKey.__table__, [{
+        'key': key,
+        'method': method,
+        'path': path,
+        'fingerprint': fingerprint,
+        'created_at': now,
+    }], 'key')
+    session.commit()
+    if claimed:
+        return None
+    return session.get(IdempotencyKey, key)
+
+def complete_key(session, key: str, status_code: int, content_type: str, body: bytes) -> None:
+    '''
+        Salva a resposta da requisição que reservou a chave.
+    '''
+    session.query(IdempotencyKey) \
+        .filter(IdempotencyKey.key == key) \
+        .update({'status_code': status_code, 'content_type': content_type,
+                 'response_body': body}, synchronize_session = False)
+    session.commit()
+
+def release_key(session, key: str) -> None:
+    '''
+        Libera a chave de uma requisição que falhou, para que possa ser
+        repetida.
+    '''
+    session.query(IdempotencyKey) \
+        .filter(IdempotencyKey.key == key, IdempotencyKey.status_code.is_(None)) \
+        .delete(synchronize_session = False)
+    session.commit()
+
+def purge_keys(session, now: datetime = None) -> int:
+    '''
+        Remove as chaves expiradas. Retorna a quantidade removida.
+    '''
+    now = now or datetime.now()
+    purged = session.query(IdempotencyKey) \
+        .filter(IdempotencyKey.created_at < now - idempotency_ttl()) \
+        .delete(synchronize_session = False)
+    session.commit()
+    return purged
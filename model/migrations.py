@@ -0,0 +1,127 @@
+'''
+    Module responsible for upgrading databases created by older versions of
+    the application. create_all only creates missing tables, so columns added
+    to existing models are created here.
+'''
+from sqlalchemy import inspect, MetaData
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.engine import Engine
+from model.base import Base
+from logger import logger
+
+
+def add_missing_columns(engine: Engine) -> None:
+    '''
+        Adiciona às tabelas existentes as colunas declaradas nos models que
+        ainda não existem no banco.
+    '''
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect = engine.dialect)
+                logger.info('Adicionando coluna %s.%s', table.name, column.name)
+                connection.exec_driver_sql(
+                    f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+
+def create_missing_indexes(engine: Engine) -> None:
+    '''
+        Cria nos bancos existentes os índices declarados nos models. Um
+        índice único que não puder ser criado por haver dados duplicados é
+        apenas registrado no log, para que a aplicação continue iniciando.
+    '''
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            logger.info('Criando índice %s', index.name)
+            try:
+                with engine.begin() as connection:
+                    index.create(connection)
+            except IntegrityError as error:
+                logger.error('Não foi possível criar o índice único %s, há valores '
+                             'duplicados na tabela %s: %s', index.name, table.name, error)
+
+def fill_next_due_at(engine: Engine) -> None:
+    '''
+        Preenche next_due_at dos lembretes criados antes da coluna existir,
+        todos sem regra de recorrência, com a própria due_date.
+    '''
+    with engine.begin() as connection:
+        filled = connection.exec_driver_sql(
+            'UPDATE reminder SET next_due_at = due_date '
+            'WHERE next_due_at IS NULL AND recurrence IS NULL AND due_date IS NOT NULL').rowcount
+    if filled:
+        logger.info('Preenchida a próxima ocorrência de %d lembretes', filled)
+
+def use_autoincrement_ids(engine: Engine) -> None:
+    '''
+        Recria a tabela de lembretes dos bancos SQLite criados sem
+        AUTOINCREMENT, em que o id do último lembrete removido é reusado. A
+        sequência começa depois do maior id já registrado na fila de emails
+        e no registro de alterações, para que um lembrete novo não herde as
+        notificações de um removido. Os índices e triggers são recriados em
+        seguida pelas demais migrações.
+    '''
+    if engine.dialect.name != 'sqlite':
+        return
+    # Imported here: model.reminder depends on the models being loaded
+    from model.reminder import Reminder
+    with engine.connect() as connection:
+        sql = connection.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'reminder'").scalar()
+        if not sql or 'AUTOINCREMENT' in sql.upper():
+            return
+        tables = set(inspect(connection).get_table_names())
+    rebuilt = Reminder.__table__.to_metadata(MetaData(), name = 'reminder_rebuild')
+    columns = ', '.join(column.name for column in rebuilt.columns)
+    used_ids = ['SELECT MAX(pk_reminder) AS id FROM reminder_rebuild']
+    used_ids += [f'SELECT MAX({column}) FROM {table}'
+                 for table, column in (('email_outbox', 'reminder_id'),
+                                       ('reminder_change', 'reminder_id'))
+                 if table in tables]
+    last_id = f"(SELECT MAX(id) FROM ({' UNION ALL '.join(used_ids)}))"
+    logger.info('Recriando a tabela reminder com ids não reutilizáveis')
+    # A single script: the DDL runs in one transaction, so an interrupted
+    # rebuild leaves the old table in place
+    connection = engine.raw_connection()
+    try:
+        connection.executescript(f'''
+            BEGIN IMMEDIATE;
+            {CreateTable(rebuilt).compile(dialect = engine.dialect)};
+            INSERT INTO reminder_rebuild ({columns}) SELECT {columns} FROM reminder;
+            DELETE FROM sqlite_sequence WHERE name = 'reminder_rebuild';
+            INSERT INTO sqlite_sequence (name, seq) VALUES ('reminder_rebuild', IFNULL({last_id}, 0));
+            DROP TABLE reminder;
+            ALTER TABLE reminder_rebuild RENAME TO reminder;
+            COMMIT;
+        ''')
+    finally:
+        connection.close()
+
+def upgrade(engine: Engine) -> None:
+    '''
+        Atualiza o esquema de um banco existente para a versão atual.
+    '''
+    # Imported here: these modules depend on the models being loaded
+    from model.search import create_search_index
+    from model.change_version import create_change_version
+    from model.change_log import create_change_log
+
+    add_missing_columns(engine)
+    use_autoincrement_ids(engine)
+    create_missing_indexes(engine)
+    fill_next_due_at(engine)
+    create_search_index(engine)
+    create_change_version(engine)
+    create_change_log(engine)
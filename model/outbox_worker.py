@@ -0,0 +1,215 @@
+'''
+    Module responsible for delivering the emails queued in the outbox.
+    Can run as a background thread of the API or as a standalone process:
+
+        python -m model.outbox_worker
+'''
+import os
+import threading
+from typing import List, Optional
+from datetime import datetime, timedelta
+from model import Session
+from model.email_client import EmailClient, DigestEmailClient
+from model.email_outbox import EmailOutbox, KIND_CREATED, KIND_UPDATED, KIND_DUE_DATE, KIND_DIGEST, \
+                              STATUS_PENDING, STATUS_SENDING, STATUS_SENT, STATUS_FAILED
+from logger import logger
+
+FLAGS = {
+    KIND_CREATED: {'flag_create': True},
+    KIND_UPDATED: {'flag_update': True},
+    KIND_DUE_DATE: {'flag_due_date': True},
+}
+
+
+def outbox_settings() -> dict:
+    '''
+        Configuração da fila lida das variáveis de ambiente no momento do
+        uso, para que valha o .env carregado por create_app.
+    '''
+    return {
+        'poll_interval': float(os.environ.get('OUTBOX_POLL_INTERVAL', 5)),
+        'batch_size': int(os.environ.get('OUTBOX_BATCH_SIZE', 50)),
+        'max_attempts': int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 8)),
+        'backoff_base': float(os.environ.get('OUTBOX_BACKOFF_BASE', 30)),
+        'backoff_max': float(os.environ.get('OUTBOX_BACKOFF_MAX', 3600)),
+        # A row stuck in 'sending' for longer than this belongs to a worker that
+        # died mid-delivery and is picked up again, which makes delivery
+        # at-least-once.
+        'claim_timeout': float(os.environ.get('OUTBOX_CLAIM_TIMEOUT', 300)),
+    }
+
+def backoff_delay(attempts: int) -> timedelta:
+    '''
+        Tempo de espera exponencial até a próxima tentativa de envio.
+    '''
+    settings = outbox_settings()
+    return timedelta(seconds = min(settings['backoff_base'] * 2 ** (attempts - 1),
+                                   settings['backoff_max']))
+
+def prepare_outbox_email(outbox: EmailOutbox):
+    '''
+        Monta o cliente de email de um item da fila: um DigestEmailClient
+        para resumos com vários lembretes ou um EmailClient para os demais.
+    '''
+    payload = outbox.load_payload()
+    if outbox.kind == KIND_DIGEST:
+        return DigestEmailClient(payload['reminders'], outbox.email_receiver)
+    return EmailClient(
+        payload['name'],
+        payload['description'],
+        payload['due_date'],
+        outbox.email_receiver
+        )
+
+def send_outbox_emails(batch: List[EmailOutbox]) -> List[Optional[Exception]]:
+    '''
+        Envia um lote de emails da fila reutilizando uma única sessão SMTP.
+        Retorna None para cada email enviado ou a exceção da falha.
+    '''
+    results: List[Optional[Exception]] = []
+    messages = []
+    pool = None
+    for outbox in batch:
+        try:
+            email_client = prepare_outbox_email(outbox)
+            messages.append(email_client.prepare_email(**FLAGS.get(outbox.kind, {})))
+            pool = pool or email_client.smtp_pool()
+            results.append(None)
+        except Exception as error:
+            messages.append(None)
+            results.append(error)
+    if pool is None:
+        return results
+    sendable = [message for message in messages if message is not None]
+    sent = iter(pool.send_batch(sendable))
+    return [next(sent) if message is not None else error
+            for message, error in zip(messages, results)]
+
+
+class OutboxWorker():
+    '''Class representing the outbox delivery worker'''
+    def __init__(self, poll_interval: float = None, batch_size: int = None):
+        # None reads OUTBOX_POLL_INTERVAL and OUTBOX_BATCH_SIZE when used
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._wake_up = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        '''
+            Inicia o envio dos emails da fila em uma thread de fundo.
+        '''
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target = self.run, name = 'outbox-worker', daemon = True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None) -> None:
+        '''
+            Interrompe a thread de envio.
+        '''
+        self._stopped.set()
+        self._wake_up.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def notify(self) -> None:
+        '''
+            Avisa o worker de que há emails novos na fila, sem esperar pelo
+            próximo intervalo de consulta.
+        '''
+        self._wake_up.set()
+
+    def run(self) -> None:
+        '''
+            Esvazia a fila periodicamente até que o worker seja interrompido.
+        '''
+        logger.info('Worker de envio de emails iniciado')
+        poll_interval = self.poll_interval or outbox_settings()['poll_interval']
+        while not self._stopped.is_set():
+            try:
+                while self.drain_once() and not self._stopped.is_set():
+                    pass
+            except Exception as error:
+                logger.warning('Erro ao processar a fila de emails: %s', error)
+            self._wake_up.wait(poll_interval)
+            self._wake_up.clear()
+
+    def claim(self, session) -> list:
+        '''
+            Reserva um lote de emails prontos para envio. A reserva é feita
+            com um UPDATE condicional, de forma que vários workers possam
+            consumir a mesma fila sem enviar o mesmo email duas vezes.
+        '''
+        settings = outbox_settings()
+        now = datetime.now()
+        stale = now - timedelta(seconds = settings['claim_timeout'])
+        candidates = session.query(EmailOutbox.id, EmailOutbox.status) \
+            .filter(
+                ((EmailOutbox.status == STATUS_PENDING) & (EmailOutbox.next_attempt_at <= now)) |
+                ((EmailOutbox.status == STATUS_SENDING) & (EmailOutbox.next_attempt_at <= stale))) \
+            .order_by(EmailOutbox.next_attempt_at) \
+            .limit(self.batch_size or settings['batch_size']) \
+            .all()
+        claimed = []
+        for outbox_id, status in candidates:
+            updated = session.query(EmailOutbox) \
+                .filter(EmailOutbox.id == outbox_id, EmailOutbox.status == status) \
+                .update({'status': STATUS_SENDING, 'next_attempt_at': now},
+                        synchronize_session = False)
+            if updated:
+                claimed.append(outbox_id)
+        session.commit()
+        if not claimed:
+            return []
+        return session.query(EmailOutbox).filter(EmailOutbox.id.in_(claimed)).all()
+
+    def drain_once(self) -> int:
+        '''
+            Envia um lote de emails da fila e retorna quantos foram processados.
+        '''
+        session = Session()
+        try:
+            batch = self.claim(session)
+            if batch:
+                for outbox, error in zip(batch, send_outbox_emails(batch)):
+                    self.record_result(outbox, error)
+            session.commit()
+            return len(batch)
+        finally:
+            Session.remove()
+
+    def record_result(self, outbox: EmailOutbox, error: Optional[Exception]) -> None:
+        '''
+            Registra o resultado do envio de um email, reagendando com espera
+            exponencial em caso de falha.
+        '''
+        outbox.attempts += 1
+        if error:
+            outbox.last_error = str(error)[:255]
+            if outbox.attempts >= outbox_settings()['max_attempts']:
+                outbox.status = STATUS_FAILED
+                logger.warning('Email # %d descartado após %d tentativas: %s',
+                               outbox.id, outbox.attempts, error)
+            else:
+                outbox.status = STATUS_PENDING
+                outbox.next_attempt_at = datetime.now() + backoff_delay(outbox.attempts)
+                logger.info('Falha ao enviar email # %d, nova tentativa em %s: %s',
+                            outbox.id, outbox.next_attempt_at, error)
+            return
+        outbox.status = STATUS_SENT
+        outbox.sent_at = datetime.now()
+        logger.debug('Email # %d enviado para %s', outbox.id, outbox.email_receiver)
+
+
+outbox_worker = OutboxWorker()
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from logger import configure_logging
+
+    load_dotenv('../.env')
+    configure_logging()
+    outbox_worker.run()
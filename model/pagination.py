@@ -0,0 +1,80 @@
+'''Module responsible for keyset pagination of reminders'''
+import base64
+import binascii
+from datetime import datetime
+from typing import Optional, Tuple
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Query
+from model.reminder import Reminder
+
+ORDER_BY_ID = 'id'
+ORDER_BY_DUE_DATE = 'due_date'
+ORDER_FIELDS = (ORDER_BY_ID, ORDER_BY_DUE_DATE)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    '''Raised when a pagination cursor can not be decoded'''
+
+
+def encode_cursor(reminder: Reminder, order_by: str = ORDER_BY_ID) -> str:
+    '''
+        Gera um cursor opaco a partir do último lembrete retornado.
+    '''
+    if order_by == ORDER_BY_DUE_DATE:
+        raw = '%s|%d' % (reminder.due_date.isoformat(), reminder.id)
+    else:
+        raw = str(reminder.id)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str, order_by: str = ORDER_BY_ID) -> Tuple[Optional[datetime], int]:
+    '''
+        Decodifica um cursor gerado por encode_cursor, retornando
+        a tupla (due_date, id) do último lembrete visto.
+    '''
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        if order_by == ORDER_BY_DUE_DATE:
+            due_date, reminder_id = raw.rsplit('|', 1)
+            return datetime.fromisoformat(due_date), int(reminder_id)
+        return None, int(raw)
+    except (ValueError, binascii.Error) as error:
+        raise InvalidCursor(cursor) from error
+
+def keyset_filter(query: Query, cursor: Optional[str], order_by: str = ORDER_BY_ID) -> Query:
+    '''
+        Aplica a ordenação e, caso exista cursor, o filtro de keyset
+        (linhas posteriores ao último lembrete visto) à query.
+    '''
+    if order_by == ORDER_BY_DUE_DATE:
+        query = query.filter(Reminder.due_date.isnot(None)) \
+                     .order_by(Reminder.due_date, Reminder.id)
+        if cursor:
+            due_date, reminder_id = decode_cursor(cursor, order_by)
+            query = query.filter(or_(
+                Reminder.due_date > due_date,
+                and_(Reminder.due_date == due_date, Reminder.id > reminder_id)))
+        return query
+
+    query = query.order_by(Reminder.id)
+    if cursor:
+        _, reminder_id = decode_cursor(cursor, order_by)
+        query = query.filter(Reminder.id > reminder_id)
+    return query
+
+def fetch_page(query: Query, cursor: Optional[str], page_size: int,
+               order_by: str = ORDER_BY_ID):
+    '''
+        Retorna uma página de lembretes e o cursor para a próxima página,
+        ou None quando não houver mais lembretes.
+    '''
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    # One extra row tells whether there is a next page without a COUNT(*)
+    rows = keyset_filter(query, cursor, order_by).limit(page_size + 1).all()
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        return rows, encode_cursor(rows[-1], order_by)
+    return rows, None
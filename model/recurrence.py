@@ -0,0 +1,62 @@
+'''
+    Module responsible for the reminder recurrence rules. A rule is a
+    frequency (daily, weekly or monthly) and an interval, so every 2 weeks is
+    ('weekly', 2). Occurrences are counted from the reminder due_date, and
+    the next one is computed directly, without expanding the previous ones.
+    Monthly occurrences keep the due_date day, or the last day of shorter
+    months.
+'''
+import calendar
+from datetime import datetime, timedelta
+from typing import Optional
+
+RECURRENCE_DAILY = 'daily'
+RECURRENCE_WEEKLY = 'weekly'
+RECURRENCE_MONTHLY = 'monthly'
+RECURRENCE_FREQUENCIES = (RECURRENCE_DAILY, RECURRENCE_WEEKLY, RECURRENCE_MONTHLY)
+
+STEPS = {
+    RECURRENCE_DAILY: timedelta(days = 1),
+    RECURRENCE_WEEKLY: timedelta(weeks = 1),
+}
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    '''
+        Soma meses a uma data, limitando o dia ao último dia do mês.
+    '''
+    month = value.month - 1 + months
+    year, month = value.year + month // 12, month % 12 + 1
+    day = min(value.day, calendar.monthrange(year, month)[1])
+    return value.replace(year = year, month = month, day = day)
+
+def next_occurrence(due_date: datetime, recurrence: str, interval: Optional[int],
+                    after: datetime) -> datetime:
+    '''
+        Primeira ocorrência da regra, contada a partir de due_date, que é
+        posterior a after.
+    '''
+    interval = interval or 1
+    if due_date > after:
+        return due_date
+    if recurrence == RECURRENCE_MONTHLY:
+        months = (after.year - due_date.year) * 12 + after.month - due_date.month
+        count = max(months // interval, 0)
+        occurrence = add_months(due_date, count * interval)
+        while occurrence <= after:
+            count += 1
+            occurrence = add_months(due_date, count * interval)
+        return occurrence
+    step = STEPS[recurrence] * interval
+    return due_date + ((after - due_date) // step + 1) * step
+
+def first_due_at(due_date: Optional[datetime], recurrence: Optional[str],
+                 interval: Optional[int], now: datetime = None) -> Optional[datetime]:
+    '''
+        Valor inicial de next_due_at: a própria due_date para lembretes sem
+        recorrência ou que ainda não venceram, ou a próxima ocorrência.
+    '''
+    now = now or datetime.now()
+    if due_date is None or not recurrence or due_date >= now:
+        return due_date
+    return next_occurrence(due_date, recurrence, interval, now)
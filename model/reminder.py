@@ -1,26 +1,50 @@
 '''Module responsible for reminder model'''
 from typing import Union
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, DateTime, Boolean
+from sqlalchemy import Column, String, Integer, DateTime, Boolean, Index, text
 from sqlalchemy.orm import relationship
 from unidecode import unidecode
 from model import Base
 from model import Email
+from model.recurrence import first_due_at
 
 
 class Reminder(Base):
     '''Class representing a reminder'''
     __tablename__ = 'reminder'
+    __table_args__ = (
+        # Range scan used by the due date scheduler
+        Index('ix_reminder_send_email_due_date', 'send_email', 'due_date'),
+        # Range scan of the upcoming occurrences, used by the scheduler and
+        # by /reminders/upcoming
+        Index('ix_reminder_next_due_at', 'next_due_at'),
+        # Partial index read by the scheduler when advancing recurring
+        # reminders, which skips the past one-time reminders
+        Index('ix_reminder_recurring_next_due_at', 'next_due_at',
+              sqlite_where = text('recurrence IS NOT NULL'),
+              postgresql_where = text('recurrence IS NOT NULL')),
+        # Ids are never reused, so the outbox, the change log and the caches
+        # never mistake a new reminder for a deleted one
+        {'sqlite_autoincrement': True},
+    )
 
     id = Column('pk_reminder', Integer, primary_key = True)
     name = Column(String(60), unique = True)
-    name_normalized = Column(String(140))
+    name_normalized = Column(String(140), unique = True, index = True)
     description = Column(String(255))
     due_date = Column(DateTime)
     send_email = Column(Boolean, unique = False, default = False)
     recurring = Column(Boolean, unique = False, default = False)
-    created_at = Column(DateTime, default = datetime.now())
+    # Recurrence rule (see model.recurrence); None for single reminders
+    recurrence = Column(String(10), default = None)
+    recurrence_interval = Column(Integer, default = 1)
+    # Next occurrence not yet past: due_date for single reminders, advanced
+    # by the scheduler for recurring ones
+    next_due_at = Column(DateTime, default = None)
+    created_at = Column(DateTime, default = datetime.now)
     updated_at = Column(DateTime, default = None)
+    # due_date for which the due date email was already queued
+    notified_due_date = Column(DateTime, default = None)
     # relationship with table email
     email_relationship = relationship('Email')
 
@@ -31,6 +55,8 @@ class Reminder(Base):
         due_date: Union[DateTime, None] = None,
         send_email: bool = False,
         recurring: bool = False,
+        recurrence: Union[str, None] = None,
+        recurrence_interval: Union[int, None] = None,
         created_at: Union[DateTime, None] = None,
         updated_at: Union[DateTime, None] = None):
         self.name = name
@@ -38,11 +64,14 @@ class Reminder(Base):
         self.description = description
         self.due_date = due_date
         self.send_email = send_email
-        self.recurring = recurring
+        self.recurring = recurring or bool(recurrence)
+        self.recurrence = recurrence
+        self.recurrence_interval = recurrence_interval or 1
+        self.schedule()
 
-        if not created_at:
+        if created_at:
             self.created_at = created_at
-        if not updated_at:
+        if updated_at:
             self.updated_at = updated_at
 
     def insert_email(self, email:Email):
@@ -51,6 +80,14 @@ class Reminder(Base):
         '''
         self.email_relationship.append(email)
 
+    def schedule(self, now: Union[datetime, None] = None) -> None:
+        '''
+            Recalcula a próxima ocorrência a partir da due_date e da regra de
+            recorrência. Chamado quando uma delas é alterada.
+        '''
+        self.next_due_at = first_due_at(self.due_date, self.recurrence,
+                                        self.recurrence_interval, now)
+
     def validate_email_before_send(self) -> bool:
         '''
             Function to validate if send_email is True, and if there is
@@ -62,9 +99,9 @@ class Reminder(Base):
 
     def validate_due_date(self) -> bool:
         '''
-            Validate if due_date is one day or less than today.
+            Validate if the next occurrence is one day or less than today.
         '''
-        due_date = self.due_date
+        due_date = self.next_due_at or self.due_date
         current_datetime = datetime.now()
         delta = due_date - current_datetime
         if delta.days <= 1:
@@ -0,0 +1,90 @@
+'''
+    Module responsible for reminder queries, loading each reminder together
+    with its email in a constant number of statements.
+'''
+from datetime import datetime
+from typing import Optional, List
+from sqlalchemy import select
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Query, Session, joinedload, selectinload
+from model.email import Email
+from model.reminder import Reminder
+
+
+def reminders_with_email(session: Session) -> Query:
+    '''
+        Query de lembretes que carrega os emails relacionados em lote
+        (um único SELECT ... IN por bloco de lembretes), evitando uma
+        consulta extra por lembrete ao acessar email_relationship.
+    '''
+    return session.query(Reminder).options(selectinload(Reminder.email_relationship))
+
+def reminder_rows(session: Session) -> Query:
+    '''
+        Query apenas das colunas de ReminderViewSchema, com o email do
+        lembrete, que retorna tuplas em vez de objetos Reminder. Sem identity
+        map nem relacionamentos, é o caminho usado pelas listagens.
+    '''
+    # A correlated subquery keeps one row per reminder, like
+    # email_relationship[0] in show_reminder, and uses the email.reminder index
+    email = select(Email.email) \
+        .where(Email.reminder == Reminder.id) \
+        .order_by(Email.id) \
+        .limit(1) \
+        .scalar_subquery() \
+        .label('email')
+    return session.query(Reminder.id, Reminder.name, Reminder.name_normalized,
+                         Reminder.description, Reminder.due_date, Reminder.send_email,
+                         email, Reminder.recurring, Reminder.recurrence,
+                         Reminder.recurrence_interval)
+
+def upcoming_reminders(session: Session, start: datetime, end: datetime, limit: int) -> List[Row]:
+    '''
+        Lembretes cuja próxima ocorrência está entre start e end, em ordem
+        de ocorrência, com uma única leitura por intervalo do índice de
+        next_due_at.
+    '''
+    return reminder_rows(session) \
+        .add_columns(Reminder.next_due_at) \
+        .filter(Reminder.next_due_at >= start, Reminder.next_due_at <= end) \
+        .order_by(Reminder.next_due_at, Reminder.id) \
+        .limit(limit) \
+        .all()
+
+def find_reminder_id(session: Session, name_normalized: str) -> Optional[int]:
+    '''
+        Busca apenas o id do lembrete de nome normalizado informado, lido
+        direto do índice único, para detectar um nome duplicado antes de
+        montar o lembrete.
+    '''
+    return session.query(Reminder.id) \
+        .filter(Reminder.name_normalized == name_normalized) \
+        .scalar()
+
+def get_reminder_by_id(session: Session, reminder_id: int) -> Optional[Reminder]:
+    '''
+        Busca um lembrete pelo id, já com o email, em um único SELECT.
+    '''
+    return session.query(Reminder) \
+        .options(joinedload(Reminder.email_relationship)) \
+        .filter(Reminder.id == reminder_id) \
+        .first()
+
+def get_reminder_by_name(session: Session, name_normalized: str) -> Optional[Reminder]:
+    '''
+        Busca um lembrete pelo nome normalizado, já com o email, em um
+        único SELECT.
+    '''
+    return session.query(Reminder) \
+        .options(joinedload(Reminder.email_relationship)) \
+        .filter(Reminder.name_normalized == name_normalized) \
+        .first()
+
+def get_reminder_version(session: Session, *criteria) -> Optional[Row]:
+    '''
+        Busca apenas id, updated_at e created_at do lembrete, o suficiente
+        para validar uma requisição condicional sem carregar o lembrete.
+    '''
+    return session.query(Reminder.id, Reminder.updated_at, Reminder.created_at) \
+        .filter(*criteria) \
+        .first()
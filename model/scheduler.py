@@ -0,0 +1,247 @@
+'''
+    Module responsible for queueing the due date emails. Replaces calling
+    /send_email once per reminder: a single range query on next_due_at finds
+    the reminders due within the window. Recurring reminders then have
+    next_due_at advanced to their following occurrence. Can run as a
+    background thread of the API or as a standalone process. In digest mode
+    the reminders of the same recipient are sent together in a single email:
+
+        python -m model.scheduler [--once]
+'''
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+from typing import List
+from sqlalchemy import update, bindparam
+from model import Session
+from model.email import Email
+from model.email_outbox import EmailOutbox, EmailOutboxReminder, KIND_DUE_DATE, KIND_DIGEST, \
+                               notification_key, digest_key
+from model.outbox_worker import outbox_worker
+from model.reminder import Reminder
+from model.recurrence import next_occurrence
+from model.idempotency import purge_keys
+from model.change_log import purge_changes
+from logger import logger
+
+
+def scheduler_settings() -> dict:
+    '''
+        Configuração do agendador lida das variáveis de ambiente no momento
+        do uso, para que valha o .env carregado por create_app.
+    '''
+    return {
+        'interval': float(os.environ.get('SCHEDULER_INTERVAL', 60)),
+        # Reminders due up to this far in the future are notified
+        'window': timedelta(days = float(os.environ.get('SCHEDULER_WINDOW_DAYS', 1))),
+        # Reminders that became due while the scheduler was not running are
+        # still notified if they are at most this late
+        'lookback': timedelta(days = float(os.environ.get('SCHEDULER_LOOKBACK_DAYS', 1))),
+        'digest': os.environ.get('SCHEDULER_DIGEST', '1') == '1',
+    }
+
+def find_due_reminders(session, now: datetime) -> List[tuple]:
+    '''
+        Busca, com uma única consulta por intervalo de next_due_at, os
+        lembretes com envio de email ativo cuja próxima ocorrência está
+        dentro da janela e ainda não foi notificada.
+    '''
+    settings = scheduler_settings()
+    return session.query(Reminder.id, Reminder.name, Reminder.description,
+                         Reminder.next_due_at, Email.email) \
+        .join(Email, Email.reminder == Reminder.id) \
+        .filter(
+            Reminder.next_due_at >= now - settings['lookback'],
+            Reminder.next_due_at <= now + settings['window'],
+            Reminder.send_email.is_(True),
+            (Reminder.notified_due_date.is_(None)) |
+            (Reminder.notified_due_date != Reminder.next_due_at),
+            Email.email.isnot(None),
+            Email.email != '') \
+        .all()
+
+def advance_recurring(session, now: datetime) -> int:
+    '''
+        Avança next_due_at dos lembretes recorrentes cuja ocorrência já
+        passou e que não esperam mais notificação: já notificados, sem envio
+        de email ou atrasados além de SCHEDULER_LOOKBACK_DAYS. Os lembretes
+        recorrentes vencidos são lidos pelo índice parcial
+        ix_reminder_recurring_next_due_at, sem percorrer os lembretes únicos
+        já vencidos. Retorna a quantidade de lembretes avançados.
+    '''
+    lookback = scheduler_settings()['lookback']
+    rows = session.query(Reminder.id, Reminder.due_date, Reminder.recurrence,
+                         Reminder.recurrence_interval, Reminder.next_due_at,
+                         Reminder.notified_due_date, Reminder.send_email) \
+        .filter(Reminder.next_due_at < now, Reminder.recurrence.isnot(None)) \
+        .all()
+    advanced = [{
+        'b_id': row.id,
+        'b_next_due_at': row.next_due_at,
+        'next_due_at': next_occurrence(row.due_date, row.recurrence, row.recurrence_interval, now),
+    } for row in rows
+        if row.notified_due_date == row.next_due_at or not row.send_email
+        or row.next_due_at < now - lookback]
+    if advanced:
+        # Conditional on the value read, in case another process advanced it
+        session.execute(
+            update(Reminder.__table__)
+            .where(Reminder.__table__.c.pk_reminder == bindparam('b_id'),
+                   Reminder.__table__.c.next_due_at == bindparam('b_next_due_at')),
+            advanced)
+    return len(advanced)
+
+def due_date_outbox(email: str, reminders: List[dict], digest: bool) -> List[EmailOutbox]:
+    '''
+        Emails da fila para os lembretes de um destinatário: um único resumo
+        em modo digest, quando houver mais de um lembrete, ligado a cada
+        lembrete que inclui, ou um email por lembrete.
+    '''
+    if digest and len(reminders) > 1:
+        payload = [{key: reminder[key] for key in ('name', 'description', 'due_date')}
+                   for reminder in reminders]
+        outbox = EmailOutbox(
+            kind = KIND_DIGEST,
+            email_receiver = email,
+            payload = {'reminders': payload},
+            notification_key = digest_key(email, [(reminder['id'], reminder['occurrence'])
+                                                  for reminder in reminders]))
+        outbox.covered_reminders = [EmailOutboxReminder(reminder_id = reminder['id'])
+                                    for reminder in reminders]
+        return [outbox]
+    outbox = []
+    for reminder in reminders:
+        payload = {key: reminder[key] for key in ('name', 'description', 'due_date')}
+        outbox.append(EmailOutbox(
+            kind = KIND_DUE_DATE,
+            email_receiver = email,
+            payload = payload,
+            reminder_id = reminder['id'],
+            notification_key = notification_key(reminder['id'], KIND_DUE_DATE, email,
+                                                payload, reminder['occurrence'])))
+    return outbox
+
+def queue_due_date_emails(now: datetime = None, digest: bool = None) -> int:
+    '''
+        Coloca na fila de envio os emails dos lembretes que vencem dentro da
+        janela e registra a notificação no próprio lembrete. Em modo digest
+        os lembretes são agrupados por destinatário (por padrão, conforme
+        SCHEDULER_DIGEST). Em seguida avança a próxima ocorrência dos
+        lembretes recorrentes. Retorna a quantidade de emails enfileirados.
+    '''
+    now = now or datetime.now()
+    if digest is None:
+        digest = scheduler_settings()['digest']
+    session = Session()
+    try:
+        by_recipient = {}
+        for reminder_id, name, description, due_date, email in find_due_reminders(session, now):
+            # Conditional update: another scheduler may have claimed the reminder
+            claimed = session.query(Reminder) \
+                .filter(Reminder.id == reminder_id,
+                        (Reminder.notified_due_date.is_(None)) |
+                        (Reminder.notified_due_date != due_date)) \
+                .update({'notified_due_date': due_date}, synchronize_session = False)
+            if not claimed:
+                continue
+            by_recipient.setdefault(email, []).append({
+                'id': reminder_id,
+                'name': name,
+                'description': description,
+                'due_date': due_date.strftime('%d/%m/%Y'),
+                'occurrence': due_date,
+            })
+        queued = 0
+        for email, reminders in by_recipient.items():
+            outbox = due_date_outbox(email, reminders, digest)
+            session.add_all(outbox)
+            queued += len(outbox)
+        advanced = advance_recurring(session, now)
+        session.commit()
+    finally:
+        Session.remove()
+
+    if advanced:
+        logger.info('Próxima ocorrência avançada em %d lembretes recorrentes', advanced)
+    if queued:
+        logger.info('%d emails de prazo final enfileirados', queued)
+        outbox_worker.notify()
+    return queued
+
+
+def purge_expired() -> None:
+    '''
+        Remove as Idempotency-Keys expiradas e as alterações antigas já
+        substituídas do registro de alterações.
+    '''
+    session = Session()
+    try:
+        keys = purge_keys(session)
+        changes = purge_changes(session)
+    finally:
+        Session.remove()
+    if keys:
+        logger.info('%d Idempotency-Keys expiradas removidas', keys)
+    if changes:
+        logger.info('%d alterações antigas removidas do registro de alterações', changes)
+
+
+class DueDateScheduler():
+    '''Class representing the due date email scheduler'''
+    def __init__(self, interval: float = None):
+        # None reads SCHEDULER_INTERVAL when the scheduler runs
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        '''
+            Inicia o agendador em uma thread de fundo.
+        '''
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target = self.run, name = 'due-date-scheduler', daemon = True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None) -> None:
+        '''
+            Interrompe o agendador.
+        '''
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def run(self) -> None:
+        '''
+            Verifica os lembretes a vencer a cada intervalo até que o
+            agendador seja interrompido. Também remove as Idempotency-Keys
+            expiradas e as alterações antigas.
+        '''
+        logger.info('Agendador de emails de prazo final iniciado')
+        interval = self.interval or scheduler_settings()['interval']
+        while not self._stopped.is_set():
+            try:
+                queue_due_date_emails()
+            except Exception as error:
+                logger.warning('Erro ao agendar emails de prazo final: %s', error)
+            try:
+                purge_expired()
+            except Exception as error:
+                logger.warning('Erro ao remover registros expirados: %s', error)
+            self._stopped.wait(interval)
+
+
+due_date_scheduler = DueDateScheduler()
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from logger import configure_logging
+
+    load_dotenv('../.env')
+    configure_logging()
+    if '--once' in sys.argv:
+        queue_due_date_emails()
+    else:
+        due_date_scheduler.run()
@@ -0,0 +1,103 @@
+'''
+    Module responsible for the accent insensitive full text search over
+    reminders, backed by an SQLite FTS5 index kept in sync by triggers.
+'''
+import re
+from typing import List
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from unidecode import unidecode
+from model.reminder import Reminder
+from model.reminder_query import reminders_with_email
+from logger import logger
+
+SEARCH_TABLE = 'reminder_fts'
+
+# External content table: the index stores only the tokens, the text is read
+# from reminder. remove_diacritics makes the description accent insensitive,
+# the name is indexed already normalized with unidecode.
+CREATE_SEARCH_TABLE = f'''
+    CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(
+        name_normalized, description,
+        content = 'reminder', content_rowid = 'pk_reminder',
+        tokenize = 'unicode61 remove_diacritics 2')
+'''
+CREATE_SEARCH_TRIGGERS = (
+    f'''
+    CREATE TRIGGER IF NOT EXISTS reminder_fts_insert AFTER INSERT ON reminder BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, name_normalized, description)
+        VALUES (new.pk_reminder, new.name_normalized, new.description);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS reminder_fts_delete AFTER DELETE ON reminder BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, name_normalized, description)
+        VALUES ('delete', old.pk_reminder, old.name_normalized, old.description);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS reminder_fts_update
+    AFTER UPDATE OF name_normalized, description ON reminder BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, name_normalized, description)
+        VALUES ('delete', old.pk_reminder, old.name_normalized, old.description);
+        INSERT INTO {SEARCH_TABLE}(rowid, name_normalized, description)
+        VALUES (new.pk_reminder, new.name_normalized, new.description);
+    END
+    ''',
+)
+# Matches on the name weigh more than matches on the description
+RANK = f'bm25({SEARCH_TABLE}, 10.0, 1.0)'
+
+
+def has_search_index(bind) -> bool:
+    '''
+        Indica se o banco do engine ou conexão tem o índice de busca textual.
+    '''
+    return bind.dialect.name == 'sqlite'
+
+def create_search_index(engine: Engine) -> None:
+    '''
+        Cria o índice de busca textual e seus triggers, indexando os
+        lembretes já existentes na primeira execução.
+    '''
+    if not has_search_index(engine):
+        return
+    with engine.begin() as connection:
+        exists = connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {'name': SEARCH_TABLE}).first()
+        if not exists:
+            logger.info('Criando índice de busca textual %s', SEARCH_TABLE)
+            connection.exec_driver_sql(CREATE_SEARCH_TABLE)
+            connection.exec_driver_sql(
+                f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')")
+        for trigger in CREATE_SEARCH_TRIGGERS:
+            connection.exec_driver_sql(trigger)
+
+def build_match_query(terms: str, prefix: bool = True) -> str:
+    '''
+        Converte o texto buscado em uma consulta FTS5: cada palavra,
+        normalizada sem acentos, deve estar presente no lembrete e, com
+        prefix, pode ser apenas o início de uma palavra.
+    '''
+    words = re.findall(r'\w+', unidecode(terms.lower()))
+    suffix = '*' if prefix else ''
+    return ' '.join(f'"{word}"{suffix}' for word in words)
+
+def search_reminders(session, terms: str, limit: int, prefix: bool = True) -> List[Reminder]:
+    '''
+        Retorna até limit lembretes que correspondem ao texto buscado,
+        ordenados por relevância.
+    '''
+    match = build_match_query(terms, prefix)
+    if not match:
+        return []
+    ids = session.execute(
+        text(f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match '
+             f'ORDER BY {RANK} LIMIT :limit'),
+        {'match': match, 'limit': limit}).scalars().all()
+    if not ids:
+        return []
+    reminders = reminders_with_email(session).filter(Reminder.id.in_(ids)).all()
+    position = {reminder_id: index for index, reminder_id in enumerate(ids)}
+    return sorted(reminders, key = lambda reminder: position[reminder.id])
@@ -0,0 +1,53 @@
+'''Module responsible for counting and timing the SQL statements issued per request'''
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class StatementCounter():
+    '''
+        Conta e cronometra, por thread, os comandos SQL executados pelo
+        engine. Usado para medir quantas consultas cada requisição realiza
+        e quanto tempo elas levam.
+    '''
+    def __init__(self):
+        self._local = threading.local()
+
+    def listen(self, engine: Engine) -> None:
+        '''
+            Registra o contador nos eventos de execução do engine.
+        '''
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _before_cursor_execute(self, *args) -> None:
+        self._local.count = self.count + 1
+        self._local.started = time.perf_counter()
+
+    def _after_cursor_execute(self, *args) -> None:
+        started = getattr(self._local, 'started', None)
+        if started is not None:
+            self._local.seconds = self.seconds + time.perf_counter() - started
+            self._local.started = None
+
+    @property
+    def count(self) -> int:
+        '''Statements executed by the current thread since the last reset'''
+        return getattr(self._local, 'count', 0)
+
+    @property
+    def seconds(self) -> float:
+        '''Time spent executing statements by the current thread since the last reset'''
+        return getattr(self._local, 'seconds', 0.0)
+
+    def reset(self) -> None:
+        '''
+            Zera o contador da thread atual.
+        '''
+        self._local.count = 0
+        self._local.seconds = 0.0
+        self._local.started = None
+
+
+statement_counter = StatementCounter()
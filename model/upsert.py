@@ -0,0 +1,64 @@
+'''
+    Module responsible for inserts that resolve unique key conflicts in the
+    database, in a single statement, instead of failing the transaction with
+    an IntegrityError: rows are either ignored or upserted. Uses INSERT ...
+    ON CONFLICT on SQLite and PostgreSQL.
+'''
+from typing import List, Sequence
+from sqlalchemy import Table, insert, update, select, and_
+from sqlalchemy.dialects import sqlite, postgresql
+
+CONFLICT_INSERTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+
+def insert_ignore(session, table: Table, rows: List[dict], *key: str) -> int:
+    '''
+        Insere as linhas, ignorando as que violam uma chave única, e retorna
+        quantas foram inseridas. Nos demais bancos, as linhas cuja chave
+        (colunas informadas em key) já existe são descartadas por uma
+        consulta prévia.
+    '''
+    if not rows:
+        return 0
+    conflict_insert = CONFLICT_INSERTS.get(session.get_bind().dialect.name)
+    if conflict_insert:
+        return session.execute(conflict_insert(table).on_conflict_do_nothing(), rows).rowcount
+    inserted = 0
+    for row in rows:
+        exists = session.execute(
+            select(table.c[key[0]])
+            .where(and_(*[table.c[column] == row[column] for column in key]))).first()
+        if not exists:
+            session.execute(insert(table), [row])
+            inserted += 1
+    return inserted
+
+def upsert(session, table: Table, rows: List[dict], key: str, columns: Sequence[str],
+           values: dict = None) -> None:
+    '''
+        Insere as linhas ou, quando a chave única key já existe, atualiza as
+        colunas informadas com os valores enviados e as colunas de values
+        com valores fixos. Nos demais bancos, cada linha é atualizada e, se
+        não existir, inserida.
+    '''
+    if not rows:
+        return
+    values = values or {}
+    conflict_insert = CONFLICT_INSERTS.get(session.get_bind().dialect.name)
+    if conflict_insert:
+        statement = conflict_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements = [key],
+            set_ = {**{column: statement.excluded[column] for column in columns}, **values})
+        session.execute(statement, rows)
+        return
+    for row in rows:
+        updated = session.execute(
+            update(table)
+            .where(table.c[key] == row[key])
+            .values(**{column: row[column] for column in columns}, **values)).rowcount
+        if not updated:
+            session.execute(insert(table), [row])
@@ -3,5 +3,18 @@ from schemas.reminder import ReminderSchema, ReminderUpdateSchema, \
                             ReminderSearchSchema, ReminderDeleteSchema, \
                             ReminderViewSchema, RemindersListSchema, \
                             ReminderSearchByNameSchema, EmailSentSchema, \
-                                show_reminder, show_reminders
+                            ReminderListQuerySchema, ReminderBulkSchema, \
+                            ReminderBulkDeleteSchema, ReminderBulkResultSchema, \
+                            ReminderFullTextSearchSchema, CacheStatsSchema, \
+                            ReminderImportQuerySchema, ReminderImportResultSchema, \
+                            ImportErrorSchema, ReminderExportQuerySchema, \
+                            ReminderUpcomingQuerySchema, ReminderOccurrenceSchema, \
+                            RemindersUpcomingSchema, NotificationQuerySchema, \
+                            NotificationViewSchema, NotificationsListSchema, \
+                            ReminderUpsertQuerySchema, ChangesQuerySchema, ChangeSchema, \
+                            ChangesSchema, \
+                                show_reminder, show_reminders, stream_reminders, \
+                                show_reminder_row, dump_reminder_rows, dumps, \
+                                validate_bulk_items, validate_item, parse_reminder_items, \
+                                show_notification, show_changes
 from schemas.error import ErrorSchema
@@ -2,11 +2,43 @@
     Schema responsible for defining how routes return messages are
     displayed and also for routes parameters validation.
 '''
-from typing import Optional, List
+from typing import Optional, List, Iterable, Dict, Any, Type, Tuple
 import re
 from datetime import datetime
-from pydantic import BaseModel, validator
+from flask import json
+from werkzeug.http import http_date
+try:
+    import orjson
+except ImportError:
+    orjson = None
+from pydantic import BaseModel, validator, ValidationError
 from model.reminder import Reminder
+from model.pagination import ORDER_FIELDS, ORDER_BY_ID, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from model.recurrence import RECURRENCE_FREQUENCIES
+
+MAX_UPCOMING = 1000
+MAX_CHANGES = 1000
+MAX_CHANGES_WAIT = 30
+
+
+def validate_recurrence(parameter):
+    '''Validator for recurrence'''
+    # Empty values, as in CSV files, mean no recurrence
+    if not parameter:
+        return None
+    if parameter not in RECURRENCE_FREQUENCIES:
+        raise ValueError(f'A recorrência deve ser uma de: {", ".join(RECURRENCE_FREQUENCIES)}')
+    return parameter
+
+def default_recurrence_interval(parameter):
+    '''Default for an empty recurrence_interval'''
+    return 1 if parameter in (None, '') else parameter
+
+def validate_recurrence_interval(parameter):
+    '''Validator for recurrence_interval'''
+    if not 0 < parameter <= 366:
+        raise ValueError('O intervalo da recorrência deve estar entre 1 e 366')
+    return parameter
 
 
 class ReminderSchema(BaseModel):
@@ -19,6 +51,8 @@ class ReminderSchema(BaseModel):
     send_email: Optional[bool] = False
     email: Optional[str]
     recurring: Optional[bool] = False
+    recurrence: Optional[str] = None
+    recurrence_interval: Optional[int] = 1
 
     @validator('name', allow_reuse = True)
     def validator_name(cls, parameter):
@@ -29,6 +63,12 @@ class ReminderSchema(BaseModel):
             raise ValueError('O nome do lembrete não pode conter números')
         return parameter
 
+    _validator_recurrence = validator('recurrence', allow_reuse = True)(validate_recurrence)
+    _default_recurrence_interval = validator('recurrence_interval', pre = True, allow_reuse = True)(
+        default_recurrence_interval)
+    _validator_recurrence_interval = validator('recurrence_interval', allow_reuse = True)(
+        validate_recurrence_interval)
+
     @validator('description', allow_reuse = True)
     def validator_description(cls, parameter):
         '''Validator for description'''
@@ -49,8 +89,16 @@ class ReminderUpdateSchema(BaseModel):
     send_email: Optional[bool] = True
     email: Optional[str] = 'emaildeexemplo@email.com'
     recurring: Optional[bool] = False
+    recurrence: Optional[str] = None
+    recurrence_interval: Optional[int] = 1
     updated_at = datetime.now()
 
+    _validator_recurrence = validator('recurrence', allow_reuse = True)(validate_recurrence)
+    _default_recurrence_interval = validator('recurrence_interval', pre = True, allow_reuse = True)(
+        default_recurrence_interval)
+    _validator_recurrence_interval = validator('recurrence_interval', allow_reuse = True)(
+        validate_recurrence_interval)
+
     @validator('name', allow_reuse = True)
     def validator_name(cls, parameter):
         '''Validator for name'''
@@ -67,6 +115,21 @@ class ReminderUpdateSchema(BaseModel):
             raise ValueError('A descrição não pode ser vazia!')
         return parameter
 
+    @validator('due_date', allow_reuse = True)
+    def validator_due_date(cls, parameter):
+        '''Validator for due_date'''
+        # Dates are stored without time zone, as sent to /create
+        return parameter.replace(tzinfo = None) if parameter else parameter
+
+
+class ReminderUpsertQuerySchema(BaseModel):
+    '''
+        Define o modo de gravação de lembretes. Com upsert=true, um lembrete
+        de mesmo nome é atualizado em vez de rejeitado, e nada é gravado se
+        ele já tiver os valores enviados.
+    '''
+    upsert: Optional[bool] = False
+
 
 class ReminderSearchSchema(BaseModel):
     '''
@@ -82,6 +145,77 @@ class ReminderSearchByNameSchema(BaseModel):
     name: str
 
 
+class ReminderListQuerySchema(BaseModel):
+    '''
+        Define os parâmetros de paginação da listagem de lembretes.
+    '''
+    cursor: Optional[str]
+    page_size: Optional[int] = DEFAULT_PAGE_SIZE
+    order_by: Optional[str] = ORDER_BY_ID
+    stream: Optional[bool] = False
+
+    @validator('page_size', allow_reuse = True)
+    def validator_page_size(cls, parameter):
+        '''Validator for page_size'''
+        if parameter is None:
+            return DEFAULT_PAGE_SIZE
+        if not 0 < parameter <= MAX_PAGE_SIZE:
+            raise ValueError(f'O tamanho da página deve estar entre 1 e {MAX_PAGE_SIZE}')
+        return parameter
+
+    @validator('order_by', allow_reuse = True)
+    def validator_order_by(cls, parameter):
+        '''Validator for order_by'''
+        if parameter is None:
+            return ORDER_BY_ID
+        if parameter not in ORDER_FIELDS:
+            raise ValueError(f'Ordenação deve ser uma de: {", ".join(ORDER_FIELDS)}')
+        return parameter
+
+
+class ReminderUpcomingQuerySchema(BaseModel):
+    '''
+        Define a janela de busca das próximas ocorrências de lembretes. Por
+        padrão, de agora até os próximos 7 dias.
+    '''
+    start: Optional[datetime]
+    end: Optional[datetime]
+    limit: Optional[int] = 100
+
+    @validator('start', 'end', allow_reuse = True)
+    def validator_dates(cls, parameter):
+        '''Validator for start and end'''
+        # Dates are stored without time zone, as sent to /create
+        return parameter.replace(tzinfo = None) if parameter else parameter
+
+    @validator('limit', allow_reuse = True)
+    def validator_limit(cls, parameter):
+        '''Validator for limit'''
+        if parameter is None:
+            return 100
+        if not 0 < parameter <= MAX_UPCOMING:
+            raise ValueError(f'O limite deve estar entre 1 e {MAX_UPCOMING}')
+        return parameter
+
+
+class ReminderFullTextSearchSchema(BaseModel):
+    '''
+        Define a busca textual de lembretes por nome e descrição.
+    '''
+    q: str
+    limit: Optional[int] = 20
+    prefix: Optional[bool] = True
+
+    @validator('limit', allow_reuse = True)
+    def validator_limit(cls, parameter):
+        '''Validator for limit'''
+        if parameter is None:
+            return 20
+        if not 0 < parameter <= 100:
+            raise ValueError('O limite deve estar entre 1 e 100')
+        return parameter
+
+
 class ReminderDeleteSchema(BaseModel):
     '''
         Define como será o retorno após a remoção de um lembrete.
@@ -95,6 +229,7 @@ class RemindersListSchema(BaseModel):
         Define como a listagem de lembretes será retornada.
     '''
     reminders:List[ReminderSchema]
+    next_cursor: Optional[str]
 
 
 class ReminderViewSchema(BaseModel):
@@ -109,6 +244,245 @@ class ReminderViewSchema(BaseModel):
     email: Optional[str]
     send_email: Optional[bool]
     recurring: Optional[bool]
+    recurrence: Optional[str]
+    recurrence_interval: Optional[int]
+
+
+class ReminderOccurrenceSchema(ReminderViewSchema):
+    '''
+        Define como será a visualização de um lembrete com a sua próxima
+        ocorrência.
+    '''
+    next_due_at: datetime
+
+
+class RemindersUpcomingSchema(BaseModel):
+    '''
+        Define como as próximas ocorrências de lembretes serão retornadas,
+        em ordem de ocorrência.
+    '''
+    reminders: List[ReminderOccurrenceSchema]
+
+
+class ReminderBulkSchema(BaseModel):
+    '''
+        Define a lista de lembretes para criação ou atualização em lote.
+        Cada item é validado individualmente, para que um item inválido não
+        impeça a gravação dos demais.
+    '''
+    __root__: List[Any]
+
+
+class ReminderBulkDeleteSchema(BaseModel):
+    '''
+        Define a lista de ids de lembretes a remover em lote.
+    '''
+    __root__: List[int]
+
+
+class BulkErrorSchema(BaseModel):
+    '''
+        Define como o erro de um item de uma operação em lote é retornado.
+    '''
+    index: int
+    mensagem: str
+
+
+class ReminderBulkResultSchema(BaseModel):
+    '''
+        Define o retorno de uma operação em lote: ids processados com
+        sucesso e os erros, indicados pela posição do item na lista enviada.
+    '''
+    total: int
+    ids: List[int]
+    errors: List[BulkErrorSchema]
+    # Only with upsert=true: reminders that already had the values sent
+    unchanged: Optional[List[int]]
+
+
+class ReminderImportQuerySchema(BaseModel):
+    '''
+        Define os parâmetros da importação de lembretes. O arquivo é enviado
+        como corpo da requisição ou no campo file de um formulário multipart.
+    '''
+    format: Optional[str] = None
+    # None uses BULK_CHUNK_SIZE
+    chunk_size: Optional[int] = None
+
+    @validator('format', allow_reuse = True)
+    def validator_format(cls, parameter):
+        '''Validator for format'''
+        if parameter is not None and parameter not in ('ndjson', 'csv'):
+            raise ValueError('O formato deve ser ndjson ou csv')
+        return parameter
+
+    @validator('chunk_size', allow_reuse = True)
+    def validator_chunk_size(cls, parameter):
+        '''Validator for chunk_size'''
+        if parameter is not None and not 0 < parameter <= 10000:
+            raise ValueError('O tamanho do bloco deve estar entre 1 e 10000')
+        return parameter
+
+
+class ReminderExportQuerySchema(BaseModel):
+    '''
+        Define o formato e os filtros opcionais da exportação de lembretes.
+        As datas seguem o mesmo formato da rota /create.
+    '''
+    format: Optional[str] = 'ndjson'
+    due_from: Optional[datetime]
+    due_to: Optional[datetime]
+    updated_since: Optional[datetime]
+
+    @validator('format', allow_reuse = True)
+    def validator_format(cls, parameter):
+        '''Validator for format'''
+        if parameter is None:
+            return 'ndjson'
+        if parameter not in ('ndjson', 'csv'):
+            raise ValueError('O formato deve ser ndjson ou csv')
+        return parameter
+
+    @validator('due_from', 'due_to', 'updated_since', allow_reuse = True)
+    def validator_dates(cls, parameter):
+        '''Validator for the date filters'''
+        # Dates are stored without time zone, as sent to /create
+        return parameter.replace(tzinfo = None) if parameter else parameter
+
+
+class ImportErrorSchema(BaseModel):
+    '''
+        Define como a rejeição de uma linha importada é retornada.
+    '''
+    line: int
+    mensagem: str
+
+
+class ReminderImportResultSchema(BaseModel):
+    '''
+        Define o resumo de uma importação: linhas lidas, aceitas, rejeitadas
+        e o motivo das rejeições, indicadas pelo número da linha no arquivo.
+    '''
+    total: int
+    accepted: int
+    rejected: int
+    errors: List[ImportErrorSchema]
+
+
+class CacheStatsSchema(BaseModel):
+    '''
+        Define como as estatísticas do cache de leitura serão retornadas.
+    '''
+    backend: str
+    hits: int
+    misses: int
+    invalidations: int
+
+
+class ChangesQuerySchema(BaseModel):
+    '''
+        Define os parâmetros do feed de alterações. since é o next_cursor da
+        resposta anterior (0 para sincronizar tudo); com wait, a resposta
+        espera até wait segundos por uma alteração (long polling); com
+        stream=true, as alterações são enviadas como server-sent events.
+    '''
+    since: Optional[int] = 0
+    limit: Optional[int] = 100
+    wait: Optional[int] = 0
+    stream: Optional[bool] = False
+
+    @validator('since', allow_reuse = True)
+    def validator_since(cls, parameter):
+        '''Validator for since'''
+        if parameter is None:
+            return 0
+        if parameter < 0:
+            raise ValueError('O cursor não pode ser negativo')
+        return parameter
+
+    @validator('limit', allow_reuse = True)
+    def validator_limit(cls, parameter):
+        '''Validator for limit'''
+        if parameter is None:
+            return 100
+        if not 0 < parameter <= MAX_CHANGES:
+            raise ValueError(f'O limite deve estar entre 1 e {MAX_CHANGES}')
+        return parameter
+
+    @validator('wait', allow_reuse = True)
+    def validator_wait(cls, parameter):
+        '''Validator for wait'''
+        if parameter is None:
+            return 0
+        if not 0 <= parameter <= MAX_CHANGES_WAIT:
+            raise ValueError(f'A espera deve estar entre 0 e {MAX_CHANGES_WAIT} segundos')
+        return parameter
+
+
+class ChangeSchema(BaseModel):
+    '''
+        Define como a alteração de um lembrete é retornada: o estado atual
+        do lembrete ou, se ele foi removido, deleted=true sem o lembrete.
+    '''
+    id: int
+    cursor: int
+    deleted: bool
+    reminder: Optional[ReminderViewSchema]
+
+
+class ChangesSchema(BaseModel):
+    '''
+        Define como o feed de alterações é retornado. next_cursor deve ser
+        enviado como since na próxima consulta; has_more indica que há mais
+        alterações a buscar imediatamente.
+    '''
+    changes: List[ChangeSchema]
+    next_cursor: int
+    has_more: bool
+
+
+class NotificationQuerySchema(BaseModel):
+    '''
+        Define os filtros da consulta ao registro de notificações.
+    '''
+    reminder_id: Optional[int]
+    kind: Optional[str]
+    status: Optional[str]
+    limit: Optional[int] = 100
+
+    @validator('limit', allow_reuse = True)
+    def validator_limit(cls, parameter):
+        '''Validator for limit'''
+        if parameter is None:
+            return 100
+        if not 0 < parameter <= 1000:
+            raise ValueError('O limite deve estar entre 1 e 1000')
+        return parameter
+
+
+class NotificationViewSchema(BaseModel):
+    '''
+        Define como uma notificação registrada é exibida, com a situação do
+        envio: pending, sending, sent ou failed.
+    '''
+    id: int
+    reminder_id: Optional[int]
+    # Reminders notified, including every reminder of a digest
+    reminder_ids: List[int]
+    kind: str
+    email_receiver: str
+    status: str
+    attempts: int
+    last_error: Optional[str]
+    created_at: datetime
+    sent_at: Optional[datetime]
+
+
+class NotificationsListSchema(BaseModel):
+    '''
+        Define como o registro de notificações será retornado.
+    '''
+    notifications: List[NotificationViewSchema]
 
 
 class EmailSentSchema(BaseModel):
@@ -118,6 +492,60 @@ class EmailSentSchema(BaseModel):
     message: str
     name: str
 
+def validate_item(schema: Type[BaseModel], item: Any):
+    '''
+        Valida um item com o schema informado. Retorna o item validado e
+        None, ou None e a mensagem de erro.
+    '''
+    try:
+        return schema(**item), None
+    except (ValidationError, TypeError) as error:
+        message = '; '.join(detail['msg'] for detail in error.errors()) \
+            if isinstance(error, ValidationError) else 'Item inválido'
+        return None, message
+
+def validate_bulk_items(schema: Type[BaseModel], items: List[Dict[str, Any]]):
+    '''
+        Valida cada item de uma operação em lote com o schema informado.
+        Retorna as tuplas (posição, item validado) e os erros por posição.
+    '''
+    valid, errors = [], []
+    for index, item in enumerate(items):
+        validated, message = validate_item(schema, item)
+        if message:
+            errors.append({'index': index, 'mensagem': message})
+        else:
+            valid.append((index, validated))
+    return valid, errors
+
+def parse_reminder_items(items: Iterable[Tuple[int, Any]]):
+    '''
+        Valida itens (posição, item) no formato da rota /create e os converte
+        nos valores gravados por bulk_create. Retorna as tuplas (posição,
+        valores) e os erros por posição.
+    '''
+    rows, errors = [], []
+    for index, item in items:
+        form, message = validate_item(ReminderSchema, item)
+        if message:
+            errors.append({'index': index, 'mensagem': message})
+            continue
+        try:
+            due_date = datetime.strptime(form.due_date, '%Y-%m-%dT%H:%M:%S.%fZ')
+        except ValueError:
+            errors.append({'index': index, 'mensagem': 'Data final inválida'})
+            continue
+        rows.append((index, {
+            'name': form.name,
+            'description': form.description,
+            'due_date': due_date,
+            'send_email': form.send_email,
+            'email': form.email,
+            'recurring': form.recurring,
+            'recurrence': form.recurrence,
+            'recurrence_interval': form.recurrence_interval}))
+    return rows, errors
+
 def show_reminder(reminder: Reminder):
     '''
         Retorna a representação de um lembrete seguindo o esquema definido
@@ -131,24 +559,94 @@ def show_reminder(reminder: Reminder):
         'due_date': reminder.due_date,
         'send_email': reminder.send_email,
         'email': reminder.email_relationship[0].email,
-        'recurring': reminder.recurring
+        'recurring': reminder.recurring,
+        'recurrence': reminder.recurrence,
+        'recurrence_interval': reminder.recurrence_interval
     }
 
-def show_reminders(reminders: List[Reminder]):
+def show_reminders(reminders: List[Reminder], next_cursor: Optional[str] = None):
     '''
         Retorna a representação do lembrete seguindo o esquema definido
         em ReminderViewSchema.
     '''
+    result = [show_reminder(reminder) for reminder in reminders]
+    return {'reminders': result, 'next_cursor': next_cursor}
+
+def dumps(value) -> bytes:
+    '''
+        Codifica em JSON com o orjson, quando instalado, ou com o json do
+        Flask caso contrário.
+    '''
+    if orjson:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii = False, separators = (',', ':')).encode()
+
+def show_reminder_row(row) -> dict:
+    '''
+        Representação de uma linha de reminder_rows, igual à de
+        show_reminder, com as datas no mesmo formato do JSON do Flask.
+    '''
+    view = row._asdict()
+    for field in ('due_date', 'next_due_at'):
+        if view.get(field) is not None:
+            view[field] = http_date(view[field])
+    return view
+
+def dump_reminder_rows(rows: Iterable, next_cursor: Optional[str] = None) -> bytes:
+    '''
+        Codifica diretamente em JSON a listagem de linhas de reminder_rows,
+        sem montar objetos Reminder.
+    '''
+    return dumps({'reminders': [show_reminder_row(row) for row in rows],
+                  'next_cursor': next_cursor})
+
+def stream_reminders(rows: Iterable):
+    '''
+        Gera a mesma representação de dump_reminder_rows em partes, um
+        lembrete por vez, para que a resposta possa ser enviada sem montar a
+        lista completa em memória.
+    '''
+    yield b'{"reminders":['
+    separator = b''
+    for row in rows:
+        yield separator + dumps(show_reminder_row(row))
+        separator = b','
+    yield b'],"next_cursor":null}'
+
+def show_notification(outbox) -> dict:
+    '''
+        Retorna a representação de uma notificação seguindo o esquema
+        definido em NotificationViewSchema.
+    '''
+    return {
+        'id': outbox.id,
+        'reminder_id': outbox.reminder_id,
+        'reminder_ids': outbox.reminder_ids(),
+        'kind': outbox.kind,
+        'email_receiver': outbox.email_receiver,
+        'status': outbox.status,
+        'attempts': outbox.attempts,
+        'last_error': outbox.last_error,
+        'created_at': outbox.created_at,
+        'sent_at': outbox.sent_at
+    }
+
+def show_changes(changes: List[Tuple[int, int]], rows: Dict[int, Any], since: int,
+                 limit: int) -> dict:
+    '''
+        Retorna a representação de uma página do feed de alterações
+        seguindo o esquema definido em ChangesSchema, a partir das tuplas
+        (id, cursor) e das linhas de reminder_rows de changes_since.
+    '''
     result = []
-    for reminder in reminders:
+    for reminder_id, cursor in changes:
+        row = rows.get(reminder_id)
         result.append({
-            'id': reminder.id,
-            'name': reminder.name,
-            'name_normalized': reminder.name_normalized,
-            'description': reminder.description,
-            'due_date': reminder.due_date,
-            'send_email': reminder.send_email,
-            'email': reminder.email_relationship[0].email,
-            'recurring': reminder.recurring
+            'id': reminder_id,
+            'cursor': cursor,
+            'deleted': row is None,
+            'reminder': show_reminder_row(row) if row is not None else None,
         })
-    return {'reminders': result}
+    return {'changes': result,
+            'next_cursor': changes[-1][1] if changes else since,
+            'has_more': len(changes) == limit}
@@ -0,0 +1,90 @@
+'''
+    Tests of the API and of the models. Each test runs the application
+    factory on a scratch SQLite database, without the outbox worker and
+    scheduler threads, which the tests drive directly when needed. Logs
+    are written to a temporary directory:
+
+        python -m nose2 -v
+'''
+import atexit
+import os
+import shutil
+import tempfile
+import unittest
+
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+import logger
+from app import create_app
+from cache import reminder_cache
+from model import Session
+
+DUE_DATE = '2030-01-01T10:00:00.000Z'
+
+logger.LOG_PATH = tempfile.mkdtemp(prefix = 'reminders-test-log-')
+atexit.register(shutil.rmtree, logger.LOG_PATH, ignore_errors = True)
+
+
+def reminder_form(name: str, **fields) -> dict:
+    '''
+        Formulário da rota /create, com os campos informados sobrepostos.
+    '''
+    form = {
+        'name': name,
+        'description': f'descrição de {name}',
+        'due_date': DUE_DATE,
+        'email': 'lembrete@email.com',
+        'send_email': 'true',
+    }
+    form.update(fields)
+    return form
+
+
+class ApiTestCase(unittest.TestCase):
+    '''
+        Base dos testes: a aplicação sobre um banco novo a cada teste, em
+        um diretório temporário da classe.
+    '''
+    @classmethod
+    def setUpClass(cls):
+        cls._workdir = tempfile.mkdtemp(prefix = 'reminders-test-')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls._workdir, ignore_errors = True)
+
+    def setUp(self):
+        self.database = self.database_path()
+        self.app = create_app(self.config())
+        self.client = self.app.test_client()
+        reminder_cache.backend.clear()
+
+    def tearDown(self):
+        Session.remove()
+
+    def database_path(self) -> str:
+        '''
+            Arquivo do banco do teste.
+        '''
+        return os.path.join(self._workdir, f'{self.id()}.sqlite3')
+
+    def config(self) -> dict:
+        '''
+            Configuração passada a create_app.
+        '''
+        return {
+            'DB_URL': f'sqlite:///{self.database}',
+            'DB_INIT_SCHEMA': '1',
+            'DOTENV_PATH': os.devnull,
+            'OUTBOX_WORKER': '0',
+            'SCHEDULER': '0',
+            'ASYNC_EMAIL': '1',
+        }
+
+    def create(self, name: str, **fields) -> dict:
+        '''
+            Cria um lembrete pela rota /create e retorna a sua representação.
+        '''
+        response = self.client.post('/create', data = reminder_form(name, **fields))
+        self.assertEqual(response.status_code, 200, response.get_data(as_text = True))
+        return response.json
@@ -0,0 +1,31 @@
+'''Tests of the application factory'''
+import os
+from unittest import mock
+from app import create_app
+from cache import reminder_cache
+from model.outbox_worker import outbox_settings
+from model.scheduler import scheduler_settings
+from model.bulk import bulk_chunk_size
+from tests import ApiTestCase
+
+
+class CreateAppTest(ApiTestCase):
+    '''
+        As configurações do .env carregado por create_app valem também para
+        os módulos importados antes dele.
+    '''
+    def test_dotenv_settings(self):
+        '''CACHE_TTL, OUTBOX_POLL_INTERVAL, SCHEDULER_DIGEST e BULK_CHUNK_SIZE vêm do .env'''
+        dotenv = os.path.join(self._workdir, 'settings.env')
+        with open(dotenv, 'w') as file:
+            file.write('CACHE_TTL=5\nOUTBOX_POLL_INTERVAL=1\nSCHEDULER_DIGEST=0\nBULK_CHUNK_SIZE=7\n')
+        names = ('CACHE_TTL', 'OUTBOX_POLL_INTERVAL', 'SCHEDULER_DIGEST', 'BULK_CHUNK_SIZE')
+        # load_dotenv writes to os.environ, which is restored afterwards
+        with mock.patch.dict(os.environ):
+            for name in names:
+                os.environ.pop(name, None)
+            create_app(dict(self.config(), DOTENV_PATH = dotenv))
+            self.assertEqual(reminder_cache.backend.ttl, 5)
+            self.assertEqual(outbox_settings()['poll_interval'], 1)
+            self.assertFalse(scheduler_settings()['digest'])
+            self.assertEqual(bulk_chunk_size(), 7)
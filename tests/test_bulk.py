@@ -0,0 +1,51 @@
+'''Tests of the bulk create, update and delete routes'''
+from tests import ApiTestCase, reminder_form
+
+
+class BulkTest(ApiTestCase):
+    '''
+        Os itens inválidos de um lote são informados pela posição, sem
+        impedir a gravação dos demais.
+    '''
+    def test_create(self):
+        '''Itens inválidos e nomes duplicados voltam em errors'''
+        self.create('Dentista')
+        response = self.client.post('/reminders/bulk', json = [
+            reminder_form('Mecanico'),
+            reminder_form('Dentista'),
+            reminder_form('Lembrete 2'),
+            reminder_form('mecanico'),
+            reminder_form('Padaria'),
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['total'], 5)
+        self.assertEqual([error['index'] for error in response.json['errors']], [1, 2, 3])
+        names = [self.client.get(f'/reminder?id={reminder_id}').json['name']
+                 for reminder_id in response.json['ids']]
+        self.assertEqual(names, ['Mecanico', 'Padaria'])
+
+    def test_update_changes_only_sent_fields(self):
+        '''Apenas os campos enviados em cada item são alterados'''
+        first = self.create('Dentista')
+        second = self.create('Mecanico')
+        response = self.client.put('/reminders/bulk', json = [
+            {'id': first['id'], 'description': 'nova'},
+            {'id': 9999, 'description': 'nova'},
+            {'description': 'sem id'},
+            {'id': second['id'], 'name': 'Dentista'},
+        ])
+        self.assertEqual(response.json['ids'], [first['id']])
+        self.assertEqual([error['index'] for error in response.json['errors']], [1, 2, 3])
+        updated = self.client.get(f"/reminder?id={first['id']}").json
+        self.assertEqual((updated['name'], updated['description'], updated['email']),
+                         ('Dentista', 'nova', first['email']))
+        self.assertEqual(self.client.get(f"/reminder?id={second['id']}").json['name'], 'Mecanico')
+
+    def test_delete(self):
+        '''Ids inexistentes voltam em errors e os demais são removidos'''
+        ids = [self.create(name)['id'] for name in ('Dentista', 'Mecanico')]
+        response = self.client.delete('/reminders/bulk', json = [ids[0], 9999, ids[1]])
+        self.assertEqual(response.json['ids'], ids)
+        self.assertEqual([error['index'] for error in response.json['errors']], [1])
+        self.assertEqual(self.client.get('/reminders').json['reminders'], [])
+        self.assertEqual(self.client.get(f'/reminder?id={ids[0]}').status_code, 404)
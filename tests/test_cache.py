@@ -0,0 +1,63 @@
+'''Tests of the reminder read cache'''
+from cache import reminder_cache, ReminderCache, RedisCache, LocalCache, CachedView
+from tests import ApiTestCase, reminder_form
+
+
+class FakeRedis():
+    '''
+        Substituto do cliente redis-py, em memória.
+    '''
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    def setex(self, key, ttl, value):
+        self.values[key] = value.encode()
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+    def incr(self, key):
+        self.values[key] = str(int(self.values.get(key, 0)) + 1).encode()
+
+    def expire(self, key, ttl):
+        pass
+
+
+class ReminderCacheTest(ApiTestCase):
+    '''
+        Uma visualização lida antes de uma alteração não é servida depois
+        dela.
+    '''
+    def test_view_read_before_update_is_not_served(self):
+        '''A visualização antiga gravada após a invalidação é descartada'''
+        reminder_id = self.create('Dentista')['id']
+        _, generation = reminder_cache.get_by_id(reminder_id)
+        self.client.put('/update', data = reminder_form(
+            'Dentista', id = reminder_id, description = 'nova', due_date = '2030-01-01T10:00:00'))
+        # A reader that loaded the reminder before the update caches it now
+        reminder_cache.set(reminder_id, 'dentista',
+                           CachedView('velho', None, '{"description":"velha"}'), generation)
+        response = self.client.get(f'/reminder?id={reminder_id}')
+        self.assertEqual(response.json['description'], 'nova')
+        self.assertEqual(self.client.get(f'/reminder?id={reminder_id}').json['description'], 'nova')
+
+    def test_backends(self):
+        '''Os dois backends descartam entradas de gerações anteriores'''
+        for backend in (LocalCache(), RedisCache(FakeRedis())):
+            cache = ReminderCache(backend)
+            view = CachedView('etag', None, '{}')
+            _, generation = cache.get_by_id(1)
+            cache.set(1, 'um', view, generation)
+            self.assertEqual(cache.get_by_id(1), (view, generation))
+
+            _, generation = cache.get_by_id(2)
+            cache.invalidate(2)
+            cache.set(2, 'dois', view, generation)
+            self.assertEqual(cache.get_by_id(2), (None, generation + 1))
@@ -0,0 +1,70 @@
+'''Tests of the reminder change feed'''
+from datetime import datetime, timedelta
+from tests import ApiTestCase, reminder_form
+from model import Session
+from sqlalchemy import text
+from model.change_log import purge_changes, changes_settings, CHANGES_SINCE
+
+
+class ChangeFeedTest(ApiTestCase):
+    '''
+        O feed retorna cada lembrete alterado uma única vez, com o estado
+        atual ou como removido.
+    '''
+    def changes(self, since: int = 0, **params) -> dict:
+        query = '&'.join(f'{name}={value}' for name, value in params.items())
+        response = self.client.get(f'/changes?since={since}&{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.json
+
+    def test_changes_are_compacted(self):
+        '''Várias alterações de um lembrete aparecem uma vez, e a remoção como deleted'''
+        kept = self.create('Dentista')['id']
+        removed = self.create('Mecanico')['id']
+        cursor = self.changes()['next_cursor']
+        for description in ('primeira', 'segunda'):
+            self.client.put('/update', data = reminder_form(
+                'Dentista', id = kept, description = description, due_date = '2030-01-01T10:00:00'))
+        self.client.delete(f'/delete?id={removed}')
+
+        page = self.changes(cursor)
+        self.assertEqual([(change['id'], change['deleted']) for change in page['changes']],
+                         [(kept, False), (removed, True)])
+        self.assertEqual(page['changes'][0]['reminder']['description'], 'segunda')
+        self.assertIsNone(page['changes'][1]['reminder'])
+        self.assertEqual(self.changes(page['next_cursor'])['changes'], [])
+
+    def test_pages(self):
+        '''has_more indica que há mais alterações depois de next_cursor'''
+        for name in ('Um', 'Dois', 'Tres'):
+            self.create(name)
+        first = self.changes(limit = 2)
+        self.assertTrue(first['has_more'])
+        second = self.changes(first['next_cursor'], limit = 2)
+        self.assertFalse(second['has_more'])
+        self.assertEqual(len(first['changes']) + len(second['changes']), 3)
+
+    def test_expired_cursor(self):
+        '''Um cursor anterior a uma remoção descartada recebe 410'''
+        self.create('Dentista')
+        removed = self.create('Mecanico')['id']
+        cursor = self.changes()['next_cursor'] - 1
+        self.client.delete(f'/delete?id={removed}')
+        purge_changes(Session(), datetime.utcnow() + changes_settings()['retention'] + timedelta(days = 1))
+
+        response = self.client.get(f'/changes?since={cursor}')
+        self.assertEqual(response.status_code, 410)
+        # A full resync still lists every existing reminder
+        self.assertEqual([change['deleted'] for change in self.changes()['changes']], [False])
+
+    def test_wait_returns_when_nothing_changes(self):
+        '''Sem alterações, wait responde com a lista vazia e o mesmo cursor'''
+        cursor = self.changes()['next_cursor']
+        page = self.changes(cursor, wait = 1)
+        self.assertEqual((page['changes'], page['next_cursor']), ([], cursor))
+
+    def test_reads_only_changes_after_cursor(self):
+        '''A consulta do feed percorre apenas o intervalo de seq após o cursor'''
+        plan = Session().execute(text(f'EXPLAIN QUERY PLAN {CHANGES_SINCE}'),
+                                 {'since': 0, 'limit': 10}).all()
+        self.assertIn('USING INTEGER PRIMARY KEY (rowid>?)', plan[0][-1])
@@ -0,0 +1,68 @@
+'''Tests of the ETag and Last-Modified validators of the reminder reads'''
+from unittest import mock
+from tests import ApiTestCase, reminder_form
+
+
+class ConditionalGetTest(ApiTestCase):
+    '''
+        Leituras com o validador atual recebem 304, e qualquer alteração
+        gera um validador novo.
+    '''
+    def update(self, reminder_id: int, description: str) -> None:
+        response = self.client.put('/update', data = reminder_form(
+            'Dentista', id = reminder_id, description = description,
+            due_date = '2030-01-01T10:00:00'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_reminder(self):
+        '''/reminder e /reminder_name respondem 304 até o lembrete mudar'''
+        reminder_id = self.create('Dentista')['id']
+        for path in (f'/reminder?id={reminder_id}', '/reminder_name?name=dentista'):
+            # Both the database and the cached reads honor the validators
+            for _ in range(2):
+                response = self.client.get(path)
+                etag = response.headers['ETag']
+                self.assertIn('Last-Modified', response.headers)
+                response = self.client.get(path, headers = {'If-None-Match': etag})
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.get_data(), b'')
+                self.assertEqual(response.headers['ETag'], etag)
+
+        self.update(reminder_id, 'nova')
+        response = self.client.get(f'/reminder?id={reminder_id}', headers = {'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.json['description'], 'nova')
+
+    def test_if_modified_since(self):
+        '''Sem If-None-Match, If-Modified-Since é usado'''
+        reminder_id = self.create('Dentista')['id']
+        last_modified = self.client.get(f'/reminder?id={reminder_id}').headers['Last-Modified']
+        response = self.client.get(f'/reminder?id={reminder_id}',
+                                   headers = {'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(f'/reminder?id={reminder_id}', headers = {
+            'If-Modified-Since': 'Mon, 01 Jan 2001 00:00:00 GMT'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_reminders(self):
+        '''/reminders muda de ETag a cada escrita e por parâmetros'''
+        reminder_id = self.create('Dentista')['id']
+        etag = self.client.get('/reminders').headers['ETag']
+        self.assertEqual(self.client.get('/reminders', headers = {'If-None-Match': etag}).status_code, 304)
+        self.assertNotEqual(self.client.get('/reminders?page_size=1').headers['ETag'], etag)
+
+        self.update(reminder_id, 'nova')
+        response = self.client.get('/reminders', headers = {'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.client.delete(f'/delete?id={reminder_id}')
+        self.assertEqual(self.client.get('/reminders', headers = {'If-None-Match': etag}).status_code, 200)
+
+    def test_reminders_without_version_table(self):
+        '''Sem a tabela de versão, /reminders é servido sem ETag'''
+        self.create('Dentista')
+        with mock.patch('app.current_version', return_value = (None, None)):
+            response = self.client.get('/reminders', headers = {'If-None-Match': '*'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response.headers)
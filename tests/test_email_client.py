@@ -0,0 +1,24 @@
+'''Tests of the pooled SMTP client'''
+import ssl
+from unittest import mock
+from tests import ApiTestCase
+from model.email_client import SMTPConnectionPool
+
+
+class SMTPConnectionPoolTest(ApiTestCase):
+    '''
+        As conexões SMTP com SSL verificam o certificado do servidor.
+    '''
+    def test_ssl_from_settings_verifies_certificates(self):
+        '''Com SMTP_SSL=1, o contexto verifica certificado e nome do servidor'''
+        with mock.patch.dict('os.environ', {'SMTP_SSL': '1'}):
+            pool = SMTPConnectionPool('usuario', 'senha')
+        self.assertTrue(pool.use_ssl)
+        self.assertEqual(pool._context.verify_mode, ssl.CERT_REQUIRED)
+        self.assertTrue(pool._context.check_hostname)
+
+    def test_without_ssl(self):
+        '''Com SMTP_SSL=0, nenhum contexto SSL é criado'''
+        with mock.patch.dict('os.environ', {'SMTP_SSL': '0'}):
+            pool = SMTPConnectionPool('usuario', 'senha')
+        self.assertIsNone(pool._context)
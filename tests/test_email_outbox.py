@@ -0,0 +1,93 @@
+'''Tests of the notification log and of the reminder ids it refers to'''
+from datetime import datetime, timedelta
+from sqlalchemy import MetaData, create_engine, text
+from sqlalchemy.schema import CreateTable
+from tests import ApiTestCase, reminder_form
+from model import Session, EmailOutbox
+from model.base import Base
+from model.reminder import Reminder
+from model.email_outbox import KIND_CREATED, KIND_UPDATED, KIND_DIGEST
+from model.scheduler import queue_due_date_emails
+
+
+class NotificationTest(ApiTestCase):
+    '''
+        Cada notificação é registrada uma única vez, e um lembrete novo
+        nunca herda as notificações de um removido.
+    '''
+    def outbox(self, **filters) -> list:
+        return Session().query(EmailOutbox).filter_by(**filters).order_by(EmailOutbox.id).all()
+
+    def test_new_reminder_does_not_reuse_deleted_id(self):
+        '''Criar um lembrete após remover o último não retorna 409'''
+        deleted = self.create('Alpha')['id']
+        self.client.delete(f'/delete?id={deleted}')
+        created = self.create('Completely different')['id']
+        self.assertNotEqual(created, deleted)
+        self.assertEqual([outbox.reminder_id for outbox in self.outbox(kind = KIND_CREATED)],
+                         [deleted, created])
+
+    def test_import_after_deleting_every_reminder(self):
+        '''Exportar, remover todos e importar de novo aceita todas as linhas'''
+        for name in ('Um', 'Dois', 'Tres', 'Quatro'):
+            self.create(name)
+        exported = self.client.get('/export?format=ndjson').get_data()
+        ids = [reminder['id'] for reminder in self.client.get('/reminders').json['reminders']]
+        self.client.delete('/reminders/bulk', json = ids)
+        response = self.client.post('/import?format=ndjson', data = exported,
+                                    content_type = 'application/x-ndjson')
+        self.assertEqual(response.json['accepted'], 4, response.json)
+
+    def test_same_update_queues_one_email(self):
+        '''Repetir a mesma alteração não enfileira outro email'''
+        reminder = self.create('Dentista')
+        form = reminder_form('Dentista', id = reminder['id'], description = 'alterado',
+                             due_date = '2030-01-01T10:00:00')
+        for _ in range(2):
+            self.assertEqual(self.client.put('/update', data = form).status_code, 200)
+        self.assertEqual(len(self.outbox(kind = KIND_UPDATED)), 1)
+
+    def test_digest_is_listed_for_each_reminder(self):
+        '''O resumo do agendador aparece no registro de cada lembrete'''
+        due_date = (datetime.now() + timedelta(hours = 5)).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        ids = [self.create(name, due_date = due_date)['id'] for name in ('Um', 'Dois')]
+        self.assertEqual(queue_due_date_emails(digest = True), 1)
+        for reminder_id in ids:
+            notifications = self.client.get(
+                f'/notifications?reminder_id={reminder_id}&kind={KIND_DIGEST}').json['notifications']
+            self.assertEqual([notification['reminder_ids'] for notification in notifications], [ids])
+        # A second run finds the reminders already notified
+        self.assertEqual(queue_due_date_emails(digest = True), 0)
+
+
+class LegacyDatabaseTest(ApiTestCase):
+    '''
+        Bancos criados antes de AUTOINCREMENT têm a tabela de lembretes
+        recriada, sem reusar ids já registrados na fila de emails.
+    '''
+    def setUp(self):
+        engine = create_engine(f'sqlite:///{self.database_path()}')
+        legacy = Reminder.__table__.to_metadata(MetaData())
+        legacy.dialect_options['sqlite']['autoincrement'] = False
+        with engine.begin() as connection:
+            connection.execute(CreateTable(legacy))
+            Base.metadata.create_all(connection)
+            connection.execute(text(
+                "INSERT INTO reminder (pk_reminder, name, name_normalized, description) "
+                "VALUES (1, 'Antigo', 'antigo', 'antigo')"))
+            connection.execute(text(
+                "INSERT INTO email (email, reminder, created_at) "
+                "VALUES ('a@b.com', 1, CURRENT_TIMESTAMP)"))
+            # Reminder 7 was deleted, but its created email is still logged
+            connection.execute(text(
+                "INSERT INTO email_outbox (reminder_id, kind, email_receiver, payload, status, "
+                "attempts, next_attempt_at, notification_key) "
+                "VALUES (7, 'created', 'a@b.com', '{}', 'sent', 1, CURRENT_TIMESTAMP, '7:created:')"))
+        engine.dispose()
+        super().setUp()
+
+    def test_ids_continue_after_logged_reminders(self):
+        '''O próximo id vem depois do maior id registrado'''
+        self.assertEqual(self.create('Novo')['id'], 8)
+        self.assertEqual(self.client.get('/reminder?id=1').json['name'], 'Antigo')
+        self.assertEqual(self.client.get('/reminders/search?q=antigo').json['reminders'][0]['id'], 1)
@@ -0,0 +1,54 @@
+'''Tests of the NDJSON and CSV export of GET /export'''
+import csv
+import io
+import json
+from tests import ApiTestCase
+from exporter import EXPORT_FIELDS
+
+
+class ExportTest(ApiTestCase):
+    '''
+        A exportação traz todos os lembretes com o email, filtrados pelas
+        datas informadas, e pode ser reimportada.
+    '''
+    def setUp(self):
+        super().setUp()
+        self.ids = [self.create(name, due_date = due_date)['id'] for name, due_date in (
+            ('Dentista', '2030-01-01T10:00:00.000Z'),
+            ('Mecanico', '2030-02-01T10:00:00.000Z'),
+            ('Padaria', '2030-03-01T10:00:00.000Z'))]
+
+    def export(self, query: str = '') -> list:
+        response = self.client.get(f'/export?format=ndjson&{query}')
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        return [json.loads(line) for line in response.get_data().splitlines()]
+
+    def test_ndjson(self):
+        '''Cada linha é um lembrete com todos os campos exportados'''
+        rows = self.export()
+        self.assertEqual([row['id'] for row in rows], self.ids)
+        self.assertEqual(tuple(rows[0]), EXPORT_FIELDS)
+        self.assertEqual((rows[0]['email'], rows[0]['due_date']),
+                         ('lembrete@email.com', '2030-01-01T10:00:00.000Z'))
+
+    def test_csv(self):
+        '''O CSV tem cabeçalho com os campos exportados'''
+        response = self.client.get('/export?format=csv')
+        self.assertEqual(response.headers['Content-Disposition'], 'attachment; filename=reminders.csv')
+        rows = list(csv.DictReader(io.StringIO(response.get_data(as_text = True))))
+        self.assertEqual([row['name'] for row in rows], ['Dentista', 'Mecanico', 'Padaria'])
+        self.assertEqual(tuple(rows[0]), EXPORT_FIELDS)
+
+    def test_filters(self):
+        '''due_from, due_to e updated_since restringem as linhas'''
+        rows = self.export('due_from=2030-01-15T00:00:00.000Z&due_to=2030-02-15T00:00:00')
+        self.assertEqual([row['name'] for row in rows], ['Mecanico'])
+        self.assertEqual(self.export('updated_since=2999-01-01T00:00:00'), [])
+
+    def test_reimport(self):
+        '''O CSV exportado é reimportado sem erros após remover os lembretes'''
+        exported = self.client.get('/export?format=csv').get_data()
+        self.client.delete('/reminders/bulk', json = self.ids)
+        summary = self.client.post('/import', data = exported, content_type = 'text/csv').json
+        self.assertEqual((summary['accepted'], summary['errors']), (3, []))
+        self.assertEqual([row['name'] for row in self.export()], ['Dentista', 'Mecanico', 'Padaria'])
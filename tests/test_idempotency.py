@@ -0,0 +1,82 @@
+'''Tests of the Idempotency-Key support of the write routes'''
+import io
+import json
+from unittest import mock
+from tests import ApiTestCase, reminder_form, DUE_DATE
+
+
+def ndjson(*names: str) -> bytes:
+    '''
+        Arquivo NDJSON da rota /import com um lembrete por nome.
+    '''
+    return b''.join(json.dumps({'name': name, 'description': 'importado', 'due_date': DUE_DATE,
+                                'email': 'a@b.com'}).encode() + b'\n' for name in names)
+
+
+class IdempotencyKeyTest(ApiTestCase):
+    '''
+        Repetições com a mesma chave recebem a resposta salva, e a chave
+        reusada em outra requisição é recusada.
+    '''
+    def post(self, path: str, key: str, **kwargs):
+        return self.client.post(path, headers = {'Idempotency-Key': key}, **kwargs)
+
+    def reminder_count(self) -> int:
+        return len(self.client.get('/reminders').json['reminders'])
+
+    def test_retry_replays_response(self):
+        '''A repetição não cria outro lembrete'''
+        first = self.post('/create', 'chave', data = reminder_form('Dentista'))
+        retry = self.post('/create', 'chave', data = reminder_form('Dentista'))
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json, first.json)
+        self.assertEqual(self.reminder_count(), 1)
+
+    def test_key_reused_with_other_form(self):
+        '''A chave reusada com outro formulário retorna 422'''
+        self.post('/create', 'chave', data = reminder_form('Dentista'))
+        response = self.post('/create', 'chave', data = reminder_form('Mecanico'))
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.reminder_count(), 1)
+
+    def test_key_reused_with_other_import_file(self):
+        '''A chave reusada com outro arquivo em /import retorna 422'''
+        path = '/import?format=ndjson'
+        first = self.post(path, 'chave', data = ndjson('Um'), content_type = 'application/x-ndjson')
+        retry = self.post(path, 'chave', data = ndjson('Um'), content_type = 'application/x-ndjson')
+        other = self.post(path, 'chave', data = ndjson('Dois'), content_type = 'application/x-ndjson')
+        self.assertEqual(first.json['accepted'], 1)
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(other.status_code, 422)
+
+    def test_key_reused_with_other_uploaded_file(self):
+        '''A chave reusada com outro arquivo de formulário retorna 422'''
+        def upload(*names):
+            return self.post('/import', 'chave', content_type = 'multipart/form-data',
+                             data = {'file': (io.BytesIO(ndjson(*names)), 'lembretes.ndjson')})
+        self.assertEqual(upload('Um').json['accepted'], 1)
+        self.assertEqual(upload('Um').headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(upload('Dois').status_code, 422)
+        self.assertEqual(self.reminder_count(), 1)
+
+    def test_failed_write_can_be_retried(self):
+        '''Uma escrita que falha com 4xx é salva e repetida sem 500 nem 409'''
+        self.create('Dentista')
+        reminder_id = self.create('Mecanico')['id']
+        form = reminder_form('Dentista', id = reminder_id, due_date = '2030-01-01T10:00:00')
+        for _ in range(2):
+            response = self.client.put('/update', data = form, headers = {'Idempotency-Key': 'chave'})
+            self.assertEqual(response.status_code, 400, response.get_data(as_text = True))
+        self.assertEqual(response.headers['Idempotent-Replayed'], 'true')
+
+    def test_uncommitted_changes_are_not_saved(self):
+        '''As alterações não confirmadas pela rota não são gravadas com a resposta'''
+        reminder_id = self.create('Dentista')['id']
+        form = reminder_form('Dentista', id = reminder_id, description = 'nova',
+                             due_date = '2030-01-01T10:00:00')
+        with mock.patch('app.queue_notifications', side_effect = ValueError('falha')):
+            response = self.client.put('/update', data = form, headers = {'Idempotency-Key': 'chave'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(f'/reminder?id={reminder_id}').json['description'],
+                         'descrição de Dentista')
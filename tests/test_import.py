@@ -0,0 +1,53 @@
+'''Tests of the NDJSON and CSV import of POST /import'''
+import io
+from tests import ApiTestCase
+
+
+class ImportTest(ApiTestCase):
+    '''
+        As linhas válidas são gravadas e as inválidas informadas no resumo
+        pelo número da linha.
+    '''
+    CSV = ('name,description,due_date,email,send_email\n'
+           'Dentista,limpeza,2030-01-01T10:00:00.000Z,a@b.com,true\n'
+           'Lembrete 2,numero no nome,2030-01-01T10:00:00.000Z,a@b.com,true\n'
+           'Mecanico,revisão,2030-01-02T10:00:00.000Z,a@b.com,false\n'
+           'dentista,repetido,2030-01-01T10:00:00.000Z,a@b.com,true\n')
+    NDJSON = ('{"name": "Dentista", "description": "limpeza", "due_date": "2030-01-01T10:00:00.000Z"}\n'
+              '\n'
+              '{"name": "Mecanico", "description": \n'
+              '{"name": "Padaria", "description": "pao", "due_date": "2030-01-01T10:00:00.000Z"}\n')
+
+    def post(self, path: str, body: str, content_type: str):
+        response = self.client.post(path, data = body.encode(), content_type = content_type)
+        self.assertEqual(response.status_code, 200, response.get_data(as_text = True))
+        return response.json
+
+    def names(self) -> list:
+        return [reminder['name'] for reminder in self.client.get('/reminders').json['reminders']]
+
+    def test_csv(self):
+        '''Linhas inválidas ou duplicadas do CSV são rejeitadas'''
+        summary = self.post('/import', self.CSV, 'text/csv')
+        self.assertEqual((summary['total'], summary['accepted'], summary['rejected']), (4, 2, 2))
+        self.assertEqual([error['line'] for error in summary['errors']], [3, 5])
+        self.assertEqual(self.names(), ['Dentista', 'Mecanico'])
+
+    def test_ndjson(self):
+        '''Linhas vazias são ignoradas e JSON inválido é rejeitado'''
+        summary = self.post('/import?format=ndjson&chunk_size=1', self.NDJSON, 'application/x-ndjson')
+        self.assertEqual((summary['total'], summary['accepted'], summary['rejected']), (3, 2, 1))
+        self.assertEqual(summary['errors'][0]['line'], 3)
+        self.assertTrue(summary['errors'][0]['mensagem'].startswith('JSON inválido'))
+        self.assertEqual(self.names(), ['Dentista', 'Padaria'])
+
+    def test_uploaded_file_format_from_name(self):
+        '''O formato do arquivo enviado em formulário vem da extensão'''
+        summary = self.client.post('/import', content_type = 'multipart/form-data', data = {
+            'file': (io.BytesIO(self.CSV.encode()), 'lembretes.csv')}).json
+        self.assertEqual(summary['accepted'], 2)
+
+    def test_invalid_chunk_size(self):
+        '''chunk_size fora do intervalo permitido retorna 422'''
+        response = self.client.post('/import?chunk_size=0', data = b'', content_type = 'text/csv')
+        self.assertEqual(response.status_code, 422)
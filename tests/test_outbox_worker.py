@@ -0,0 +1,70 @@
+'''Tests of the outbox worker: claims, retries and backoff'''
+import smtplib
+from datetime import datetime, timedelta
+from unittest import mock
+from tests import ApiTestCase
+from model import Session, EmailOutbox
+from model.email_outbox import STATUS_PENDING, STATUS_SENDING, STATUS_SENT, STATUS_FAILED
+from model.outbox_worker import OutboxWorker, outbox_settings, backoff_delay
+
+
+class OutboxWorkerTest(ApiTestCase):
+    '''
+        Reserva, reenvio com espera exponencial e descarte dos emails da
+        fila.
+    '''
+    def setUp(self):
+        super().setUp()
+        self.worker = OutboxWorker()
+        self.reminder_id = self.create('Dentista')['id']
+
+    def queued(self) -> EmailOutbox:
+        Session.remove()
+        return Session().query(EmailOutbox).filter_by(reminder_id = self.reminder_id).one()
+
+    def drain(self, error: Exception = None) -> int:
+        with mock.patch('model.outbox_worker.send_outbox_emails',
+                        side_effect = lambda batch: [error] * len(batch)):
+            return self.worker.drain_once()
+
+    def test_sent(self):
+        '''Um email enviado é marcado como enviado e não é reservado de novo'''
+        self.assertEqual(self.drain(), 1)
+        outbox = self.queued()
+        self.assertEqual((outbox.status, outbox.attempts), (STATUS_SENT, 1))
+        self.assertIsNotNone(outbox.sent_at)
+        self.assertEqual(self.drain(), 0)
+
+    def test_failure_is_retried_later(self):
+        '''Uma falha reagenda o email com espera exponencial'''
+        started = datetime.now()
+        self.assertEqual(self.drain(smtplib.SMTPException('indisponível')), 1)
+        outbox = self.queued()
+        self.assertEqual((outbox.status, outbox.attempts), (STATUS_PENDING, 1))
+        self.assertEqual(outbox.last_error, 'indisponível')
+        self.assertGreaterEqual(outbox.next_attempt_at, started + backoff_delay(1))
+        # Not due yet
+        self.assertEqual(self.drain(), 0)
+
+    def test_failed_after_max_attempts(self):
+        '''O email é descartado após OUTBOX_MAX_ATTEMPTS falhas'''
+        session = Session()
+        session.query(EmailOutbox).update({'attempts': outbox_settings()['max_attempts'] - 1})
+        session.commit()
+        self.drain(smtplib.SMTPException('indisponível'))
+        self.assertEqual(self.queued().status, STATUS_FAILED)
+
+    def test_stale_claim_is_taken_over(self):
+        '''Um email reservado por um worker que parou volta a ser enviado'''
+        session = Session()
+        session.query(EmailOutbox).update({
+            'status': STATUS_SENDING,
+            'next_attempt_at': datetime.now() - timedelta(seconds = outbox_settings()['claim_timeout'] + 1)})
+        session.commit()
+        self.assertEqual(self.drain(), 1)
+        self.assertEqual(self.queued().status, STATUS_SENT)
+
+    def test_backoff_is_capped(self):
+        '''A espera dobra a cada tentativa, até o limite'''
+        self.assertEqual(backoff_delay(2), 2 * backoff_delay(1))
+        self.assertEqual(backoff_delay(100), backoff_delay(200))
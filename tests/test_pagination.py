@@ -0,0 +1,77 @@
+'''Tests of the keyset pagination and streaming of GET /reminders'''
+import json
+from tests import ApiTestCase, reminder_form
+
+
+class PaginationTest(ApiTestCase):
+    '''
+        As páginas seguem a ordem pedida, sem repetir nem pular lembretes,
+        e um cursor inválido é recusado.
+    '''
+    DUE_DATES = ('2030-01-03T10:00:00.000Z', '2030-01-01T10:00:00.000Z',
+                 '2030-01-02T10:00:00.000Z', '2030-01-01T10:00:00.000Z',
+                 '2030-01-05T10:00:00.000Z')
+
+    def setUp(self):
+        super().setUp()
+        response = self.client.post('/reminders/bulk', json = [
+            reminder_form(f'Lembrete {chr(65 + index)}', due_date = due_date, send_email = False)
+            for index, due_date in enumerate(self.DUE_DATES)])
+        self.ids = response.json['ids']
+        self.assertEqual(len(self.ids), len(self.DUE_DATES))
+
+    def walk(self, **params) -> list:
+        '''
+            Percorre todas as páginas e retorna os lembretes na ordem recebida.
+        '''
+        reminders, cursor = [], None
+        while True:
+            query = '&'.join(f'{name}={value}' for name, value in params.items())
+            if cursor:
+                query += f'&cursor={cursor}'
+            page = self.client.get(f'/reminders?{query}').json
+            self.assertLessEqual(len(page['reminders']), params.get('page_size', 100))
+            reminders += page['reminders']
+            cursor = page['next_cursor']
+            if cursor is None:
+                return reminders
+
+    def test_pages_by_id(self):
+        '''As páginas por id cobrem todos os lembretes em ordem crescente'''
+        reminders = self.walk(page_size = 2)
+        self.assertEqual([reminder['id'] for reminder in reminders], self.ids)
+
+    def test_pages_by_due_date(self):
+        '''Por due_date, empates são ordenados pelo id'''
+        reminders = self.walk(page_size = 2, order_by = 'due_date')
+        expected = sorted(zip(self.DUE_DATES, self.ids))
+        self.assertEqual([reminder['id'] for reminder in reminders],
+                         [reminder_id for _, reminder_id in expected])
+
+    def test_reminder_created_between_pages(self):
+        '''Um lembrete criado durante a paginação aparece no fim, sem repetições'''
+        page = self.client.get('/reminders?page_size=3').json
+        created = self.create('Novo')['id']
+        rest = self.client.get(f"/reminders?page_size=100&cursor={page['next_cursor']}").json
+        self.assertEqual([reminder['id'] for reminder in page['reminders'] + rest['reminders']],
+                         self.ids + [created])
+
+    def test_invalid_cursor(self):
+        '''Um cursor que não foi gerado pela listagem retorna 400'''
+        for cursor in ('bm9wZQ==', '***'):
+            response = self.client.get(f'/reminders?cursor={cursor}')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json['mensagem'], 'Cursor de paginação inválido.')
+        response = self.client.get('/reminders?order_by=due_date&cursor=MTI=')
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_page_size(self):
+        '''page_size fora do intervalo permitido retorna 422'''
+        self.assertEqual(self.client.get('/reminders?page_size=0').status_code, 422)
+
+    def test_stream(self):
+        '''Com stream=true, todos os lembretes a partir do cursor vêm em uma resposta'''
+        cursor = self.client.get('/reminders?page_size=2').json['next_cursor']
+        body = json.loads(self.client.get(f'/reminders?stream=true&cursor={cursor}').get_data())
+        self.assertEqual([reminder['id'] for reminder in body['reminders']], self.ids[2:])
+        self.assertIsNone(body['next_cursor'])
@@ -0,0 +1,90 @@
+'''Tests of the recurrence rules and of the routes that update them'''
+import unittest
+from datetime import datetime
+from sqlalchemy import event
+from tests import ApiTestCase, reminder_form
+from model import Session
+from model.reminder import Reminder
+from model.recurrence import add_months, next_occurrence, first_due_at
+from model.scheduler import advance_recurring
+
+
+class RecurringUpdateTest(ApiTestCase):
+    '''
+        Lembretes recorrentes aceitam datas com o sufixo Z nas rotas de
+        alteração.
+    '''
+    def test_update(self):
+        '''PUT /update com data em UTC recalcula a próxima ocorrência'''
+        reminder_id = self.create('Dentista', recurrence = 'weekly',
+                                  due_date = '2020-01-01T10:00:00.000Z')['id']
+        response = self.client.put('/update', data = reminder_form(
+            'Dentista', id = reminder_id, recurrence = 'weekly',
+            due_date = '2021-01-01T10:00:00.000Z'))
+        self.assertEqual(response.status_code, 200, response.json)
+
+    def test_bulk_update(self):
+        '''PUT /reminders/bulk com data em UTC não falha'''
+        reminder_id = self.create('Dentista', recurrence = 'monthly')['id']
+        response = self.client.put('/reminders/bulk', json = [
+            {'id': reminder_id, 'due_date': '2021-01-31T10:00:00.000Z'}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['errors'], [])
+
+
+class AdvanceRecurringTest(ApiTestCase):
+    '''
+        O agendador avança apenas os lembretes recorrentes vencidos, lidos
+        pelo índice parcial sem percorrer os lembretes únicos.
+    '''
+    def test_advances_only_recurring(self):
+        '''Lembretes únicos vencidos não são lidos nem alterados'''
+        for name in ('Dentista', 'Mecanico'):
+            self.create(name, send_email = False, due_date = '2020-01-01T10:00:00.000Z')
+        recurring_id = self.create('Padaria', send_email = False, recurrence = 'daily',
+                                   due_date = '2020-01-01T10:00:00.000Z')['id']
+        session = Session()
+        statements = []
+        def capture(connection, cursor, statement, parameters, context, executemany):
+            if statement.startswith('SELECT'):
+                statements.append((statement, parameters))
+
+        event.listen(session.get_bind(), 'before_cursor_execute', capture)
+        try:
+            self.assertEqual(advance_recurring(session, datetime(2030, 1, 1)), 1)
+            session.commit()
+        finally:
+            event.remove(session.get_bind(), 'before_cursor_execute', capture)
+        statement, parameters = statements[0]
+        plan = session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+        self.assertIn('ix_reminder_recurring_next_due_at', plan[0][-1])
+        self.assertEqual([reminder.id for reminder in session.query(Reminder)
+                          .filter(Reminder.next_due_at > datetime(2030, 1, 1))], [recurring_id])
+        Session.remove()
+
+
+class RecurrenceTest(unittest.TestCase):
+    '''
+        Cálculo das ocorrências das regras de recorrência.
+    '''
+    def test_add_months_clamps_day(self):
+        '''O dia é limitado ao último dia do mês'''
+        self.assertEqual(add_months(datetime(2024, 1, 31), 1), datetime(2024, 2, 29))
+        self.assertEqual(add_months(datetime(2023, 11, 30), 3), datetime(2024, 2, 29))
+
+    def test_next_occurrence(self):
+        '''A próxima ocorrência é a primeira posterior à data informada'''
+        due_date = datetime(2024, 1, 31, 10)
+        after = datetime(2024, 3, 10)
+        self.assertEqual(next_occurrence(due_date, 'daily', 3, after), datetime(2024, 3, 10, 10))
+        self.assertEqual(next_occurrence(due_date, 'weekly', 2, after), datetime(2024, 3, 13, 10))
+        self.assertEqual(next_occurrence(due_date, 'monthly', 1, after), datetime(2024, 3, 31, 10))
+        self.assertEqual(next_occurrence(due_date, 'monthly', 2, after), datetime(2024, 3, 31, 10))
+
+    def test_first_due_at(self):
+        '''Lembretes futuros ou sem recorrência mantêm a due_date'''
+        now = datetime(2024, 3, 10)
+        future = datetime(2024, 4, 1)
+        self.assertEqual(first_due_at(future, 'daily', 1, now), future)
+        self.assertEqual(first_due_at(datetime(2024, 1, 1), None, 1, now), datetime(2024, 1, 1))
+        self.assertEqual(first_due_at(datetime(2024, 1, 1), 'weekly', 1, now), datetime(2024, 3, 11))
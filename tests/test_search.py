@@ -0,0 +1,57 @@
+'''Tests of the full text search of GET /reminders/search'''
+from unittest import mock
+from tests import ApiTestCase, reminder_form
+
+
+class SearchTest(ApiTestCase):
+    '''
+        A busca ignora acentos e maiúsculas, ordena por relevância e segue
+        as alterações dos lembretes.
+    '''
+    def search(self, terms: str, **params) -> list:
+        query = '&'.join(f'{name}={value}' for name, value in params.items())
+        response = self.client.get(f'/reminders/search?q={terms}&{query}')
+        self.assertEqual(response.status_code, 200)
+        return [reminder['name'] for reminder in response.json['reminders']]
+
+    def test_accents_and_case(self):
+        '''Acentos e maiúsculas não diferenciam os resultados'''
+        self.create('Consulta', description = 'Médico às Três')
+        self.create('Cafe', description = 'reunião')
+        self.assertEqual(self.search('MEDICO tres'), ['Consulta'])
+        self.assertEqual(self.search('café'), ['Cafe'])
+        self.assertEqual(self.search('reuniao'), ['Cafe'])
+
+    def test_prefix(self):
+        '''Com prefix=false, apenas palavras completas correspondem'''
+        self.create('Dentista')
+        self.assertEqual(self.search('dent'), ['Dentista'])
+        self.assertEqual(self.search('dent', prefix = 'false'), [])
+
+    def test_name_ranks_first(self):
+        '''Correspondências no nome vêm antes das na descrição'''
+        self.create('Oficina', description = 'levar o carro')
+        self.create('Carro', description = 'revisão')
+        self.assertEqual(self.search('carro'), ['Carro', 'Oficina'])
+        self.assertEqual(self.search('carro', limit = 1), ['Carro'])
+
+    def test_follows_updates_and_deletes(self):
+        '''Alterações e remoções são refletidas no índice'''
+        reminder_id = self.create('Dentista', description = 'limpeza')['id']
+        self.client.put('/update', data = reminder_form(
+            'Dentista', id = reminder_id, description = 'canal', due_date = '2030-01-01T10:00:00'))
+        self.assertEqual(self.search('limpeza'), [])
+        self.assertEqual(self.search('canal'), ['Dentista'])
+        self.client.delete(f'/delete?id={reminder_id}')
+        self.assertEqual(self.search('canal'), [])
+
+    def test_without_words(self):
+        '''Uma busca sem palavras não retorna lembretes'''
+        self.create('Dentista')
+        self.assertEqual(self.search('%2A%22'), [])
+
+    def test_other_databases(self):
+        '''Sem o índice do SQLite, a busca retorna 501'''
+        with mock.patch('app.has_search_index', return_value = False):
+            response = self.client.get('/reminders/search?q=dentista')
+        self.assertEqual(response.status_code, 501)
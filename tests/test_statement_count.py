@@ -0,0 +1,44 @@
+'''Tests of the SQL statement count reported in X-SQL-Statements'''
+from tests import ApiTestCase, reminder_form
+
+
+class StatementCountTest(ApiTestCase):
+    '''
+        As listagens executam a mesma quantidade de comandos SQL qualquer
+        que seja a quantidade de lembretes retornados.
+    '''
+    # Streamed responses are counted only up to the headers, so they are
+    # left out
+    ROUTES = (
+        '/reminders?page_size=100',
+        '/reminders/search?q=descricao',
+        '/reminders/upcoming?start=2029-12-31T00:00:00&end=2030-01-02T00:00:00',
+        '/changes?limit=100',
+    )
+
+    def add_reminders(self, first: int, count: int) -> None:
+        names = [f'Lembrete {chr(65 + index // 26)}{chr(65 + index % 26)}'
+                 for index in range(first, first + count)]
+        response = self.client.post('/reminders/bulk', json = [
+            reminder_form(name, send_email = False) for name in names])
+        self.assertEqual(len(response.json['ids']), count)
+
+    def statements(self, path: str) -> int:
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200, path)
+        response.get_data()
+        return int(response.headers['X-SQL-Statements'])
+
+    def test_listing_statements_do_not_grow_with_reminders(self):
+        '''Listar 3 ou 60 lembretes executa os mesmos comandos SQL'''
+        self.add_reminders(0, 3)
+        few = {path: self.statements(path) for path in self.ROUTES}
+        self.add_reminders(3, 57)
+        many = {path: self.statements(path) for path in self.ROUTES}
+        self.assertEqual(few, many)
+
+    def test_reminder_read_statements(self):
+        '''A leitura de um lembrete usa poucos comandos e nenhum em cache'''
+        reminder_id = self.create('Consulta')['id']
+        self.assertLessEqual(self.statements(f'/reminder?id={reminder_id}'), 2)
+        self.assertEqual(self.statements(f'/reminder?id={reminder_id}'), 0)
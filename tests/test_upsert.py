@@ -0,0 +1,43 @@
+'''Tests of the upsert mode of the create routes'''
+from tests import ApiTestCase, reminder_form
+from model import Session, EmailOutbox
+
+
+class UpsertTest(ApiTestCase):
+    '''
+        Com upsert=true, o lembrete de mesmo nome é atualizado, e nada é
+        gravado se ele já tiver os valores enviados.
+    '''
+    def outbox_count(self) -> int:
+        return Session().query(EmailOutbox).count()
+
+    def test_duplicate_name_without_upsert(self):
+        '''Sem upsert, um nome duplicado retorna 409'''
+        self.create('Dentista')
+        response = self.client.post('/create', data = reminder_form('Dentista'))
+        self.assertEqual(response.status_code, 409)
+
+    def test_unchanged_upsert_writes_nothing(self):
+        '''Reenviar os mesmos valores não grava nem envia email'''
+        reminder_id = self.create('Dentista')['id']
+        cursor = self.client.get('/changes').json['next_cursor']
+        emails = self.outbox_count()
+        response = self.client.post('/create?upsert=true', data = reminder_form('Dentista'))
+        self.assertEqual(response.json['id'], reminder_id)
+        self.assertEqual(self.outbox_count(), emails)
+        self.assertEqual(self.client.get(f'/changes?since={cursor}').json['changes'], [])
+
+    def test_changed_upsert_updates(self):
+        '''Valores diferentes atualizam o lembrete de mesmo nome'''
+        reminder_id = self.create('Dentista')['id']
+        response = self.client.post('/create?upsert=true',
+                                    data = reminder_form('Dentista', description = 'nova'))
+        self.assertEqual((response.json['id'], response.json['description']), (reminder_id, 'nova'))
+
+    def test_bulk_upsert(self):
+        '''O upsert em lote separa os lembretes gravados dos inalterados'''
+        kept = self.create('Dentista')['id']
+        response = self.client.post('/reminders/bulk?upsert=true', json = [
+            reminder_form('Dentista'), reminder_form('Mecanico')])
+        self.assertEqual(response.json['unchanged'], [kept])
+        self.assertEqual(len(response.json['ids']), 1)